@@ -1,12 +1,20 @@
 import streamlit as st
-import pandas as pd
-from db_utils import fetch_data
+from alerting import start_alerting
+from log_writer import get_log_writer
+from predictor import get_predictor
+from vehicle_index import get_vehicle_index, get_watchlist
+
+NOT_RECORDED = "Not recorded"
 
 def show_add_log():
     st.title("📝 Add New Police Log")
 
-    # Fetch the traffic stop data
-    data = fetch_data("SELECT * FROM traffic_stops")
+    # Outcome/violation counts per (gender, age, search, duration, drugs), kept current from new stops
+    model = get_predictor()
+    if model.last_error:
+        st.warning(f"Predictor: {model.last_error}")
+    # Logs entered from here on are checked against the alert rules
+    start_alerting()
 
     # Main form for input
     with st.form("new_log_form"):
@@ -19,7 +27,10 @@ def show_add_log():
         search_conducted = st.selectbox("Was a Search Conducted?", ["0", "1"])
         search_type = st.text_input("Search Type")  # Added Search Type input
         drugs_related_stop = st.selectbox("Was it Drug Related?", ["0", "1"])
-        stop_duration = st.selectbox("Stop Duration", data['stop_duration'].dropna().unique())
+        stop_duration = st.selectbox("Stop Duration", model.stop_durations())
+        # What actually happened; left as NULL when not known. The prediction is only shown.
+        violation = st.selectbox("Violation", [NOT_RECORDED] + model.class_labels("violation"))
+        stop_outcome = st.selectbox("Stop Outcome", [NOT_RECORDED] + model.class_labels("outcome"))
         vehicle_number = st.text_input("Vehicle Number")
 
         submitted = st.form_submit_button("Submit")
@@ -35,32 +46,67 @@ def show_add_log():
         elif driver_gender == "Female":
             driver_gender_match = "F"
         
-        filtered_data = data[
-            (data['driver_gender'].str.lower() == driver_gender_match.lower()) &
-            (data['driver_age'] == driver_age) &
-            (data['search_conducted'] == search_conducted_int) &
-            (data['stop_duration'].str.lower() == stop_duration.lower()) &
-            (data['drugs_related_stop'] == drugs_related_stop_int)
-        ]
-        
-        # Use mode of matching data
-        if not filtered_data.empty:
-            predicted_outcome = filtered_data['stop_outcome'].mode()[0]
-            predicted_violation = filtered_data['violation'].mode()[0]
-        else:
-            predicted_outcome = "warning"
-            predicted_violation = "speeding"
-        
+        # Most likely outcome/violation, backing off to similar stops when few match exactly
+        predicted_outcome, predicted_violation, _ = model.predict(
+            driver_gender_match, driver_age, search_conducted_int, stop_duration, drugs_related_stop_int
+        )
+
+        # Queue the log for a batched insert; violation and outcome are what the officer entered
+        violation = None if violation == NOT_RECORDED else violation
+        stop_outcome = None if stop_outcome == NOT_RECORDED else stop_outcome
+        log_record = {
+            "stop_date": stop_date.isoformat(),
+            "stop_time": stop_time.strftime("%H:%M"),
+            "country_name": county_name,
+            "driver_gender": driver_gender_match,
+            "driver_age_raw": int(driver_age),
+            "driver_age": int(driver_age),
+            "driver_race": driver_race,
+            "violation_raw": violation,
+            "violation": violation,
+            "search_conducted": search_conducted_int,
+            "search_type": search_type if search_type else "None",
+            "stop_outcome": stop_outcome,
+            "is_arrested": None if stop_outcome is None else int("arrest" in stop_outcome.lower()),
+            "stop_duration": stop_duration,
+            "drugs_related_stop": drugs_related_stop_int,
+            "vehicle_number": vehicle_number,
+            "timestamp": f"{stop_date.isoformat()} {stop_time.strftime('%H:%M:%S')}",
+        }
+        writer = get_log_writer()
+        writer.submit(log_record)
+
+        # Flag watchlisted vehicles and repeat offenders before anything else
+        for hit in get_watchlist().match(vehicle_number):
+            st.error(f"🚨 Vehicle {vehicle_number} is on the watchlist: {hit['reason'] or 'no reason given'}")
+        previous = get_vehicle_index().lookup(vehicle_number, with_history=False)
+        if previous:
+            st.info(
+                f"🚘 {previous['vehicle_number']} has {previous['stops']} previous stops "
+                f"({previous['searches']} searched, {previous['drug_stops']} drug-related), "
+                f"last seen {previous['last_seen'] or 'at an unknown time'}."
+            )
+
         # Show success message
         try:
             st.toast("✅ Prediction complete. See summary below.", icon="🔍")
         except AttributeError:
             st.success("✅ Prediction complete. See summary below.")
+
+        writer_stats = writer.stats()
+        st.caption(
+            f"Log queued for saving ({writer_stats['pending']} pending, {writer_stats['written']} written this session)."
+        )
+        if writer_stats["dead_letters"]:
+            st.error(f"{writer_stats['dead_letters']} logs were rejected by the database and kept in "
+                     f"{writer.dead_letter_path} for review.")
+        elif writer_stats["last_error"]:
+            st.warning(f"Database write delayed, will retry automatically: {writer_stats['last_error']}")
         
         # Display prediction results
         with st.expander("🚔 **View Prediction Summary**", expanded=False):
-            st.markdown(f"**Violation:** {predicted_violation}")
-            st.markdown(f"**Stop Outcome:** {predicted_outcome}")
+            st.markdown(f"**Predicted Violation:** {predicted_violation}")
+            st.markdown(f"**Predicted Stop Outcome:** {predicted_outcome}")
             
             summary_1 = (
                 f"On {stop_date.strftime('%B %d, %Y')} at {stop_time.strftime('%I:%M %p')}, "
@@ -0,0 +1,379 @@
+# Real-time alerts over newly logged stops. The engine subscribes to the table mirror,
+# so it sees every row above the id high-water mark once, whether it came from the Add
+# Log writer (which refreshes the mirror after each flush) or from anything else writing
+# to traffic_stops. Rules keep sliding-window state keyed by stop time that is updated per
+# event in O(1) amortized time: nothing re-reads history.
+#
+#   python alerting.py --sqlite securecheck.db     # replay a database through the rules
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from table_mirror import get_table_mirror
+from vehicle_index import IGNORED_PLATES, get_watchlist, normalize_plate
+
+# Same vehicle stopped this many times within the window
+REPEAT_STOPS = int(os.environ.get("SECURECHECK_ALERT_REPEAT_STOPS", "3"))
+REPEAT_WINDOW = float(os.environ.get("SECURECHECK_ALERT_REPEAT_WINDOW", "3600"))
+# Drug-related stops in a country within the window, against a moving average of past windows
+SPIKE_WINDOW = float(os.environ.get("SECURECHECK_ALERT_SPIKE_WINDOW", "3600"))
+SPIKE_FACTOR = float(os.environ.get("SECURECHECK_ALERT_SPIKE_FACTOR", "3.0"))
+SPIKE_MIN_STOPS = int(os.environ.get("SECURECHECK_ALERT_SPIKE_MIN_STOPS", "5"))
+# Weight of the latest window in the baseline, and windows seen before a spike can be called
+SPIKE_SMOOTHING = 0.1
+SPIKE_WARMUP_WINDOWS = 24
+# Stop times are typed in on the Add Log form; one dated in the future would hold every window
+# open at that time and make all real stops look late, so times are capped at now plus this
+MAX_FUTURE_SECONDS = float(os.environ.get("SECURECHECK_ALERT_MAX_FUTURE_SECONDS", "300"))
+MAX_ALERTS = int(os.environ.get("SECURECHECK_MAX_ALERTS", "500"))
+POLL_INTERVAL = float(os.environ.get("SECURECHECK_ALERT_POLL_INTERVAL", "5"))
+
+
+class Event:
+    __slots__ = ("id", "seconds", "plate", "vehicle_number", "country", "drugs")
+
+    def __init__(self, id, seconds, vehicle_number, country, drugs):
+        self.id = id
+        # Stop time in epoch seconds; None when the row has no timestamp
+        self.seconds = seconds
+        self.vehicle_number = vehicle_number
+        self.plate = normalize_plate(vehicle_number)
+        if self.plate in IGNORED_PLATES:
+            self.plate = ""
+        self.country = country
+        self.drugs = drugs
+
+
+class RepeatVehicleRule:
+    # Arrival-ordered window of (stop time, plate) plus a count per plate. Each event is
+    # appended once and expired once. Events older than the window when they arrive are late.
+    name = "repeat_vehicle"
+
+    def __init__(self, stops=REPEAT_STOPS, window=REPEAT_WINDOW):
+        self.stops = stops
+        self.window = window
+        self.horizon = window
+        self.reset()
+
+    def reset(self):
+        self._events = deque()
+        self._counts = {}
+        self._alerted = {}
+        self._latest = -math.inf
+
+    def _expire(self, cutoff):
+        while self._events and self._events[0][0] <= cutoff:
+            _, plate = self._events.popleft()
+            self._counts[plate] -= 1
+            if not self._counts[plate]:
+                del self._counts[plate]
+                self._alerted.pop(plate, None)
+
+    def evaluate(self, event):
+        if not event.plate or event.seconds is None:
+            return None
+        self._latest = max(self._latest, event.seconds)
+        cutoff = self._latest - self.window
+        self._expire(cutoff)
+        if event.seconds <= cutoff:
+            return None
+        self._events.append((event.seconds, event.plate))
+        count = self._counts.get(event.plate, 0) + 1
+        self._counts[event.plate] = count
+        last = self._alerted.get(event.plate)
+        if count >= self.stops and (last is None or event.seconds - last >= self.window):
+            self._alerted[event.plate] = event.seconds
+            return f"Vehicle {event.vehicle_number} stopped {count} times within {self.window / 60:.0f} minutes"
+        return None
+
+
+class _CountryWindow:
+    __slots__ = ("stops", "latest", "bucket", "bucket_count", "baseline", "buckets_seen", "spiking")
+
+    def __init__(self, bucket):
+        self.stops = deque()
+        self.latest = -math.inf
+        self.bucket = bucket
+        self.bucket_count = 0
+        self.baseline = 0.0
+        self.buckets_seen = 0
+        self.spiking = False
+
+
+class DrugSpikeRule:
+    # Per country: drug-related stops in the sliding window, and an exponential moving
+    # average of the count per fixed window as the baseline. Windows without drug stops
+    # are folded in when the next one arrives (one pow() however many were skipped).
+    name = "drug_spike"
+
+    def __init__(self, window=SPIKE_WINDOW, factor=SPIKE_FACTOR, min_stops=SPIKE_MIN_STOPS,
+                 smoothing=SPIKE_SMOOTHING, warmup=SPIKE_WARMUP_WINDOWS):
+        self.window = window
+        self.factor = factor
+        self.min_stops = min_stops
+        self.smoothing = smoothing
+        self.warmup = warmup
+        self.horizon = window * warmup * 2
+        self.reset()
+
+    def reset(self):
+        self._countries = {}
+
+    def evaluate(self, event):
+        if not event.drugs or event.seconds is None:
+            return None
+        bucket = int(event.seconds // self.window)
+        state = self._countries.get(event.country)
+        if state is None:
+            state = self._countries[event.country] = _CountryWindow(bucket)
+        if bucket > state.bucket:
+            keep = 1 - self.smoothing
+            state.baseline = (keep * state.baseline + self.smoothing * state.bucket_count) * keep ** (bucket - state.bucket - 1)
+            state.buckets_seen += bucket - state.bucket
+            state.bucket = bucket
+            state.bucket_count = 0
+        if bucket == state.bucket:
+            state.bucket_count += 1
+
+        state.latest = max(state.latest, event.seconds)
+        cutoff = state.latest - self.window
+        while state.stops and state.stops[0] <= cutoff:
+            state.stops.popleft()
+        if event.seconds <= cutoff:
+            return None
+        state.stops.append(event.seconds)
+        count = len(state.stops)
+        threshold = self.factor * state.baseline
+        if state.buckets_seen < self.warmup or count < self.min_stops or count <= threshold:
+            if count <= threshold:
+                state.spiking = False
+            return None
+        if state.spiking:
+            return None
+        state.spiking = True
+        return (f"{count} drug-related stops in {event.country or 'unknown country'} within "
+                f"{self.window / 60:.0f} minutes (baseline {state.baseline:.1f})")
+
+
+class WatchlistRule:
+    # Exact and prefix watchlist entries; a lookup costs O(plate length)
+    name = "watchlist"
+    horizon = 0
+
+    def __init__(self, watchlist=None):
+        self.watchlist = watchlist
+
+    def reset(self):
+        pass
+
+    def evaluate(self, event):
+        if not event.plate:
+            return None
+        if self.watchlist is None:
+            self.watchlist = get_watchlist()
+        hits = self.watchlist.match(event.vehicle_number)
+        if not hits:
+            return None
+        return "; ".join(f"Vehicle {event.vehicle_number} is on the watchlist ({hit['plate']}"
+                         f"{'*' if hit['prefix'] else ''}): {hit['reason'] or 'no reason given'}" for hit in hits)
+
+
+def default_rules():
+    return [RepeatVehicleRule(), DrugSpikeRule(), WatchlistRule()]
+
+
+def _seconds(stamps):
+    # datetime64 stop times as seconds (NaN for NaT), capped at now + MAX_FUTURE_SECONDS.
+    # Timestamps are naive local times, so "now" is too.
+    stamps = np.asarray(stamps, dtype="datetime64[s]")
+    seconds = stamps.astype(np.int64).astype(np.float64)
+    seconds[np.isnat(stamps)] = np.nan
+    now = pd.Timestamp.now().to_datetime64().astype("datetime64[s]").astype(np.int64)
+    return np.minimum(seconds, now + MAX_FUTURE_SECONDS)
+
+
+def _events(frame, seconds, rows):
+    # The selected rows (boolean mask) as events in stop-time order; rows without a timestamp go last
+    frame = frame[rows]
+    seconds = seconds[rows]
+    order = np.argsort(np.where(np.isnan(seconds), np.inf, seconds), kind="stable")
+    drugs = pd.to_numeric(frame["drugs_related_stop"], errors="coerce").fillna(0).to_numpy() == 1
+    ids = frame["id"].to_numpy()
+    plates = frame["vehicle_number"].to_numpy(dtype=object)
+    countries = frame["country_name"].to_numpy(dtype=object)
+    return [Event(int(ids[i]), None if np.isnan(seconds[i]) else float(seconds[i]),
+                  None if plates[i] is None or plates[i] != plates[i] else plates[i],
+                  None if countries[i] is None or countries[i] != countries[i] else countries[i],
+                  bool(drugs[i])) for i in order]
+
+
+class AlertEngine:
+    # Mirror subscriber. Rows up to silent_until (the table as it was when the engine
+    # started) only fill the windows, and only their most recent stretch at that: alerts
+    # are for stops logged from now on.
+    def __init__(self, rules=None, silent_until=0, max_alerts=MAX_ALERTS):
+        self.rules = default_rules() if rules is None else rules
+        self.silent_until = silent_until
+        self.alerts = deque(maxlen=max_alerts)
+        self.high_water = 0
+        self.events = 0
+        self.warmup_events = 0
+        self.evaluations = 0
+        self.evaluation_seconds = 0.0
+        self.fired = {rule.name: 0 for rule in self.rules}
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def add_frame(self, frame):
+        if frame.empty:
+            return
+        seconds = _seconds(pd.to_datetime(frame["timestamp"], errors="coerce"))
+        with self._lock:
+            new = frame["id"].to_numpy() > self.silent_until
+            if not new.all():
+                self._warm(frame, seconds)
+            events = _events(frame, seconds, new)
+            started = time.perf_counter()
+            for event in events:
+                for rule in self.rules:
+                    message = rule.evaluate(event)
+                    if message is not None:
+                        self._raise(rule, event, message)
+            self.evaluation_seconds += time.perf_counter() - started
+            self.evaluations += len(events) * len(self.rules)
+            self.events += len(events)
+            self.high_water = max(self.high_water, int(frame["id"].max()))
+
+    def _recent(self, ids, seconds):
+        # Mask of the rows up to silent_until within the longest rule horizon of the latest of them
+        old = (ids <= self.silent_until) & ~np.isnan(seconds)
+        if not old.any():
+            return old
+        since = seconds[old].max() - max(rule.horizon for rule in self.rules)
+        return old & (np.nan_to_num(seconds, nan=-np.inf) >= since)
+
+    def replay_rows(self, table):
+        # For TableMirror.subscribe: only the rows _warm would keep are decoded and handed over
+        return self._recent(table.columns["id"], _seconds(table.columns["timestamp"]))
+
+    def _warm(self, frame, seconds):
+        # Feeds the rules the recent part of the rows they start from, without raising
+        # anything. The rows outside the longest horizon are dropped before any event is built.
+        for event in _events(frame, seconds, self._recent(frame["id"].to_numpy(), seconds)):
+            for rule in self.rules:
+                if rule.horizon:
+                    rule.evaluate(event)
+            self.warmup_events += 1
+
+    def _raise(self, rule, event, message):
+        self.fired[rule.name] += 1
+        self.alerts.appendleft({
+            "rule": rule.name,
+            "id": event.id,
+            "stop_time": None if event.seconds is None else pd.Timestamp(event.seconds, unit="s"),
+            "vehicle_number": event.vehicle_number,
+            "country_name": event.country,
+            "message": message,
+            "raised_at": time.time(),
+        })
+
+    def clear(self):
+        # The mirror re-delivers the whole table; rows already seen only refill the windows
+        with self._lock:
+            for rule in self.rules:
+                rule.reset()
+            self.silent_until = max(self.silent_until, self.high_water)
+
+    def recent(self, limit=None):
+        with self._lock:
+            return list(self.alerts)[:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "events": self.events,
+                "warmup_events": self.warmup_events,
+                "rules": len(self.rules),
+                "evaluations": self.evaluations,
+                "rules_per_second": self.evaluations / self.evaluation_seconds if self.evaluation_seconds else None,
+                "fired": dict(self.fired),
+                "high_water": self.high_water,
+                "last_error": self.last_error,
+            }
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_monitor = None
+
+
+def get_alert_engine():
+    # Loads the mirror, then subscribes: everything mirrored so far only warms the windows
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            mirror = get_table_mirror()
+            mirror.refresh(force=True)
+            _engine = AlertEngine(silent_until=mirror.high_water)
+            mirror.subscribe(_engine, _engine.replay_rows)
+        return _engine
+
+
+def _watch():
+    while True:
+        try:
+            engine = get_alert_engine()
+            get_table_mirror().refresh()
+            engine.last_error = get_table_mirror().last_error
+        except Exception as e:
+            if _engine is not None:
+                _engine.last_error = str(e)
+        time.sleep(POLL_INTERVAL)
+
+
+def start_alerting():
+    # Background thread that keeps the mirror, and with it the alerts, current even when
+    # no page is open. Started by the Alerts and Add Log pages rather than at launch, so a
+    # cold start does not wait on it. The Add Log writer refreshes the mirror itself after
+    # every flush.
+    global _monitor
+    with _engine_lock:
+        if _monitor is None:
+            _monitor = threading.Thread(target=_watch, name="securecheck-alerts", daemon=True)
+            _monitor.start()
+
+
+def main(argv=None):
+    from columnar import LOAD_QUERY
+    from db_utils import SQLiteBackend, configure_pool, stream_data
+
+    parser = argparse.ArgumentParser(description="Replay traffic_stops through the alert rules.")
+    parser.add_argument("--sqlite", metavar="PATH", help="use a SQLite file instead of MySQL")
+    parser.add_argument("--show", type=int, default=10, help="alerts to print")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    engine = AlertEngine()
+    started = time.perf_counter()
+    for chunk in stream_data(f"{LOAD_QUERY} ORDER BY timestamp, id", label="alert replay"):
+        engine.add_frame(chunk)
+    stats = engine.stats()
+    print(f"{stats['events']:,} stops, {stats['evaluations']:,} rule evaluations in "
+          f"{time.perf_counter() - started:.2f}s ({stats['rules_per_second'] or 0:,.0f} rules/s while evaluating)")
+    for name, count in stats["fired"].items():
+        print(f"  {name}: {count:,} alerts")
+    for alert in engine.recent(args.show):
+        print(f"  [{alert['rule']}] {alert['stop_time']}  {alert['message']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
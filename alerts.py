@@ -0,0 +1,38 @@
+import pandas as pd
+import streamlit as st
+from alerting import get_alert_engine, start_alerting
+
+
+def show_alerts():
+    st.title("🚨 Alerts")
+
+    engine = get_alert_engine()
+    # From now on new stops are checked even while this page is closed
+    start_alerting()
+    stats = engine.stats()
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Alerts Raised", sum(stats["fired"].values()))
+    col2.metric("Stops Checked", f"{stats['events']:,}")
+    col3.metric("Rule Evaluations", f"{stats['evaluations']:,}")
+    col4.metric("Rules / Second", f"{stats['rules_per_second']:,.0f}" if stats["rules_per_second"] else "–")
+    st.caption(" · ".join(f"{name}: {count}" for name, count in stats["fired"].items())
+               + f" · watching ids above {stats['high_water']}")
+    if stats["last_error"]:
+        st.warning(f"Refresh failed: {stats['last_error']}")
+
+    if st.button("🔄 Check for new stops"):
+        # Normally the background monitor and the Add Log writer do this
+        from table_mirror import get_table_mirror
+
+        get_table_mirror().refresh(force=True)
+        st.rerun()
+
+    rules = st.multiselect("Rules", list(stats["fired"]), default=list(stats["fired"]))
+    alerts = [alert for alert in engine.recent() if alert["rule"] in rules]
+    if not alerts:
+        st.info("No alerts yet. New stops are checked as they are logged.")
+        return
+    frame = pd.DataFrame(alerts)
+    frame["raised_at"] = pd.to_datetime(frame["raised_at"], unit="s")
+    st.dataframe(frame[["raised_at", "rule", "message", "vehicle_number", "country_name", "stop_time", "id"]])
@@ -0,0 +1,281 @@
+# Benchmark suite for SecureCheck's query and page data paths.
+#
+#   python benchmark.py --sizes 100k 1m 10m --output bench.json
+#   python benchmark.py --sizes 100k --compare bench.json
+#
+# Builds synthetic traffic_stops databases in SQLite (cached under --data-dir), then
+# times every insight query, the Home dashboard data path and the Add Log prediction
+# path, with the predictor's size in memory and on disk. Results are written as JSON;
+# --compare reports slowdowns against an older run.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import rollups
+from db_utils import SQLiteBackend, configure_pool, fetch_data, result_cache, transaction
+from migrations import migrate
+
+SIZES = {"100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+GENERATE_CHUNK = 100_000
+REPEATS = 5
+REGRESSION_THRESHOLD = 1.25
+
+# Category weights give the skew seen in real stop data: a dominant country and violation,
+# and a Zipf-distributed vehicle pool so a few plates are stopped over and over
+COUNTRIES = {"Canada": 0.45, "USA": 0.35, "India": 0.2}
+VIOLATIONS = {"Speeding": 0.55, "Moving violation": 0.15, "Equipment": 0.12, "Other": 0.08,
+              "Registration/plates": 0.06, "Seat belt": 0.04}
+RACES = {"White": 0.55, "Black": 0.18, "Hispanic": 0.14, "Asian": 0.09, "Other": 0.04}
+GENDERS = {"M": 0.68, "F": 0.32}
+OUTCOMES = {"Ticket": 0.6, "Warning": 0.2, "Arrest": 0.12, "Summons": 0.05, "No Action": 0.03}
+DURATIONS = {"0-15 Min": 0.7, "16-30 Min": 0.22, "30+ Min": 0.08}
+SEARCH_TYPES = {"None": 0.9, "Incident to Arrest": 0.05, "Probable Cause": 0.03, "Inventory": 0.02}
+VEHICLE_POOL_RATIO = 0.6
+
+
+def _choice(rng, weights, size):
+    values = np.array(list(weights), dtype=object)
+    return values[rng.choice(len(values), size=size, p=np.array(list(weights.values())))]
+
+
+def synthetic_chunk(rng, size, vehicle_pool):
+    ages = np.clip(rng.normal(36, 13, size).round(), 16, 90).astype(object)
+    ages[rng.random(size) < 0.02] = None
+    outcomes = _choice(rng, OUTCOMES, size)
+    violations = _choice(rng, VIOLATIONS, size)
+    # Stops cluster in daytime and rush hours
+    hour_weights = np.array([1, 1, 1, 1, 1, 2, 4, 6, 7, 6, 5, 5, 5, 5, 5, 6, 7, 7, 6, 4, 3, 2, 2, 1], dtype=float)
+    hours = rng.choice(24, size=size, p=hour_weights / hour_weights.sum())
+    seconds = rng.integers(0, 4 * 365 * 86400, size) // 86400 * 86400 + hours * 3600 + rng.integers(0, 3600, size)
+    timestamps = pd.to_datetime("2020-01-01") + pd.to_timedelta(seconds, unit="s")
+    vehicles = np.char.add("TN", np.char.zfill((rng.zipf(1.3, size) % vehicle_pool).astype(str), 7))
+
+    return pd.DataFrame({
+        "stop_date": timestamps.strftime("%Y-%m-%d"),
+        "stop_time": timestamps.strftime("%H:%M"),
+        "country_name": _choice(rng, COUNTRIES, size),
+        "driver_gender": _choice(rng, GENDERS, size),
+        "driver_age_raw": ages,
+        "driver_age": ages,
+        "driver_race": _choice(rng, RACES, size),
+        "violation_raw": violations,
+        "violation": violations,
+        "search_conducted": (rng.random(size) < 0.1).astype(int),
+        "search_type": _choice(rng, SEARCH_TYPES, size),
+        "stop_outcome": outcomes,
+        "is_arrested": (outcomes == "Arrest").astype(int),
+        "stop_duration": _choice(rng, DURATIONS, size),
+        "drugs_related_stop": (rng.random(size) < 0.05).astype(int),
+        "vehicle_number": vehicles.astype(object),
+        "timestamp": timestamps.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+
+def generate(path, rows, seed=42, log=print):
+    # Synthetic database with the production schema (migrations, indexes, rollups)
+    if os.path.exists(path):
+        os.remove(path)
+    configure_pool(SQLiteBackend(path), size=4)
+    migrate(log=lambda message: None)
+    rng = np.random.default_rng(seed)
+    vehicle_pool = max(int(rows * VEHICLE_POOL_RATIO), 1)
+    started = time.perf_counter()
+    columns = list(synthetic_chunk(rng, 1, vehicle_pool).columns)
+    insert = f"INSERT INTO traffic_stops ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    for start in range(0, rows, GENERATE_CHUNK):
+        chunk = synthetic_chunk(rng, min(GENERATE_CHUNK, rows - start), vehicle_pool)
+        with transaction() as cursor:
+            cursor.executemany(insert, list(chunk.astype(object).itertuples(index=False, name=None)))
+    with transaction() as cursor:
+        rollups.rebuild(cursor)
+    log(f"Generated {rows:,} rows in {time.perf_counter() - started:.1f}s -> {path}")
+
+
+def _row_count(path):
+    configure_pool(SQLiteBackend(path), size=4)
+    try:
+        return int(fetch_data("SELECT COUNT(*) AS n FROM traffic_stops", use_cache=False).iloc[0, 0])
+    except Exception:
+        return -1
+
+
+def time_call(function, repeats=REPEATS):
+    # Cold path every time: the shared result cache is cleared before each call
+    timings = []
+    result = None
+    for _ in range(repeats):
+        result_cache.clear()
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    rows = len(result) if hasattr(result, "__len__") else None
+    return {
+        "min_s": round(min(timings), 6),
+        "median_s": round(statistics.median(timings), 6),
+        "max_s": round(max(timings), 6),
+        "repeats": repeats,
+        "rows": rows,
+    }
+
+
+def benchmark_database(path, repeats=REPEATS, include_engine=False):
+    import home
+    import predictor
+    from query_catalog import CATALOG
+    from pagination import fetch_page
+
+    configure_pool(SQLiteBackend(path), size=4)
+    results = []
+
+    def record(group, name, function, times=repeats):
+        results.append({"group": group, "name": name, **time_call(function, times)})
+
+    for question in CATALOG:
+        query, params = question.bind()
+        record(question.page, question.title, lambda query=query, params=params: fetch_data(query, params, prepared=True))
+    # The same text re-sent and re-parsed on every call, for the parameterized questions
+    for question in CATALOG:
+        if question.params:
+            query, params = question.bind()
+            record("unprepared", question.title, lambda query=query, params=params: fetch_data(query, params))
+
+    record("home", "dashboard metrics", home.fetch_dashboard_metrics)
+    record("home", "logs preview first page", lambda: fetch_page(None, 50)[0])
+    record("home", "logs preview page by vehicle_number", lambda: fetch_page(("TN0005000", 0), 50, "vehicle_number")[0])
+
+    record("add_log", "build predictor", predictor.build_predictor, times=1)
+    model = predictor.build_predictor()
+    results[-1]["bytes"] = model.nbytes()
+    model_path = os.path.join(os.path.dirname(path), "predictor.npz")
+    model.save(model_path)
+    record("add_log", "load predictor", lambda: predictor.Predictor.load(model_path))
+    results[-1]["bytes"] = os.path.getsize(model_path)
+    lookups = [("M", age, search, duration, drugs) for age in range(18, 70)
+               for search in (0, 1) for duration in DURATIONS for drugs in (0, 1)]
+    record("add_log", f"predict x{len(lookups)}", lambda: [model.predict(*lookup) for lookup in lookups])
+    batch = fetch_data(f"SELECT {', '.join(predictor.KEY_COLUMNS)} FROM traffic_stops LIMIT 10000", use_cache=False)
+    record("add_log", f"predict_batch x{len(batch)}", lambda: model.predict_batch(batch))
+
+    if include_engine:
+        import columnar
+
+        record("columnar", "load table", columnar.load_columnar_table, times=1)
+        table = columnar.load_columnar_table()
+        for question in columnar.QUESTIONS:
+            record("columnar", question, lambda question=question: table.answer(question))
+    return results
+
+
+def benchmark_startup(repeats=REPEATS):
+    # Cold import time of the app launcher's own imports and of each page, every sample in
+    # a fresh interpreter so nothing is already in sys.modules
+    from page_loader import PAGES
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    modules = ["page_loader", "snapshots"] + [module for module, _ in PAGES.values()]
+    results = []
+    for module in modules:
+        code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+        timings = []
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=here)
+            timings.append(float(output.stdout.strip().splitlines()[-1]))
+        results.append({"group": "startup", "name": f"import {module}", "min_s": round(min(timings), 6),
+                        "median_s": round(statistics.median(timings), 6), "max_s": round(max(timings), 6),
+                        "repeats": repeats, "rows": None})
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline_path, threshold=REGRESSION_THRESHOLD):
+    # Returns the entries whose median got slower than threshold x the baseline
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {(run["size"], entry["group"], entry["name"]): entry
+                for run in baseline["runs"] for entry in run["results"]}
+    regressions = []
+    for run in current["runs"]:
+        for entry in run["results"]:
+            old = previous.get((run["size"], entry["group"], entry["name"]))
+            if old and old["median_s"] > 0:
+                ratio = entry["median_s"] / old["median_s"]
+                if ratio > threshold:
+                    regressions.append({"size": run["size"], "group": entry["group"], "name": entry["name"],
+                                        "baseline_s": old["median_s"], "current_s": entry["median_s"],
+                                        "ratio": round(ratio, 2)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark SecureCheck queries on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", default=["100k"], choices=list(SIZES))
+    parser.add_argument("--data-dir", default="bench_data", help="where synthetic SQLite files are kept")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--engine", action="store_true", help="also time the in-memory columnar engine")
+    parser.add_argument("--startup", action="store_true", help="also time cold imports of the app's pages")
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the synthetic databases")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="fail if medians regress against this run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": "sqlite",
+        },
+        "runs": [],
+    }
+    if args.startup:
+        print("Benchmarking startup")
+        results = benchmark_startup(args.repeats)
+        for entry in results:
+            print(f"  {entry['median_s'] * 1000:10.2f} ms  {entry['group']}: {entry['name']}")
+        report["runs"].append({"size": "startup", "rows": 0, "results": results})
+    for size in args.sizes:
+        rows = SIZES[size]
+        path = os.path.join(args.data_dir, f"traffic_stops_{size}.db")
+        if args.regenerate or _row_count(path) != rows:
+            generate(path, rows)
+        print(f"Benchmarking {size} ({rows:,} rows)")
+        results = benchmark_database(path, args.repeats, args.engine)
+        for entry in results:
+            size_note = f" ({entry['bytes']:,} bytes)" if "bytes" in entry else ""
+            print(f"  {entry['median_s'] * 1000:10.2f} ms  {entry['group']}: {entry['name']}{size_note}")
+        report["runs"].append({"size": size, "rows": rows, "results": results})
+
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['size']} {regression['group']}: {regression['name']} "
+                  f"{regression['baseline_s'] * 1000:.2f} ms -> {regression['current_s'] * 1000:.2f} ms "
+                  f"(x{regression['ratio']})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+from snapshots import data_version
+
+CHART_CACHE_MB = float(os.environ.get("SECURECHECK_CHART_CACHE_MB", "16"))
+# Most rows a chart is drawn from; bigger inputs are aggregated first
+POINT_BUDGET = int(os.environ.get("SECURECHECK_CHART_POINT_BUDGET", "2000"))
+OTHER_LABEL = "Other"
+
+
+def collapse(frame, dimensions, measures, budget=None):
+    # Sums measures over fewer dimensions, dropping them from the end, until the frame fits
+    budget = POINT_BUDGET if budget is None else budget
+    dimensions = list(dimensions)
+    while len(frame) > budget and len(dimensions) > 1:
+        dimensions.pop()
+        frame = frame.groupby(dimensions, as_index=False, sort=True)[measures].sum()
+    return frame
+
+
+def fold_small(frame, path, value, budget=None):
+    # Hierarchies (sunburst/treemap): the largest leaves are kept and the rest are merged
+    # into an "Other" leaf under their parent, moving up a level if that is still too many
+    budget = POINT_BUDGET if budget is None else budget
+    for level in range(len(path) - 1, -1, -1):
+        if len(frame) <= budget:
+            break
+        ranked = frame.sort_values(value, ascending=False, ignore_index=True)
+        ranked.loc[budget // 2:, path[level:]] = OTHER_LABEL
+        frame = ranked.groupby(path, as_index=False, sort=False)[value].sum()
+    return frame
+
+
+def note_downsampled(fig, shown, total):
+    if shown < total:
+        fig.add_annotation(text=f"Aggregated to {shown:,} of {total:,} points", showarrow=False,
+                           xref="paper", yref="paper", x=1, y=1.08, xanchor="right", font={"size": 11})
+    return fig
+
+
+class ChartCache:
+    # LRU cache of serialized Plotly figures keyed by (page, question, variant, data version).
+    # JSON is far cheaper to turn back into a figure than plotly.express is to rebuild it.
+    def __init__(self, max_bytes=int(CHART_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _drop(self, key):
+        _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def figures(self, page, question, result, build, variant=None):
+        # build(question, result) -> list of figures; called only on a miss.
+        # variant tells apart results of the same question, e.g. under different filters.
+        version = data_version()
+        key = (page, question, variant, version, len(result))
+        with self._lock:
+            if version != self._version:
+                # Figures drawn from older data can never be served again
+                for stale in [entry for entry in self._entries if entry[3] != version]:
+                    self._drop(stale)
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                serialized = entry[0]
+            else:
+                self.misses += 1
+                serialized = None
+        if serialized is not None:
+            return [pio.from_json(text, skip_invalid=True) for text in serialized]
+
+        figures = build(question, result)
+        serialized = [fig.to_json() for fig in figures]
+        nbytes = sum(len(text) for text in serialized)
+        with self._lock:
+            if nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (serialized, nbytes)
+                self._bytes += nbytes
+                while self._bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return figures
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+# Shared by all sessions of this server process
+chart_cache = ChartCache()
@@ -0,0 +1,429 @@
+# In-process columnar copy of traffic_stops that answers the insight questions with
+# NumPy group-bys instead of SQL. Text columns are dictionary-encoded (small int codes,
+# -1 for NULL), flags are bit-packed and ages/hours/years are small ints.
+import numpy as np
+import pandas as pd
+
+from db_utils import stream_data
+
+LOAD_COLUMNS = ["id", "country_name", "driver_gender", "driver_race", "driver_age", "violation",
+                "stop_outcome", "stop_duration", "search_type", "vehicle_number", "search_conducted",
+                "is_arrested", "drugs_related_stop", "stop_hour", "stop_day", "timestamp"]
+LOAD_QUERY = f"SELECT {', '.join(LOAD_COLUMNS)} FROM traffic_stops"
+CATEGORY_COLUMNS = ["country_name", "driver_gender", "driver_race", "violation", "stop_outcome",
+                    "stop_duration", "search_type", "vehicle_number"]
+FLAG_COLUMNS = ["search_conducted", "is_arrested", "drugs_related_stop"]
+INT_COLUMNS = ["id", "driver_age", "stop_hour"]
+
+FUNDAMENTAL_AGE_GROUPS = np.array(["18-25", "26-35", "36-45", "46-60", "60+"], dtype=object)
+PROFOUND_AGE_GROUPS = np.array(["18-25", "26-40", "41-60", "60+"], dtype=object)
+TIMES_OF_DAY = np.array(["Morning", "Afternoon", "Evening", "Night"], dtype=object)
+TIME_SEGMENTS = np.array(["Day", "Night"], dtype=object)
+# Stop duration midpoints in tenths of a minute (7.5, 23, 40)
+DURATION_TENTHS = {"0-15 Min": 75, "16-30 Min": 230, "30+ Min": 400}
+
+
+def _smallest_int(values, null_value=-1):
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= max(info.min, null_value) and values.max() <= info.max):
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def _half_up(numerator, denominator):
+    # Integer division rounded half away from zero (numerators here are never negative)
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+def _decimal_div(numerator, denominator, scale):
+    # MySQL decimal division: the quotient is rounded to `scale` digits.
+    # Returns the quotient in units of 10**-scale.
+    numerator = np.asarray(numerator, dtype=np.int64)
+    denominator = np.asarray(denominator, dtype=np.int64)
+    return _half_up(numerator * 10 ** scale, denominator)
+
+
+def _rate(numerator, denominator):
+    # ROUND(numerator * 100.0 / denominator, 2): the division keeps 5 digits, then ROUND
+    units = _decimal_div(np.asarray(numerator, dtype=np.int64) * 100, denominator, 5)
+    return _half_up(units, 1000) / 100
+
+
+class DictionaryEncoder:
+    def __init__(self):
+        self.codes = {}
+        self.labels = []
+
+    def encode(self, series):
+        local_codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        mapping = np.empty(len(uniques) + 1, dtype=np.int64)
+        mapping[-1] = -1
+        for position, value in enumerate(uniques):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.labels)
+                self.labels.append(value)
+            mapping[position] = code
+        return mapping[local_codes]
+
+
+class ColumnarTable:
+    def __init__(self, columns, labels, flags, length, encoders=None):
+        self.columns = columns      # name -> small int array (-1 = NULL)
+        self.labels = labels        # category name -> object array of values
+        self.flags = flags          # flag name -> packed bits
+        self.length = length
+        self.encoders = encoders    # kept so appended rows reuse the same codes
+
+    @staticmethod
+    def _encode(chunks, encoders):
+        parts = {name: [] for name in CATEGORY_COLUMNS + FLAG_COLUMNS + INT_COLUMNS + ["year", "month", "timestamp"]}
+        length = 0
+        for chunk in chunks:
+            length += len(chunk)
+            for column in CATEGORY_COLUMNS:
+                parts[column].append(encoders[column].encode(chunk[column]))
+            for column in FLAG_COLUMNS:
+                parts[column].append((pd.to_numeric(chunk[column], errors="coerce").fillna(0) == 1).to_numpy())
+            for column in INT_COLUMNS:
+                parts[column].append(pd.to_numeric(chunk[column], errors="coerce").fillna(-1).to_numpy(np.int64))
+            days = pd.to_datetime(chunk["stop_day"], errors="coerce")
+            parts["year"].append(days.dt.year.fillna(-1).to_numpy(np.int64))
+            parts["month"].append(days.dt.month.fillna(-1).to_numpy(np.int64))
+            parts["timestamp"].append(pd.to_datetime(chunk["timestamp"], errors="coerce").to_numpy("datetime64[s]"))
+        return parts, length
+
+    @classmethod
+    def _build(cls, parts, length, encoders):
+        def joined(name, dtype):
+            return np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dtype)
+
+        columns = {name: _smallest_int(joined(name, np.int64)) for name in CATEGORY_COLUMNS}
+        columns.update({name: _smallest_int(joined(name, np.int64)) for name in ["driver_age", "stop_hour", "year", "month"]})
+        columns["id"] = joined("id", np.int64).astype(np.int32 if length < 2 ** 31 else np.int64)
+        columns["timestamp"] = joined("timestamp", "datetime64[s]")
+        flags = {name: np.packbits(joined(name, bool)) for name in FLAG_COLUMNS}
+        labels = {name: np.array(encoder.labels, dtype=object) for name, encoder in encoders.items()}
+        return cls(columns, labels, flags, length, encoders)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        encoders = {column: DictionaryEncoder() for column in CATEGORY_COLUMNS}
+        parts, length = cls._encode(chunks, encoders)
+        return cls._build(parts, length, encoders)
+
+    @classmethod
+    def from_frame(cls, frame):
+        return cls.from_chunks([frame])
+
+    def appended(self, chunks):
+        # A new table with the rows added; this one stays unchanged for readers still using it
+        parts, length = self._encode(chunks, self.encoders)
+        if length == 0:
+            return self
+        for name in CATEGORY_COLUMNS + INT_COLUMNS + ["year", "month", "timestamp"]:
+            parts[name].insert(0, self.columns[name].astype(parts[name][0].dtype))
+        for name in FLAG_COLUMNS:
+            parts[name].insert(0, self.flag(name))
+        return self._build(parts, self.length + length, self.encoders)
+
+    def to_frame(self, rows=None):
+        # Decodes the rows (all, or those selected by a boolean mask) back into a DataFrame
+        # (NULLs as None/NaN); stop_day only survives as year/month
+        index = slice(None) if rows is None else np.flatnonzero(rows)
+        frame = {}
+        for name in CATEGORY_COLUMNS:
+            codes, labels = self.category(name)
+            # Code -1 picks the trailing None
+            frame[name] = np.append(labels, None)[codes[index]]
+        for name in FLAG_COLUMNS:
+            frame[name] = self.flag(name)[index].astype(np.int64)
+        for name in INT_COLUMNS:
+            values = pd.Series(self.columns[name][index].astype(np.int64))
+            frame[name] = values if name == "id" else values.where(values != -1)
+        frame["timestamp"] = self.columns["timestamp"][index]
+        return pd.DataFrame(frame)
+
+    def nbytes(self):
+        total = sum(array.nbytes for array in self.columns.values())
+        total += sum(array.nbytes for array in self.flags.values())
+        total += sum(sum(len(str(value)) + 49 for value in labels) for labels in self.labels.values())
+        return total
+
+    def flag(self, name):
+        return np.unpackbits(self.flags[name], count=self.length).astype(bool)
+
+    def category(self, name):
+        return self.columns[name], self.labels[name]
+
+    # Derived group keys, mirroring the CASE expressions in the SQL
+    def fundamental_age_group(self):
+        age = self.columns["driver_age"]
+        codes = np.select([(age >= 18) & (age <= 25), (age >= 26) & (age <= 35),
+                           (age >= 36) & (age <= 45), (age >= 46) & (age <= 60)], [0, 1, 2, 3], 4)
+        return codes, FUNDAMENTAL_AGE_GROUPS
+
+    def profound_age_group(self):
+        age = self.columns["driver_age"]
+        codes = np.select([(age >= 18) & (age <= 25), (age >= 26) & (age <= 40),
+                           (age >= 41) & (age <= 60)], [0, 1, 2], 3)
+        return codes, PROFOUND_AGE_GROUPS
+
+    def time_of_day(self):
+        hour = self.columns["stop_hour"]
+        codes = np.select([(hour >= 6) & (hour <= 11), (hour >= 12) & (hour <= 17),
+                           (hour >= 18) & (hour <= 21)], [0, 1, 2], 3)
+        return codes, TIMES_OF_DAY
+
+    def time_segment(self):
+        hour = self.columns["stop_hour"]
+        night = ((hour >= 22) & (hour <= 23)) | ((hour >= 0) & (hour <= 5))
+        return night.astype(np.int8), TIME_SEGMENTS
+
+    def number(self, name):
+        # Integer column as a group key: its own values are the labels
+        values = self.columns[name].astype(np.int64)
+        known = values >= 0
+        if not known.any():
+            return np.full(self.length, -1), np.empty(0, dtype=object)
+        low, high = values[known].min(), values[known].max()
+        labels = np.array([int(value) for value in range(low, high + 1)], dtype=object)
+        return np.where(known, values - low, -1), labels
+
+    def group(self, keys, mask=None, sums=None):
+        # GROUP BY on dictionary codes: keys is {output column: (codes, labels)},
+        # sums is {output column: int/bool array}. Returns one row per non-empty group
+        # with a `stops` count.
+        sizes = [len(labels) + 1 for _, labels in keys.values()]
+        group_ids = np.zeros(self.length, dtype=np.int64)
+        for (codes, _), size in zip(keys.values(), sizes):
+            group_ids = group_ids * size + (codes.astype(np.int64) + 1)
+        sums = sums or {}
+        if mask is not None:
+            group_ids = group_ids[mask]
+            sums = {name: values[mask] for name, values in sums.items()}
+
+        uniques, inverse = np.unique(group_ids, return_inverse=True)
+        result = {}
+        remaining = uniques.copy()
+        for (name, (_, labels)), size in reversed(list(zip(keys.items(), sizes))):
+            codes = remaining % size - 1
+            remaining //= size
+            decoded = np.empty(len(codes), dtype=object)
+            decoded[codes >= 0] = labels[codes[codes >= 0]]
+            decoded[codes < 0] = None
+            result[name] = decoded
+        frame = pd.DataFrame({name: result[name] for name in keys})
+        frame["stops"] = np.bincount(inverse, minlength=len(uniques))
+        for name, values in sums.items():
+            frame[name] = np.bincount(inverse, weights=values, minlength=len(uniques)).astype(np.int64)
+        return frame
+
+    def answer(self, question, values=None):
+        # values: the question's catalog parameters, e.g. {"top_n": 10}
+        handler = QUESTIONS.get(question)
+        if handler is None:
+            raise KeyError(f"No columnar implementation for: {question}")
+        return handler(self, **(values or {})).reset_index(drop=True)
+
+
+def _order(frame, columns, ascending, limit=None):
+    # NULLs sort first ascending and last descending, as in MySQL
+    if isinstance(ascending, bool):
+        ascending = [ascending] * len(columns)
+    frame = frame.sort_values(columns, ascending=ascending, kind="stable",
+                              na_position="first" if ascending[0] else "last")
+    return frame.head(limit) if limit else frame
+
+
+def _top_vehicles(table, flag_name, count_name, top_n):
+    codes, labels = table.category("vehicle_number")
+    valid = np.zeros(len(labels), dtype=bool)
+    valid[:] = [value is not None and value != "" for value in labels]
+    mask = table.flag(flag_name) & (codes >= 0)
+    mask &= valid[np.where(codes >= 0, codes, 0)]
+    counts = np.bincount(codes[mask].astype(np.int64), minlength=len(labels))
+    top = np.argsort(-counts, kind="stable")[:top_n]
+    top = top[counts[top] > 0]
+    return pd.DataFrame({"vehicle_number": labels[top], count_name: counts[top]})
+
+
+def top_drug_vehicles(table, top_n=10):
+    return _top_vehicles(table, "drugs_related_stop", "stop_count", top_n)
+
+
+def top_searched_vehicles(table, top_n=10):
+    return _top_vehicles(table, "search_conducted", "search_count", top_n)
+
+
+def age_group_arrest_rate(table):
+    frame = table.group({"age_group": table.fundamental_age_group()},
+                        mask=table.columns["driver_age"] >= 0, sums={"arrests": table.flag("is_arrested")})
+    frame["arrest_rate"] = _rate(frame["arrests"], frame["stops"])
+    return _order(frame[["age_group", "arrest_rate"]], ["arrest_rate"], False)
+
+
+def gender_by_country(table):
+    frame = table.group({"country_name": table.category("country_name"),
+                         "driver_gender": table.category("driver_gender")})
+    frame = frame.rename(columns={"stops": "count"})
+    return _order(frame, ["country_name", "driver_gender"], True)
+
+
+def race_gender_search_rate(table, top_n=5):
+    frame = table.group({"driver_race": table.category("driver_race"),
+                         "driver_gender": table.category("driver_gender")},
+                        sums={"searches": table.flag("search_conducted")})
+    frame["search_rate"] = _rate(frame["searches"], frame["stops"])
+    return _order(frame[["driver_race", "driver_gender", "search_rate"]], ["search_rate"], False, limit=top_n)
+
+
+def stops_by_time_of_day(table):
+    frame = table.group({"time_of_day": table.time_of_day()}).rename(columns={"stops": "stop_count"})
+    return _order(frame, ["stop_count"], False)
+
+
+def average_duration_by_violation(table):
+    codes, labels = table.category("stop_duration")
+    tenths_by_code = np.array([DURATION_TENTHS.get(value, -1) for value in labels] + [-1], dtype=np.int64)
+    tenths = tenths_by_code[codes]  # code -1 picks the trailing "unknown" slot
+    known = tenths >= 0
+    frame = table.group({"violation": table.category("violation")},
+                        sums={"tenths": np.where(known, tenths, 0), "known": known})
+    # AVG of DECIMAL(.,1) values keeps 5 digits, then ROUND(..., 2)
+    averages = np.full(len(frame), np.nan)
+    has_known = frame["known"].to_numpy() > 0
+    units = _decimal_div(frame["tenths"].to_numpy()[has_known], frame["known"].to_numpy()[has_known] * 10, 5)
+    averages[has_known] = _half_up(units, 1000) / 100
+    frame["avg_duration_min"] = averages
+    return _order(frame[["violation", "avg_duration_min"]], ["avg_duration_min"], False)
+
+
+def night_arrest_rate(table):
+    frame = table.group({"time_segment": table.time_segment()}, sums={"arrests": table.flag("is_arrested")})
+    frame["arrest_rate"] = _rate(frame["arrests"], frame["stops"])
+    return frame[["time_segment", "arrest_rate"]]
+
+
+def _violation_rates(table):
+    frame = table.group({"violation": table.category("violation")},
+                        sums={"searches": table.flag("search_conducted"), "arrests": table.flag("is_arrested")})
+    frame["search_rate"] = _rate(frame["searches"], frame["stops"])
+    frame["arrest_rate"] = _rate(frame["arrests"], frame["stops"])
+    return frame
+
+
+def violation_search_arrest_rates(table):
+    return _order(_violation_rates(table)[["violation", "search_rate", "arrest_rate"]], ["search_rate"], False)
+
+
+def young_driver_violations(table, age_cutoff=25):
+    age = table.columns["driver_age"]
+    frame = table.group({"violation": table.category("violation")}, mask=(age >= 0) & (age < age_cutoff))
+    return _order(frame.rename(columns={"stops": "count"}), ["count"], False)
+
+
+def rarely_searched_violations(table):
+    frame = _violation_rates(table)
+    frame = frame[(frame["search_rate"] < 50) & (frame["arrest_rate"] < 50)]
+    return _order(frame[["violation", "search_rate", "arrest_rate"]], ["violation"], True)
+
+
+def country_drug_rate(table):
+    frame = table.group({"country_name": table.category("country_name")},
+                        sums={"drug_stops": table.flag("drugs_related_stop")})
+    frame["drug_stop_rate"] = _rate(frame["drug_stops"], frame["stops"])
+    return _order(frame[["country_name", "drug_stop_rate"]], ["drug_stop_rate"], False)
+
+
+def country_violation_arrest_rate(table):
+    frame = table.group({"country_name": table.category("country_name"), "violation": table.category("violation")},
+                        sums={"arrests": table.flag("is_arrested")})
+    frame["arrest_rate"] = _rate(frame["arrests"], frame["stops"])
+    return _order(frame[["country_name", "violation", "arrest_rate"]], ["country_name", "arrest_rate"], [True, False])
+
+
+def country_search_count(table):
+    frame = table.group({"country_name": table.category("country_name")}, mask=table.flag("search_conducted"))
+    return _order(frame.rename(columns={"stops": "search_count"}), ["search_count"], False)
+
+
+def yearly_country_breakdown(table):
+    frame = table.group({"country_name": table.category("country_name"), "year": table.number("year")},
+                        sums={"total_arrests": table.flag("is_arrested")})
+    frame = frame.rename(columns={"stops": "total_stops"})
+    frame["arrest_rate_percent"] = _rate(frame["total_arrests"], frame["total_stops"])
+    frame = frame[["country_name", "year", "total_stops", "total_arrests", "arrest_rate_percent"]]
+    return _order(frame, ["year", "country_name"], True)
+
+
+def violation_trends_by_age_race(table):
+    frame = table.group({"driver_race": table.category("driver_race"), "violation": table.category("violation"),
+                         "age_group": table.profound_age_group()})
+    return _order(frame.rename(columns={"stops": "count"}), ["count"], False)
+
+
+def stops_by_year_month_hour(table):
+    frame = table.group({"year": table.number("year"), "month": table.number("month"),
+                         "hour": table.number("stop_hour")})
+    return _order(frame.rename(columns={"stops": "total_stops"}), ["year", "month", "hour"], True)
+
+
+def violation_search_arrest_summary(table):
+    frame = _violation_rates(table).rename(columns={"stops": "total", "search_rate": "search_rate_percent",
+                                                    "arrest_rate": "arrest_rate_percent"})
+    frame = frame[["violation", "total", "searches", "arrests", "search_rate_percent", "arrest_rate_percent"]]
+    return _order(frame, ["arrest_rate_percent"], False)
+
+
+def demographics_by_country(table):
+    age = table.columns["driver_age"].astype(np.int64)
+    known_age = age >= 0
+    frame = table.group({"country_name": table.category("country_name"),
+                         "driver_gender": table.category("driver_gender"),
+                         "driver_race": table.category("driver_race")},
+                        sums={"age_sum": np.where(known_age, age, 0), "age_count": known_age})
+    averages = np.full(len(frame), np.nan)
+    has_age = frame["age_count"].to_numpy() > 0
+    averages[has_age] = _decimal_div(frame["age_sum"].to_numpy()[has_age],
+                                     frame["age_count"].to_numpy()[has_age], 5) / 10 ** 5
+    frame["avg_age"] = averages
+    frame = frame.rename(columns={"stops": "total_drivers"})
+    frame = frame[["country_name", "driver_gender", "driver_race", "avg_age", "total_drivers"]]
+    return _order(frame, ["country_name", "total_drivers"], [True, False])
+
+
+def top_violations_by_arrest_rate(table, top_n=5):
+    frame = _violation_rates(table).rename(columns={"stops": "total", "arrest_rate": "arrest_rate_percent"})
+    return _order(frame[["violation", "total", "arrests", "arrest_rate_percent"]], ["arrest_rate_percent"], False, limit=top_n)
+
+
+QUESTIONS = {
+    "What are the top 10 vehicles involved in drug-related stops?": top_drug_vehicles,
+    "Which vehicles were most frequently searched?": top_searched_vehicles,
+    "Which driver age group had the highest arrest rate?": age_group_arrest_rate,
+    "What is the gender distribution of drivers stopped in each country?": gender_by_country,
+    "Which race and gender combination has the highest search rate?": race_gender_search_rate,
+    "What time of day sees the most traffic stops?": stops_by_time_of_day,
+    "What is the average stop duration for different violations?": average_duration_by_violation,
+    "Are stops during the night more likely to lead to arrests?": night_arrest_rate,
+    "Which violations are most associated with searches or arrests?": violation_search_arrest_rates,
+    "Which violations are most common among younger drivers (<25)?": young_driver_violations,
+    "Is there a violation that rarely results in search or arrest?": rarely_searched_violations,
+    "Which countries report the highest rate of drug-related stops?": country_drug_rate,
+    "What is the arrest rate by country and violation?": country_violation_arrest_rate,
+    "Which country has the most stops with search conducted?": country_search_count,
+    "Yearly Breakdown of Stops and Arrests by Country": yearly_country_breakdown,
+    "Driver Violation Trends Based on Age and Race": violation_trends_by_age_race,
+    "Time Period Analysis of Stops (Year, Month, Hour)": stops_by_year_month_hour,
+    "Violations with High Search and Arrest Rates": violation_search_arrest_summary,
+    "Driver Demographics by Country (Age, Gender, and Race)": demographics_by_country,
+    "Top 5 Violations with Highest Arrest Rates": top_violations_by_arrest_rate,
+}
+
+
+def load_columnar_table():
+    # Chunks are encoded as they arrive, so peak memory is one chunk plus the encoded columns.
+    # The app keeps its copy current through table_mirror instead of reloading it.
+    return ColumnarTable.from_chunks(stream_data(LOAD_QUERY, label="columnar load"))
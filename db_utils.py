@@ -1,29 +1,563 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing, contextmanager
+
 import streamlit as st
 import mysql.connector
 import pandas as pd
 
+from query_cache import QueryCache, is_cacheable
+from query_metrics import METRICS_PATH, QueryMetrics, estimate_payload_bytes
+
+# Connection settings (override with environment variables)
+DB_BACKEND = os.environ.get("SECURECHECK_DB_BACKEND", "mysql")
+DB_CONFIG = {
+    "host": os.environ.get("SECURECHECK_DB_HOST", "localhost"),
+    "user": os.environ.get("SECURECHECK_DB_USER", "root"),
+    "password": os.environ.get("SECURECHECK_DB_PASSWORD", "Sacheart$731"),
+    "database": os.environ.get("SECURECHECK_DB_NAME", "securecheck"),
+}
+SQLITE_PATH = os.environ.get("SECURECHECK_SQLITE_PATH", "securecheck.db")
+POOL_SIZE = int(os.environ.get("SECURECHECK_POOL_SIZE", "5"))
+POOL_TIMEOUT = float(os.environ.get("SECURECHECK_POOL_TIMEOUT", "30"))
+# Idle connections older than this are pinged before being handed out
+HEALTH_CHECK_AFTER = float(os.environ.get("SECURECHECK_HEALTH_CHECK_AFTER", "30"))
+# Per-query limit for fetch_many(), enforced by the database server
+QUERY_TIMEOUT = float(os.environ.get("SECURECHECK_QUERY_TIMEOUT", "30"))
+# Prepared statements kept per pooled connection (least recently used are closed first)
+STATEMENT_CACHE_SIZE = int(os.environ.get("SECURECHECK_STATEMENT_CACHE_SIZE", "64"))
+# Rows per chunk for stream_data()
+STREAM_CHUNK_SIZE = int(os.environ.get("SECURECHECK_STREAM_CHUNK_SIZE", "50000"))
+# MySQL strict-mode errors for a bad value: data truncated / incorrect value for a column
+STRICT_MODE_ERRNOS = {1265, 1366}
+# Cheap probe whose result changes whenever rows are added to or removed from traffic_stops
+DATA_VERSION_QUERY = "SELECT COUNT(*) AS row_count, MAX(id) AS max_id FROM traffic_stops"
+
+
+class MySQLBackend:
+    name = "mysql"
+    # Unread rows of an abandoned unbuffered result block the connection
+    reusable_after_partial_read = False
+
+    def __init__(self, **config):
+        self.config = dict(config)
+        # Pooled connections are reused across page loads, so every SELECT must see fresh data
+        self.config.setdefault("autocommit", True)
+
+    def connect(self):
+        return mysql.connector.connect(**self.config)
+
+    def is_alive(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def adapt_query(self, query):
+        return query
+
+    def begin(self, connection):
+        connection.start_transaction()
+
+    def stream_cursor(self, connection):
+        # Unbuffered: rows stay on the server until fetchmany() asks for them
+        return connection.cursor(buffered=False)
+
+    def prepared_cursor(self, connection):
+        # Server-side prepared statement: parsed and planned on the first execute, then
+        # only the parameters are sent while the same query string is executed again
+        return connection.cursor(prepared=True)
+
+    def set_timeout(self, connection, seconds):
+        # MySQL aborts SELECTs running longer than MAX_EXECUTION_TIME (0 = no limit)
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("SET SESSION MAX_EXECUTION_TIME = %s", (int(seconds * 1000) if seconds else 0,))
+
+
+def _timestamp_part(start, end):
+    def part(value):
+        if value is None:
+            return None
+        try:
+            return int(str(value)[start:end])
+        except ValueError:
+            return None
+    return part
+
+
+def _left(value, length):
+    if value is None:
+        return None
+    return str(value)[:length]
+
+
+_LEFT_CALL = re.compile(r"\bLEFT\s*\(", re.IGNORECASE)
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    reusable_after_partial_read = True
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                     cached_statements=STATEMENT_CACHE_SIZE)
+        # MySQL functions used by the insight queries
+        connection.create_function("YEAR", 1, _timestamp_part(0, 4), deterministic=True)
+        connection.create_function("MONTH", 1, _timestamp_part(5, 7), deterministic=True)
+        connection.create_function("HOUR", 1, _timestamp_part(11, 13), deterministic=True)
+        connection.create_function("mysql_left", 2, _left, deterministic=True)
+        return connection
+
+    def is_alive(self, connection):
+        try:
+            connection.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def adapt_query(self, query):
+        # Queries are written for MySQL: %s placeholders, and LEFT() is a keyword in SQLite
+        query = _LEFT_CALL.sub("mysql_left(", query)
+        return query.replace("%s", "?").replace("%%", "%")
+
+    def begin(self, connection):
+        connection.execute("BEGIN")
+
+    def stream_cursor(self, connection):
+        # SQLite steps through the result lazily on every fetch
+        return connection.cursor()
+
+    def prepared_cursor(self, connection):
+        # sqlite3 keeps compiled statements per connection, keyed by the SQL text
+        return connection.cursor()
+
+    def set_timeout(self, connection, seconds):
+        # The progress handler interrupts the statement once the deadline has passed
+        if not seconds:
+            connection.set_progress_handler(None, 0)
+            return
+        deadline = time.monotonic() + seconds
+        connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+
+
+def create_backend():
+    if DB_BACKEND == "sqlite":
+        return SQLiteBackend(SQLITE_PATH)
+    return MySQLBackend(**DB_CONFIG)
+
+
+class ConnectionPool:
+    def __init__(self, backend, size=POOL_SIZE, timeout=POOL_TIMEOUT, health_check_after=HEALTH_CHECK_AFTER):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self.reconnects = 0
+        # id(connection) -> OrderedDict(query -> (query, cursor)) of prepared statements
+        self._statements = {}
+        self.statements_prepared = 0
+        self.statement_reuses = 0
+
+    def _new_connection(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self.backend.connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, connection):
+        with self._lock:
+            self._created -= 1
+            statements = self._statements.pop(id(connection), {})
+        for _, cursor in statements.values():
+            _close_quietly(cursor)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def statement(self, connection, query):
+        # (query, cursor) prepared once per connection. MySQL connector re-prepares unless it
+        # is handed the very same string object, so callers execute the returned query.
+        with self._lock:
+            statements = self._statements.setdefault(id(connection), OrderedDict())
+            cached = statements.get(query)
+            if cached is not None:
+                statements.move_to_end(query)
+                self.statement_reuses += 1
+                return cached
+            self.statements_prepared += 1
+        cached = (query, self.backend.prepared_cursor(connection))
+        with self._lock:
+            statements[query] = cached
+            evicted = statements.popitem(last=False) if len(statements) > STATEMENT_CACHE_SIZE else None
+        if evicted is not None:
+            _close_quietly(evicted[1][1])
+        return cached
+
+    def forget_statement(self, connection, query):
+        # After an error the cursor's state is unknown; the next use prepares it again
+        with self._lock:
+            cached = self._statements.get(id(connection), {}).pop(query, None)
+        if cached is not None:
+            _close_quietly(cached[1])
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        connection = self._new_connection()
+        if connection is not None:
+            return connection, time.monotonic()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+
+    def acquire(self):
+        connection, last_used = self._checkout()
+        # Reconnect if the idle connection went stale (server restart, wait_timeout, ...)
+        if time.monotonic() - last_used > self.health_check_after and not self.backend.is_alive(connection):
+            self._discard(connection)
+            self.reconnects += 1
+            connection, _ = self._checkout()
+
+        with self._lock:
+            self._in_use += 1
+        return connection
+
+    def release(self, connection, discard=False):
+        with self._lock:
+            self._in_use -= 1
+        if discard:
+            self._discard(connection)
+        else:
+            self._idle.put((connection, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        broken = False
+        try:
+            yield connection
+        except Exception:
+            # Don't hand a connection in an unknown state to the next caller
+            broken = not self.backend.is_alive(connection)
+            raise
+        finally:
+            self.release(connection, discard=broken)
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "reconnects": self.reconnects,
+                "statements_prepared": self.statements_prepared,
+                "statement_reuses": self.statement_reuses,
+            }
+
+
+def _close_quietly(cursor):
+    try:
+        cursor.close()
+    except Exception:
+        pass
+
+
+# One pool per server process: imported modules survive Streamlit reruns
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(create_backend())
+        return _pool
+
+
+def configure_pool(backend, size=POOL_SIZE):
+    # Swap the process-wide pool, e.g. to point the app at a SQLite file
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(backend, size=size)
+        return _pool
+
+
 def create_connection():
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="Sacheart$731",
-            database="securecheck"
-        )
-        return connection
+        return create_backend().connect()
     except Exception as e:
         st.error(f"Database Connection Error: {e}")
         return None
 
-def fetch_data(query):
-    connection = create_connection()
-    if connection:
+
+def _run_query(query, params=None, timings=None, timeout=None, pool=None, prepared=False):
+    # timings, when given, receives per-phase durations in seconds plus rows and payload bytes.
+    # pool defaults to the app's database; shards.py passes its own. prepared runs the query
+    # as a statement cached on the connection, for queries executed again and again.
+    timings = {} if timings is None else timings
+    pool = get_pool() if pool is None else pool
+    started = time.perf_counter()
+    connection = pool.acquire()
+    timings["connect"] = time.perf_counter() - started
+    broken = False
+    cursor = None
+    query = pool.backend.adapt_query(query)
+    try:
+        if prepared:
+            query, cursor = pool.statement(connection, query)
+        else:
+            cursor = connection.cursor()
+        if timeout:
+            pool.backend.set_timeout(connection, timeout)
+        started = time.perf_counter()
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+        timings["execute"] = time.perf_counter() - started
+        started = time.perf_counter()
+        result = cursor.fetchall()
+        timings["fetch"] = time.perf_counter() - started
+        timings["rows"] = len(result)
+        timings["bytes"] = estimate_payload_bytes(result)
+        started = time.perf_counter()
+        df = pd.DataFrame(result, columns=[desc[0] for desc in cursor.description])
+        timings["frame"] = time.perf_counter() - started
+        return df
+    except Exception:
+        broken = not pool.backend.is_alive(connection)
+        if prepared and not broken:
+            pool.forget_statement(connection, query)
+        raise
+    finally:
+        if cursor is not None and not prepared:
+            _close_quietly(cursor)
+        if timeout and not broken:
+            try:
+                pool.backend.set_timeout(connection, None)
+            except Exception:
+                broken = True
+        pool.release(connection, discard=broken)
+
+
+def _probe_data_version():
+    row = _run_query(DATA_VERSION_QUERY).iloc[0]
+    return tuple(None if pd.isna(value) else int(value) for value in row)
+
+
+# Query results shared by all sessions, invalidated when traffic_stops changes
+result_cache = QueryCache(_probe_data_version)
+# Recent fetch_data calls, tagged with the calling page and question label
+query_metrics = QueryMetrics()
+
+
+def query_data(query, params=None, use_cache=True, page=None, label=None, timeout=None, prepared=False):
+    # fetch_data() without the Streamlit error message: database errors are raised
+    use_cache = use_cache and is_cacheable(query)
+    timings = {}
+    started = time.perf_counter()
+    try:
+        if use_cache:
+            cached, key = result_cache.get(query, params)
+            if cached is not None:
+                timings["total"] = time.perf_counter() - started
+                query_metrics.record(page, label, timings, rows=len(cached), cache_hit=True)
+                return cached
+        df = _run_query(query, params, timings, timeout, prepared=prepared)
+    except Exception as e:
+        timings["total"] = time.perf_counter() - started
+        query_metrics.record(page, label, timings, error=e)
+        raise
+    if use_cache:
+        result_cache.put(key, df)
+    timings["total"] = time.perf_counter() - started
+    query_metrics.record(page, label, timings, rows=timings["rows"], payload_bytes=timings["bytes"])
+    return df
+
+
+def fetch_data(query, params=None, use_cache=True, page=None, label=None, prepared=False):
+    try:
+        return query_data(query, params, use_cache, page, label, prepared=prepared)
+    except (mysql.connector.Error, sqlite3.Error, TimeoutError) as e:
+        st.error(f"Database Error: {e}")
+        return pd.DataFrame()
+
+
+def fetch_many(queries, timeout=QUERY_TIMEOUT, max_workers=None, page=None, prepared=False):
+    # Runs {label: query or (query, params)} concurrently, at most one query per pooled
+    # connection, and yields (label, result, error, seconds) in completion order. Safe to
+    # call from the Streamlit script thread: only the queries run on worker threads.
+    workers = max(min(len(queries), max_workers or get_pool().size), 1)
+
+    def run(label, query):
+        started = time.perf_counter()
+        query, params = query if isinstance(query, tuple) else (query, None)
         try:
-            with connection.cursor() as cursor:
-                cursor.execute(query)
-                result = cursor.fetchall()
-                df = pd.DataFrame(result, columns=[desc[0] for desc in cursor.description])
-                return df
-        finally:
-            connection.close()
-    return pd.DataFrame()
+            return (label, query_data(query, params, page=page, label=label, timeout=timeout, prepared=prepared),
+                    None, time.perf_counter() - started)
+        except Exception as e:
+            return label, pd.DataFrame(), e, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="securecheck-query") as executor:
+        futures = [executor.submit(run, label, query) for label, query in queries.items()]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def stream_data(query, params=None, chunk_size=STREAM_CHUNK_SIZE, dtypes=None, page=None, label=None):
+    # Yields the result as DataFrames of at most chunk_size rows, cast with dtypes
+    # ({column: dtype}) when given. Rows are pulled from an unbuffered cursor as the
+    # consumer asks for them, so the full result is never held as tuples or as one
+    # frame. The connection stays checked out until the generator is exhausted or
+    # closed. Results are not cached and errors are raised to the caller.
+    pool = get_pool()
+    timings = {"execute": 0.0, "fetch": 0.0, "frame": 0.0}
+    rows_read = 0
+    payload_bytes = 0
+    started = time.perf_counter()
+    connection = pool.acquire()
+    timings["connect"] = time.perf_counter() - started
+    cursor = None
+    finished = False
+    broken = False
+    error = None
+    try:
+        cursor = pool.backend.stream_cursor(connection)
+        query = pool.backend.adapt_query(query)
+        started = time.perf_counter()
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+        timings["execute"] = time.perf_counter() - started
+        columns = [desc[0] for desc in cursor.description]
+        while True:
+            started = time.perf_counter()
+            rows = cursor.fetchmany(chunk_size)
+            timings["fetch"] += time.perf_counter() - started
+            if not rows:
+                break
+            rows_read += len(rows)
+            payload_bytes += estimate_payload_bytes(rows)
+            started = time.perf_counter()
+            chunk = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            del rows
+            if dtypes:
+                chunk = chunk.astype({column: dtype for column, dtype in dtypes.items() if column in chunk.columns})
+            timings["frame"] += time.perf_counter() - started
+            yield chunk
+        finished = True
+    except Exception as e:
+        error = e
+        broken = not pool.backend.is_alive(connection)
+        raise
+    finally:
+        if not finished and not pool.backend.reusable_after_partial_read:
+            broken = True
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                broken = True
+        pool.release(connection, discard=broken)
+        # Time spent by the consumer between chunks is not the query's
+        timings["total"] = sum(timings.values())
+        query_metrics.record(page, label, timings, rows=rows_read, payload_bytes=payload_bytes, error=error)
+
+
+@contextmanager
+def transaction():
+    # Yields a cursor whose statements commit together (or roll back on error)
+    pool = get_pool()
+    with pool.connection() as connection:
+        pool.backend.begin(connection)
+        try:
+            with closing(connection.cursor()) as cursor:
+                yield TransactionCursor(cursor, pool.backend)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+
+class TransactionCursor:
+    def __init__(self, cursor, backend):
+        self.cursor = cursor
+        self.backend = backend
+
+    def execute(self, query, params=None):
+        query = self.backend.adapt_query(query)
+        if params is None:
+            self.cursor.execute(query)
+        else:
+            self.cursor.execute(query, params)
+        return self.cursor
+
+    def executemany(self, query, rows):
+        self.cursor.executemany(self.backend.adapt_query(query), rows)
+        return self.cursor
+
+    def __getattr__(self, name):
+        # fetchall, fetchone, description, rowcount, ...
+        return getattr(self.cursor, name)
+
+
+def is_data_error(error):
+    # True when the values being written were rejected (constraint, type, strict-mode length);
+    # retrying the same row cannot succeed. Connection, timeout and schema errors are False.
+    if isinstance(error, (mysql.connector.DataError, mysql.connector.IntegrityError, sqlite3.DataError,
+                          sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError,
+                          ValueError, TypeError)):
+        return True
+    # Strict mode reports truncated and incorrect values with SQLSTATE HY000
+    return isinstance(error, mysql.connector.DatabaseError) and getattr(error, "errno", None) in STRICT_MODE_ERRNOS
+
+
+def invalidate_cache():
+    result_cache.invalidate()
+
+
+def cache_stats():
+    return result_cache.stats()
+
+
+def export_metrics(path=METRICS_PATH):
+    # Prometheus text file for a node_exporter textfile collector or a manual scrape
+    return query_metrics.write_prometheus(path)
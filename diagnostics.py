@@ -0,0 +1,80 @@
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+from chart_cache import chart_cache
+from db_utils import cache_stats, export_metrics, get_pool, query_metrics
+from page_loader import startup_times
+from snapshots import get_warm_start
+from table_mirror import get_table_mirror
+
+
+def show_diagnostics():
+    st.title("🩺 Diagnostics")
+
+    summary = query_metrics.summary()
+    cache = cache_stats()
+    pool = get_pool().stats()
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Queries in Window", len(query_metrics.samples()))
+    col2.metric("Queries Since Start", query_metrics.recorded)
+    col3.metric("Cache Hit Rate", f"{cache['hit_rate'] * 100:.1f}%")
+    col4.metric("Connections In Use", f"{pool['in_use']} / {pool['size']}")
+
+    st.caption(f"Prepared statements: {pool['statements_prepared']} prepared, {pool['statement_reuses']} reused "
+               f"across {pool['open']} connections")
+
+    charts = chart_cache.stats()
+    st.caption(f"Chart cache: {charts['entries']} figures, {charts['bytes'] / 1024:.0f} KB, "
+               f"{charts['hit_rate'] * 100:.1f}% hit rate")
+
+    mirror = get_table_mirror().stats()
+    if mirror["loaded"]:
+        st.caption(f"Table mirror: {mirror['rows']:,} rows up to id {mirror['high_water']}, "
+                   f"{mirror['bytes'] / 1024 / 1024:.1f} MB, {mirror['delta_rows']:,} rows fetched in "
+                   f"{mirror['refreshes']} refreshes, {mirror['resyncs']} full re-syncs")
+
+    warm_start = get_warm_start().stats()
+    if warm_start["serving_snapshot"]:
+        st.warning(f"Serving the snapshot from {warm_start['snapshot_created_at']} while the database warms up.")
+    if warm_start["last_error"]:
+        st.caption(f"Snapshot error: {warm_start['last_error']}")
+
+    with st.expander("🚀 Startup Time"):
+        st.dataframe(pd.DataFrame({"step": list(startup_times), "seconds": list(startup_times.values())}))
+
+    if summary.empty:
+        st.info("No queries recorded yet. Open another page and come back.")
+        return
+
+    # Latency percentiles per page and question
+    st.subheader("⏱️ Query Latency")
+    st.dataframe(summary)
+
+    # Where the time goes for the slowest questions
+    st.subheader("📈 Phase Breakdown (mean ms)")
+    slowest = summary.head(15).copy()
+    slowest["query"] = slowest["page"] + ": " + slowest["label"]
+    phases = slowest.melt(id_vars="query", value_vars=["connect_ms", "execute_ms", "fetch_ms", "frame_ms"],
+                          var_name="phase", value_name="ms")
+    fig = px.bar(phases, x="ms", y="query", color="phase", orientation="h",
+                 title="Connect / Execute / Fetch / DataFrame Time by Query")
+    fig.update_layout(yaxis={"categoryorder": "total ascending"}, height=200 + 30 * len(slowest))
+    st.plotly_chart(fig)
+
+    st.subheader("🧾 Recent Queries")
+    recent = query_metrics.frame().sort_values("at", ascending=False).head(100)
+    st.dataframe(recent)
+
+    st.subheader("📤 Export")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Write Prometheus File"):
+            st.success(f"Metrics written to {export_metrics()}")
+    with col2:
+        st.download_button("Download Prometheus Metrics", query_metrics.to_prometheus(),
+                           file_name="query_metrics.prom", mime="text/plain")
+
+    if st.button("Clear Metrics"):
+        query_metrics.clear()
+        st.rerun()
@@ -1,302 +1,181 @@
+import time
+
 import streamlit as st
-import plotly.express as px
-from db_utils import fetch_data
+from chart_cache import chart_cache
+from table_mirror import get_columnar_table
+from db_utils import fetch_data, fetch_many
+from snapshots import serving_snapshot, snapshot_result
+from insight_filters import describe, filter_controls
+from sketches import get_vehicle_sketches
+from query_catalog import categories, get_question, param_controls, session_heading, session_values
+from shards import get_shards, shard_notes
+
+PAGE = "fundamental_insights"
+# Questions the approximate mode answers from sketches: (sketch flag, count column)
+APPROXIMATE_QUESTIONS = {
+    "What are the top 10 vehicles involved in drug-related stops?": ("drug_stops", "stop_count"),
+    "Which vehicles were most frequently searched?": ("searches", "search_count"),
+}
+
+
+def show_result(selected_question, result, filters=None, values=None):
+    # Result table and chart for one question
+    question = get_question(PAGE, selected_question)
+    values = question.values(values)
+    if filters and question.filterable:
+        st.caption(f"Filtered: {describe(filters)}")
+    elif filters:
+        st.caption("This question is not filtered by date or country.")
+    shard_notes(result)
+    if "approximate" in result.attrs:
+        st.subheader("📊 Query Output (approximate)")
+        st.caption(result.attrs["approximate"])
+        st.dataframe(result)
+    else:
+        st.subheader("📊 Query Output")
+        st.dataframe(result[question.columns] if question.columns else result)
+
+    if not question.charts:
+        return
+    st.markdown("---")
+    st.subheader("📈 Visualization")
+    variant = describe(filters) if question.filterable else None
+    if not question.is_default(values):
+        variant = (variant, tuple(values.items()))
+    if "approximate" in result.attrs:
+        variant = ("approximate", variant)
+    figures = chart_cache.figures(PAGE, selected_question, result,
+                                  lambda _, frame: question.figures(frame, values), variant)
+    for fig in figures:
+        st.plotly_chart(fig)
+
+
+def question_query(question, filters, values=None):
+    # (query, params) with the parameters bound and the filters pushed into the SQL
+    # where the question supports them
+    return get_question(PAGE, question).bind(values, filters)
+
+
+def approximate_answer(question, filters=None, top_n=10):
+    # Top n from the Space-Saving sketches, with how far each count may be over
+    flag, count_column = APPROXIMATE_QUESTIONS[question]
+    sketches = get_vehicle_sketches()
+    top, vehicles, vehicles_error, stops = sketches.estimate(flag, top_n, filters)
+    result = top.rename(columns={"count": count_column})
+    note = (f"Estimated from sketches: about {vehicles:,} ± {vehicles_error:,} distinct vehicles in {stops:,} stops. "
+            f"Counts are at most max_overcount too high; guaranteed rows are certainly in the exact top {top_n}.")
+    if filters and (filters.get("start") or filters.get("end")):
+        note += " Dates are rounded out to whole months."
+    if sketches.last_error:
+        note += f" Not refreshed: {sketches.last_error}"
+    result.attrs["approximate"] = note
+    return result
+
+
+def answer(question, use_engine, filters=None, approximate=False, values=None):
+    entry = get_question(PAGE, question)
+    values = entry.values(values)
+    shard_set = get_shards()
+    if shard_set is not None:
+        # Sharded deployments: no single database, snapshot or engine holds every row
+        return shard_set.answer(entry, values, filters)
+    if approximate and question in APPROXIMATE_QUESTIONS:
+        return approximate_answer(question, filters, values["top_n"])
+    if filters and entry.filterable:
+        # Filtered answers always come from the database: snapshots and the engine hold everything
+        query, params = entry.bind(values, filters)
+        return fetch_data(query, params, page=PAGE, label=question, prepared=True)
+    if entry.is_default(values):
+        # Right after a restart, answers come from the local snapshot (taken with the defaults)
+        result = snapshot_result(PAGE, question)
+        if result is not None:
+            return result
+    if use_engine:
+        return get_columnar_table().answer(question, values)
+    query, params = entry.bind(values)
+    return fetch_data(query, params, page=PAGE, label=question, prepared=True)
+
+
+def run_report(questions, use_engine, filters=None, approximate=False):
+    # Every question gets a slot up front so the report keeps catalog order while
+    # results arrive in completion order. Each runs with the parameters last set for it.
+    progress = st.progress(0.0, text=f"Running {len(questions)} queries...")
+    slots = {}
+    values = {question: session_values(get_question(PAGE, question), "fundamental") for question in questions}
+    for question in questions:
+        slot = st.container()
+        slot.markdown(f"### {get_question(PAGE, question).heading(values[question])}")
+        slots[question] = (slot, slot.empty())
+        slots[question][1].caption("⏳ Running...")
+
+    started = time.perf_counter()
+    if use_engine or approximate or serving_snapshot() is not None or get_shards() is not None:
+        # In-process answers take milliseconds, so they run one after another; sharded
+        # answers already fan out to every shard in parallel
+        def answer_all():
+            for question in questions:
+                answered = time.perf_counter()
+                result = answer(question, use_engine, filters, approximate, values[question])
+                yield question, result, None, time.perf_counter() - answered
+
+        results = answer_all()
+    else:
+        results = fetch_many({question: question_query(question, filters, values[question]) for question in questions},
+                             page=PAGE, prepared=True)
+
+    query_seconds = 0.0
+    for done, (question, result, error, seconds) in enumerate(results, start=1):
+        query_seconds += seconds
+        slot, status = slots[question]
+        status.empty()
+        with slot:
+            if error is not None:
+                st.error(f"Query failed after {seconds:.1f}s: {error}")
+            elif result.empty:
+                st.warning("No results found.")
+            else:
+                show_result(question, result, filters, values[question])
+                st.caption(f"Answered in {seconds * 1000:.0f} ms")
+            st.markdown("---")
+        progress.progress(done / len(questions), text=f"{done} of {len(questions)} queries finished")
+
+    st.caption(f"Report finished in {time.perf_counter() - started:.2f}s wall time "
+               f"({query_seconds:.2f}s of query time).")
+
 
 def show_fundamental_insights():
     st.title("💡 Fundamental Insights")
 
-    # Define categories and questions
-    category_map = {
-        "🚗 Vehicle-Based": [
-            "What are the top 10 vehicles involved in drug-related stops?",
-            "Which vehicles were most frequently searched?"
-        ],
-        "🧍 Demographic-Based": [
-            "Which driver age group had the highest arrest rate?",
-            "What is the gender distribution of drivers stopped in each country?",
-            "Which race and gender combination has the highest search rate?"
-        ],
-        "🕒 Time & Duration Based": [
-        "What time of day sees the most traffic stops?",
-        "What is the average stop duration for different violations?",
-        "Are stops during the night more likely to lead to arrests?"
-        ],
-        "⚖️ Violation-Based": [
-            "Which violations are most associated with searches or arrests?",
-            "Which violations are most common among younger drivers (<25)?",
-            "Is there a violation that rarely results in search or arrest?"
-        ],
-        "🌍 Location-Based": [
-            "Which countries report the highest rate of drug-related stops?",
-            "What is the arrest rate by country and violation?",
-            "Which country has the most stops with search conducted?"
-        ]
-    }
-
-    # Define queries
-    query_map = {
-        "What are the top 10 vehicles involved in drug-related stops?":
-            """
-            SELECT vehicle_number, COUNT(*) AS stop_count
-            FROM traffic_stops
-            WHERE drugs_related_stop = 1 AND vehicle_number IS NOT NULL AND vehicle_number != ''
-            GROUP BY vehicle_number
-            ORDER BY stop_count DESC
-            LIMIT 10
-            """,
-
-        "Which vehicles were most frequently searched?":
-            """
-            SELECT vehicle_number, COUNT(*) AS search_count
-            FROM traffic_stops
-            WHERE search_conducted = 1 AND vehicle_number IS NOT NULL AND vehicle_number != ''
-            GROUP BY vehicle_number
-            ORDER BY search_count DESC
-            LIMIT 10
-            """,
-
-        "Which driver age group had the highest arrest rate?":
-            """
-            SELECT 
-                CASE 
-                    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
-                    WHEN driver_age BETWEEN 26 AND 35 THEN '26-35'
-                    WHEN driver_age BETWEEN 36 AND 45 THEN '36-45'
-                    WHEN driver_age BETWEEN 46 AND 60 THEN '46-60'
-                    ELSE '60+' 
-                END AS age_group,
-                ROUND(SUM(CASE WHEN is_arrested = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS arrest_rate
-            FROM traffic_stops
-            WHERE driver_age IS NOT NULL
-            GROUP BY age_group
-            ORDER BY arrest_rate DESC
-            """,
-
-        "What is the gender distribution of drivers stopped in each country?":
-            """
-            SELECT country_name, driver_gender, COUNT(*) AS count
-            FROM traffic_stops
-            GROUP BY country_name, driver_gender
-            ORDER BY country_name, driver_gender
-            """,
-
-        "Which race and gender combination has the highest search rate?":
-            """
-            SELECT driver_race, driver_gender,
-                   ROUND(SUM(CASE WHEN search_conducted = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS search_rate
-            FROM traffic_stops
-            GROUP BY driver_race, driver_gender
-            ORDER BY search_rate DESC
-            LIMIT 5
-            """,
-        "What time of day sees the most traffic stops?": """
-            SELECT 
-                CASE 
-                    WHEN CAST(LEFT(stop_time, 2) AS UNSIGNED) BETWEEN 6 AND 11 THEN 'Morning'
-                    WHEN CAST(LEFT(stop_time, 2) AS UNSIGNED) BETWEEN 12 AND 17 THEN 'Afternoon'
-                    WHEN CAST(LEFT(stop_time, 2) AS UNSIGNED) BETWEEN 18 AND 21 THEN 'Evening'
-                    ELSE 'Night'
-                END AS time_of_day,
-                COUNT(*) AS stop_count
-            FROM traffic_stops
-            GROUP BY time_of_day
-            ORDER BY stop_count DESC
-        """,
-
-        "What is the average stop duration for different violations?": """
-            SELECT violation,
-                ROUND(AVG(
-                    CASE stop_duration
-                        WHEN '0-15 Min' THEN 7.5
-                        WHEN '16-30 Min' THEN 23
-                        WHEN '30+ Min' THEN 40
-                    END
-                ), 2) AS avg_duration_min
-            FROM traffic_stops
-            GROUP BY violation
-            ORDER BY avg_duration_min DESC
-        """,
-
-        "Are stops during the night more likely to lead to arrests?": """
-            SELECT time_segment,
-                ROUND(SUM(CASE WHEN is_arrested = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS arrest_rate
-            FROM (
-                SELECT *,
-                    CASE 
-                        WHEN CAST(LEFT(stop_time, 2) AS UNSIGNED) BETWEEN 22 AND 23 
-                                OR CAST(LEFT(stop_time, 2) AS UNSIGNED) BETWEEN 0 AND 5 THEN 'Night'
-                        ELSE 'Day'
-                    END AS time_segment
-                FROM traffic_stops
-            ) AS sub
-            GROUP BY time_segment
-        """,
-
-        "Which violations are most associated with searches or arrests?": """
-            SELECT violation,
-                ROUND(SUM(CASE WHEN search_conducted = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS search_rate,
-                ROUND(SUM(CASE WHEN is_arrested = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY violation
-            ORDER BY search_rate DESC
-        """,
-
-        "Which violations are most common among younger drivers (<25)?": """
-            SELECT violation, COUNT(*) AS count
-            FROM traffic_stops
-            WHERE driver_age < 25
-            GROUP BY violation
-            ORDER BY count DESC
-        """,
-
-        "Is there a violation that rarely results in search or arrest?": """
-            SELECT violation,
-                ROUND(SUM(CASE WHEN search_conducted = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS search_rate,
-                ROUND(SUM(CASE WHEN is_arrested = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY violation
-            HAVING search_rate < 50 AND arrest_rate < 50
-            ORDER BY violation
-        """,
-
-        "Which countries report the highest rate of drug-related stops?": """
-            SELECT country_name,
-                ROUND(SUM(CASE WHEN drugs_related_stop = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS drug_stop_rate
-            FROM traffic_stops
-            GROUP BY country_name
-            ORDER BY drug_stop_rate DESC
-        """,
-
-        "What is the arrest rate by country and violation?": """
-            SELECT country_name, violation,
-                ROUND(SUM(CASE WHEN is_arrested = 1 THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY country_name, violation
-            ORDER BY country_name, arrest_rate DESC
-        """,
-
-        "Which country has the most stops with search conducted?": """
-            SELECT country_name, COUNT(*) AS search_count
-            FROM traffic_stops
-            WHERE search_conducted = 1
-            GROUP BY country_name
-            ORDER BY search_count DESC
-        """
-
-    }
-
-    # UI - Category and question selection
+    # UI - Category and question selection, generated from the query catalog
+    category_map = categories(PAGE)
     category = st.selectbox("Select Category", list(category_map.keys()))
-    selected_question = st.selectbox("Select a Question", category_map[category])
+    selected_question = st.selectbox("Select a Question", category_map[category],
+                                     format_func=lambda title: session_heading(PAGE, title, "fundamental"),
+                                     key="fundamental_question")
+    values = param_controls(get_question(PAGE, selected_question), "fundamental")
 
     # Run query on button click
-    if st.button("Run Query"):
-        query = query_map[selected_question]
-        result = fetch_data(query)
+    use_engine = st.checkbox("⚡ Use in-memory engine", help="Answer from a columnar copy of the data loaded once per server")
+    approximate = st.checkbox("≈ Approximate vehicle rankings",
+                              help="Answer the vehicle top 10s from constant-memory sketches, with error bounds")
+    filters = filter_controls("fundamental")
+
+    col1, col2, col3 = st.columns(3)
+    run_one = col1.button("Run Query")
+    run_category = col2.button("▶️ Run All in Category")
+    run_everything = col3.button("⏩ Run Every Question")
+
+    if run_category or run_everything:
+        questions = category_map[category] if run_category else [
+            question for questions in category_map.values() for question in questions
+        ]
+        run_report(questions, use_engine, filters, approximate)
+
+    elif run_one:
+        result = answer(selected_question, use_engine, filters, approximate, values)
 
         if result.empty:
             st.warning("No results found.")
             return
 
-        # Display result table
-        if selected_question in [
-            "What are the top 10 vehicles involved in drug-related stops?",
-            "Which vehicles were most frequently searched?"
-        ]:
-            st.subheader("📊 Query Output")
-            st.dataframe(result[['vehicle_number']])
-        else:
-            st.subheader("📊 Query Output")
-            st.dataframe(result)
-
-        st.markdown("---")
-        st.subheader("📈 Visualization")
-        if selected_question == "What are the top 10 vehicles involved in drug-related stops?":
-            fig = px.bar(result, x='vehicle_number', y='stop_count',
-                         title='Top 10 Vehicles in Drug-Related Stops',
-                         labels={'vehicle_number': 'Vehicle', 'stop_count': 'Number of Stops'})
-            fig.update_layout(xaxis_title="Vehicle", yaxis_title="Stops")
-            st.plotly_chart(fig)
-
-        elif selected_question == "Which vehicles were most frequently searched?":
-            fig = px.bar(result, x='vehicle_number', y='search_count',
-                         title='Most Frequently Searched Vehicles',
-                         labels={'vehicle_number': 'Vehicle', 'search_count': 'Search Count'})
-            fig.update_layout(xaxis_title="Vehicle", yaxis_title="Searches")
-            st.plotly_chart(fig)
-
-        elif selected_question == "Which driver age group had the highest arrest rate?":
-            fig = px.bar(result, x='age_group', y='arrest_rate',
-                         title='Arrest Rate by Driver Age Group',
-                         labels={'age_group': 'Age Group', 'arrest_rate': 'Arrest Rate (%)'})
-            fig.update_layout(yaxis_range=[45, 55])
-            st.plotly_chart(fig)
-
-        elif selected_question == "What is the gender distribution of drivers stopped in each country?":
-            fig = px.bar(result, x='country_name', y='count', color='driver_gender',
-                         barmode='group', title='Gender Distribution of Drivers by Country',
-                         labels={'country_name': 'Country', 'count': 'Count'})
-            fig.update_layout(yaxis_range=[10000, 12000])
-            st.plotly_chart(fig)
-
-        elif selected_question == "Which race and gender combination has the highest search rate?":
-            fig = px.bar(result, x='driver_race', y='search_rate', color='driver_gender',
-                         title='Top Race-Gender Combinations by Search Rate',
-                         labels={'driver_race': 'Race', 'search_rate': 'Search Rate (%)'})
-            fig.update_layout(yaxis_range=[45, 55])
-            st.plotly_chart(fig)
-        
-        elif selected_question == "What time of day sees the most traffic stops?":
-            fig = px.pie(result, names='time_of_day', values='stop_count',
-                        title='Traffic Stops by Time of Day',
-                        hole=0.4)
-            st.plotly_chart(fig)
-
-        elif selected_question == "What is the average stop duration for different violations?":
-            fig = px.bar(result, x='violation', y='avg_duration_min',
-                         title='Average Stop Duration by Violation',
-                         labels={'violation': 'Violation', 'avg_duration_min': 'Avg Duration (min)'})
-            fig.update_layout(yaxis_range=[23, 24])
-            st.plotly_chart(fig)
-
-        elif selected_question == "Are stops during the night more likely to lead to arrests?":
-            fig = px.pie(result, names='time_segment', values='arrest_rate',
-                        title='Arrest Rate: Night vs Day',
-                        hole=0.4)
-            st.plotly_chart(fig)
-        
-        elif selected_question == "Which violations are most associated with searches or arrests?":
-            melted = result.melt(id_vars='violation', value_vars=['search_rate', 'arrest_rate'],
-                                var_name='Metric', value_name='Rate')
-            fig = px.bar(melted, x='violation', y='Rate', color='Metric', barmode='group',
-                        title='Search and Arrest Rates by Violation',
-                        labels={'violation': 'Violation', 'Rate': 'Rate (%)'})
-            fig.update_layout(yaxis_range=[48, 51])
-            st.plotly_chart(fig)
-
-        elif selected_question == "Which violations are most common among younger drivers (<25)?":
-            fig = px.pie(result, names='violation', values='count',
-                        title='Violations Among Drivers Under 25',
-                        hole=0.4)
-            st.plotly_chart(fig)
-
-        elif selected_question == "Which countries report the highest rate of drug-related stops?":
-            fig = px.bar(result, x='country_name', y='drug_stop_rate',
-                         title='Drug-Related Stop Rate by Country',
-                         labels={'country_name': 'Country', 'drug_stop_rate': 'Rate (%)'})
-            fig.update_layout(yaxis_range=[49, 51])
-            st.plotly_chart(fig)
-
-        elif selected_question == "What is the arrest rate by country and violation?":
-            fig = px.bar(result, x='violation', y='arrest_rate',
-                         color='country_name', barmode='group',
-                         title='Arrest Rate by Country and Violation',
-                         labels={'violation': 'Violation', 'arrest_rate': 'Arrest Rate (%)'})
-            fig.update_layout(yaxis_range=[49, 51])
-            st.plotly_chart(fig)
-
-        elif selected_question == "Which country has the most stops with search conducted?":
-            fig = px.pie(result, names='country_name', values='search_count',
-                        title='Search-Conducted Stops by Country',
-                        hole=0.4)
-            st.plotly_chart(fig)
+        show_result(selected_question, result, filters, values)
@@ -1,5 +1,76 @@
+import os
+import tempfile
+import threading
 import streamlit as st
 from db_utils import fetch_data
+from snapshots import snapshot_result
+from table_mirror import get_table_mirror
+from pagination import FILTER_COLUMNS, PAGE_SIZES, SORT_COLUMNS, export_view, fetch_filter_values, fetch_page
+
+# All banner counters in a single server-side pass
+METRICS_QUERY = """
+    SELECT
+        COUNT(*) AS total_stops,
+        SUM(CASE WHEN LOWER(stop_outcome) LIKE '%arrest%' THEN 1 ELSE 0 END) AS total_arrests,
+        SUM(CASE WHEN LOWER(stop_outcome) LIKE '%ticket%' THEN 1 ELSE 0 END) AS tickets_issued,
+        SUM(CASE WHEN search_conducted = 1 THEN 1 ELSE 0 END) AS search_conducted
+    FROM traffic_stops
+"""
+
+class DashboardCounters:
+    # METRICS_QUERY kept current from the table mirror's deltas
+    def __init__(self):
+        self._values = {"total_stops": 0, "total_arrests": 0, "tickets_issued": 0, "search_conducted": 0}
+        self._lock = threading.Lock()
+
+    def add_frame(self, frame):
+        outcome = frame["stop_outcome"].astype("string").str.lower()
+        with self._lock:
+            self._values["total_stops"] += len(frame)
+            self._values["total_arrests"] += int(outcome.str.contains("arrest", regex=False).fillna(False).sum())
+            self._values["tickets_issued"] += int(outcome.str.contains("ticket", regex=False).fillna(False).sum())
+            self._values["search_conducted"] += int((frame["search_conducted"] == 1).sum())
+
+    def clear(self):
+        with self._lock:
+            for name in self._values:
+                self._values[name] = 0
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+
+_counters = None
+_counters_lock = threading.Lock()
+
+
+def _mirrored_metrics():
+    # Once another page has loaded the mirror, the banner costs a delta refresh instead of a scan
+    global _counters
+    mirror = get_table_mirror()
+    if not mirror.loaded:
+        return None
+    with _counters_lock:
+        if _counters is None:
+            _counters = DashboardCounters()
+            mirror.subscribe(_counters)
+    mirror.refresh()
+    return _counters.values()
+
+def fetch_dashboard_metrics():
+    metrics = _mirrored_metrics()
+    if metrics is not None:
+        return metrics
+    result = snapshot_result("home", "dashboard metrics")
+    if result is None:
+        result = fetch_data(METRICS_QUERY, page="home", label="dashboard metrics")
+    metrics = {"total_stops": 0, "total_arrests": 0, "tickets_issued": 0, "search_conducted": 0}
+    if not result.empty:
+        for name, value in result.iloc[0].items():
+            # SUM() is NULL on an empty table
+            metrics[name] = 0 if value is None or value != value else int(value)
+    return metrics
 
 def show_dashboard():
     #  Custom CSS
@@ -93,15 +164,12 @@ def show_dashboard():
         </div>
     """, unsafe_allow_html=True)
 
-    # Fetch data
-    query = "SELECT * FROM traffic_stops"
-    data = fetch_data(query)
-
     # Metrics
-    total_stops = data.shape[0]
-    total_arrests = data[data['stop_outcome'].str.contains("Arrest", case=False, na=False)].shape[0]
-    tickets_issued = data[data['stop_outcome'].str.contains("Ticket", case=False, na=False)].shape[0]
-    search_conducted = data[data['search_conducted'] == 1].shape[0]
+    metrics = fetch_dashboard_metrics()
+    total_stops = metrics["total_stops"]
+    total_arrests = metrics["total_arrests"]
+    tickets_issued = metrics["tickets_issued"]
+    search_conducted = metrics["search_conducted"]
 
     # Metrics section with icons
     st.markdown(f"""
@@ -134,7 +202,50 @@ def show_dashboard():
     # Data Table
     st.markdown("---")
     st.header("🗂️ Logs Preview")
+    show_logs_preview()
+
+def show_logs_preview():
+    col1, col2, col3, col4, col5 = st.columns(5)
+    page_size = col1.selectbox("Rows per page", PAGE_SIZES, index=1)
+    sort_column = col2.selectbox("Sort by", SORT_COLUMNS)
+    descending = col3.selectbox("Order", ["Ascending", "Descending"]) == "Descending"
+    filter_column = col4.selectbox("Filter column", ["(none)"] + FILTER_COLUMNS)
+    filter_value = None
+    if filter_column != "(none)":
+        filter_value = col5.selectbox("Filter value", fetch_filter_values(filter_column))
+    filters = {filter_column: filter_value} if filter_value is not None else {}
+
+    # Cursor stack: one entry per page visited, reset whenever the view changes
+    view = (page_size, sort_column, descending, tuple(filters.items()))
+    if st.session_state.get("preview_view") != view:
+        st.session_state["preview_view"] = view
+        st.session_state["preview_cursors"] = [None]
+    cursors = st.session_state["preview_cursors"]
+
+    data, next_cursor = fetch_page(cursors[-1], page_size, sort_column, descending, filters)
     if data.empty:
         st.warning("No data available in the table.")
-    else:
-        st.dataframe(data, use_container_width=True)
+        return
+    st.dataframe(data, use_container_width=True)
+
+    prev_col, page_col, next_col = st.columns([1, 4, 1])
+    page_col.caption(f"Page {len(cursors)}")
+    if prev_col.button("⬅️ Previous", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if next_col.button("Next ➡️", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
+
+    # Built only when clicked: the view is streamed from the database chunk by chunk into a
+    # temporary file, and only the finished file is read back, once, for Streamlit to serve
+    def export_csv():
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", encoding="utf-8", newline="", delete=False) as output:
+            export_view(output, sort_column, descending, filters)
+        try:
+            with open(output.name, "rb") as export:
+                return export.read()
+        finally:
+            os.remove(output.name)
+
+    st.download_button("⬇️ Download this view (CSV)", export_csv, file_name="traffic_stops.csv", mime="text/csv")
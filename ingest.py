@@ -0,0 +1,182 @@
+# Streaming CSV loader for traffic_stops.
+#
+#   python ingest.py "traffic_stops - traffic_stops_with_vehicle_number.csv"
+#
+# Applies the cleaning rules from data_prep_and_sql_initial.ipynb chunk by chunk,
+# inserts each chunk in one transaction and records progress in the same
+# transaction, so an interrupted run resumes after the last committed chunk.
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import pandas as pd
+
+from db_utils import SQLiteBackend, configure_pool, fetch_data, invalidate_cache, transaction
+import rollups
+from migrations import migrate
+
+CHUNK_SIZE = 50000
+# Bytes hashed from each end of the CSV to tell files of the same name and size apart
+FINGERPRINT_BYTES = 65536
+BATCH_SIZE = 5000
+
+INSERT_COLUMNS = [
+    "stop_date", "stop_time", "country_name", "driver_gender", "driver_age_raw", "driver_age",
+    "driver_race", "violation_raw", "violation", "search_conducted", "search_type",
+    "stop_outcome", "is_arrested", "stop_duration", "drugs_related_stop",
+    "vehicle_number", "timestamp",
+]
+CSV_COLUMNS = [column for column in INSERT_COLUMNS if column != "timestamp"]
+
+# Same defaults as the notebook (spelling included, so existing rows and new rows group together)
+FILL_DEFAULTS = {
+    "country_name": "Unkonwn",
+    "driver_gender": "Unkonwn",
+    "driver_race": "Unkonwn",
+    "search_type": "None",
+    "violation": "Unknown",
+    "stop_duration": "Unknown",
+    "stop_outcome": "Unknown",
+    "vehicle_number": "Unkonwn",
+}
+
+INSERT_QUERY = f"""
+    INSERT INTO traffic_stops ({", ".join(INSERT_COLUMNS)})
+    VALUES ({", ".join(["%s"] * len(INSERT_COLUMNS))})
+"""
+
+CHECKPOINT_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+        source VARCHAR(255) PRIMARY KEY,
+        chunks_committed INT NOT NULL,
+        rows_committed BIGINT NOT NULL,
+        median_age DOUBLE,
+        updated_at VARCHAR(32)
+    )
+"""
+
+
+def create_tables():
+    migrate(log=lambda message: None)
+    with transaction() as cursor:
+        cursor.execute(CHECKPOINT_TABLE_QUERY)
+
+
+def source_key(csv_path):
+    # A different file (or a rewritten one) starts from scratch: name and size alone can match
+    # by accident, so the first and last blocks are hashed too
+    size = os.path.getsize(csv_path)
+    digest = hashlib.sha1()
+    with open(csv_path, "rb") as csv_file:
+        digest.update(csv_file.read(FINGERPRINT_BYTES))
+        csv_file.seek(max(size - FINGERPRINT_BYTES, 0))
+        digest.update(csv_file.read(FINGERPRINT_BYTES))
+    return f"{os.path.basename(csv_path)}:{size}:{digest.hexdigest()[:16]}"
+
+
+def load_checkpoint(source):
+    result = fetch_data(
+        "SELECT chunks_committed, rows_committed, median_age FROM ingest_checkpoints WHERE source = %s",
+        (source,), use_cache=False, page="ingest", label="load checkpoint",
+    )
+    if result.empty:
+        return None
+    row = result.iloc[0]
+    return int(row["chunks_committed"]), int(row["rows_committed"]), float(row["median_age"])
+
+
+def median_age(csv_path, chunk_size=CHUNK_SIZE):
+    # First pass: only driver_age is parsed, and ages are kept as a value histogram,
+    # so the exact median needs memory proportional to the number of distinct ages
+    histogram = pd.Series(dtype="int64")
+    for chunk in pd.read_csv(csv_path, usecols=["driver_age"], chunksize=chunk_size):
+        histogram = histogram.add(chunk["driver_age"].dropna().value_counts(), fill_value=0)
+    if histogram.empty:
+        return None
+    histogram = histogram.sort_index()
+    cumulative = histogram.cumsum()
+    total = int(cumulative.iloc[-1])
+    lower = histogram.index[cumulative.searchsorted((total + 1) // 2)]
+    upper = histogram.index[cumulative.searchsorted(total // 2 + 1)]
+    return (float(lower) + float(upper)) / 2
+
+
+def clean_chunk(chunk, driver_age_median):
+    chunk = chunk.reindex(columns=CSV_COLUMNS)
+    chunk = chunk.fillna({**FILL_DEFAULTS, "driver_age": driver_age_median})
+    chunk["timestamp"] = pd.to_datetime(chunk["stop_date"] + " " + chunk["stop_time"], errors="coerce")
+    chunk["timestamp"] = chunk["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    # Plain Python values (None for missing) are what the DB drivers accept
+    chunk = chunk[INSERT_COLUMNS].astype(object)
+    return chunk.where(chunk.notna(), None)
+
+
+def insert_chunk(cleaned, source, chunks_committed, rows_committed, driver_age_median, batch_size=BATCH_SIZE):
+    rows = list(cleaned.itertuples(index=False, name=None))
+    with transaction() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(INSERT_QUERY, rows[start:start + batch_size])
+        rollups.apply_frame(cursor, cleaned)
+        cursor.execute(
+            "REPLACE INTO ingest_checkpoints (source, chunks_committed, rows_committed, median_age, updated_at) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            (source, chunks_committed, rows_committed, driver_age_median, time.strftime("%Y-%m-%d %H:%M:%S")),
+        )
+
+
+def ingest(csv_path, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, resume=True, log=print):
+    create_tables()
+    source = source_key(csv_path)
+    checkpoint = load_checkpoint(source) if resume else None
+
+    if checkpoint:
+        chunks_done, rows_done, driver_age_median = checkpoint
+        log(f"Resuming after chunk {chunks_done} ({rows_done} rows already loaded)")
+    else:
+        chunks_done, rows_done = 0, 0
+        driver_age_median = median_age(csv_path, chunk_size)
+        log(f"Median driver age: {driver_age_median}")
+
+    started = time.perf_counter()
+    inserted = 0
+    reader = pd.read_csv(
+        csv_path, chunksize=chunk_size,
+        skiprows=range(1, rows_done + 1) if rows_done else None,
+    )
+    for chunk in reader:
+        if chunk.empty:
+            continue
+        chunk_started = time.perf_counter()
+        cleaned = clean_chunk(chunk, driver_age_median)
+        chunks_done += 1
+        rows_done += len(cleaned)
+        insert_chunk(cleaned, source, chunks_done, rows_done, driver_age_median, batch_size)
+        inserted += len(cleaned)
+        elapsed = time.perf_counter() - chunk_started
+        log(f"Chunk {chunks_done}: {len(cleaned)} rows in {elapsed:.2f}s ({len(cleaned) / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    total_elapsed = time.perf_counter() - started
+    invalidate_cache()
+    log(f"Inserted {inserted} rows in {total_elapsed:.2f}s ({inserted / max(total_elapsed, 1e-9):,.0f} rows/s)")
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load a traffic stops CSV into the SecureCheck database.")
+    parser.add_argument("csv_path")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="CSV rows per committed chunk")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per executemany call")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    parser.add_argument("--sqlite", metavar="PATH", help="load into a SQLite file instead of MySQL")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    ingest(args.csv_path, args.chunk_size, args.batch_size, resume=not args.restart)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
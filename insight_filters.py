@@ -0,0 +1,110 @@
+# Date-range and country filters for the insight questions. A question opts in with a
+# marker comment where its predicates go: /*where stop_day*/ (no WHERE clause yet) or
+# /*and timestamp*/ (after an existing one), naming the date column to range over.
+# Unfiltered, the marker is just a comment. Filtered, it becomes plain column
+# comparisons with bound parameters, so indexes on (country_name, date column) and
+# year partitions can narrow the scan instead of wrapping the column in YEAR().
+import datetime
+import re
+import sqlite3
+
+import mysql.connector
+import streamlit as st
+from db_utils import query_data
+from snapshots import serving_snapshot
+from table_mirror import get_table_mirror
+
+FILTER_MARKER = re.compile(r"/\*(where|and) (\w+)\*/")
+PERIODS = {"All time": None, "Last 30 days": 30, "Last 90 days": 90, "Last 12 months": 365, "Custom range": None}
+# Read from the (country_name, stop_day) index of the rollup table rather than traffic_stops
+COUNTRIES_QUERY = "SELECT DISTINCT country_name FROM rollup_time WHERE country_name IS NOT NULL ORDER BY country_name"
+
+# Snapshot path -> its countries; a snapshot never changes
+_snapshot_countries = {}
+
+
+def is_filterable(query):
+    return FILTER_MARKER.search(query) is not None
+
+
+def filter_clause(keyword, date_column, filters):
+    # "WHERE ..."/"AND ..." for the filters and its parameters; ("", ()) when nothing is narrowed
+    predicates = []
+    params = []
+    if filters and filters.get("countries"):
+        predicates.append(f"country_name IN ({', '.join(['%s'] * len(filters['countries']))})")
+        params.extend(filters["countries"])
+    if filters and filters.get("start"):
+        predicates.append(f"{date_column} >= %s")
+        params.append(filters["start"].isoformat())
+    if filters and filters.get("end"):
+        # Half-open upper bound so DATETIME values late on the last day still match
+        predicates.append(f"{date_column} < %s")
+        params.append((filters["end"] + datetime.timedelta(days=1)).isoformat())
+    if not predicates:
+        return "", ()
+    return f"{keyword.upper()} {' AND '.join(predicates)}", tuple(params)
+
+
+def apply_filters(query, filters):
+    # filters: {"start": date, "end": date (inclusive), "countries": [...]}; returns (query, params)
+    match = FILTER_MARKER.search(query)
+    if match is None or not filters:
+        return query, None
+    clause, params = filter_clause(*match.groups(), filters)
+    if not clause:
+        return query, None
+    return query[:match.start()] + clause + query[match.end():], params
+
+
+def describe(filters):
+    # Short text for captions and cache keys
+    if not filters:
+        return ""
+    parts = []
+    if filters.get("countries"):
+        parts.append(", ".join(filters["countries"]))
+    if filters.get("start") or filters.get("end"):
+        parts.append(f"{filters.get('start') or '…'} to {filters.get('end') or '…'}")
+    return "; ".join(parts)
+
+
+def country_options():
+    # Countries for the filter, without reading traffic_stops: the mirror's dictionary once it
+    # is loaded, the snapshot while one is served (so a cold start needs no database), else the
+    # rollup table through the result cache. Empty when none of them can answer.
+    mirror = get_table_mirror()
+    if mirror.loaded:
+        return sorted(mirror.table.labels["country_name"])
+    snapshot = serving_snapshot()
+    if snapshot is not None:
+        if snapshot.path not in _snapshot_countries:
+            import pyarrow.compute as pc
+
+            values = pc.unique(snapshot.table().column("country_name")).to_pylist()
+            _snapshot_countries[snapshot.path] = sorted(value for value in values if value is not None)
+        return _snapshot_countries[snapshot.path]
+    try:
+        result = query_data(COUNTRIES_QUERY, page="insights", label="filter values: country_name")
+    except (mysql.connector.Error, sqlite3.Error, TimeoutError):
+        return []
+    return result["country_name"].tolist()
+
+
+def filter_controls(key):
+    # Renders the filter widgets; returns the filters dict, or None when nothing is narrowed
+    with st.expander("🔎 Filters (date range and country)"):
+        col1, col2 = st.columns(2)
+        period = col1.selectbox("Period", list(PERIODS), key=f"{key}_period")
+        countries = col2.multiselect("Country", country_options(), key=f"{key}_countries")
+        start = end = None
+        if period == "Custom range":
+            picked = st.date_input("Dates", value=(), key=f"{key}_dates")
+            if len(picked) == 2:
+                start, end = picked
+        elif PERIODS[period]:
+            end = datetime.date.today()
+            start = end - datetime.timedelta(days=PERIODS[period] - 1)
+    if not countries and start is None:
+        return None
+    return {"start": start, "end": end, "countries": countries}
@@ -0,0 +1,239 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+
+import rollups
+from db_utils import invalidate_cache, is_data_error, transaction
+from sketches import refresh_sketches
+from table_mirror import refresh_mirror
+
+BATCH_SIZE = int(os.environ.get("SECURECHECK_WRITE_BATCH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.environ.get("SECURECHECK_WRITE_FLUSH_INTERVAL", "2.0"))
+MAX_RETRY_DELAY = 60.0
+# Pending logs are appended here before they are queued, so nothing is lost if the DB is down
+SPOOL_PATH = os.environ.get("SECURECHECK_WRITE_SPOOL", "pending_logs.jsonl")
+# Rows the database rejects (bad values, not an outage) are moved here with the error
+DEAD_LETTER_PATH = os.environ.get("SECURECHECK_WRITE_DEAD_LETTER", "failed_logs.jsonl")
+
+LOG_COLUMNS = [
+    "stop_date", "stop_time", "country_name", "driver_gender", "driver_age_raw", "driver_age",
+    "driver_race", "violation_raw", "violation", "search_conducted", "search_type",
+    "stop_outcome", "is_arrested", "stop_duration", "drugs_related_stop",
+    "vehicle_number", "timestamp", "log_key",
+]
+
+INSERT_QUERY = f"""
+    INSERT INTO traffic_stops ({", ".join(LOG_COLUMNS)})
+    VALUES ({", ".join(["%s"] * len(LOG_COLUMNS))})
+"""
+
+
+class LogWriter:
+    # Write-behind queue for new police logs. Records are flushed as one multi-row
+    # INSERT when batch_size is reached or the oldest record is flush_interval old.
+    # Flushes that fail on the connection keep the records (and the spool file) and retry
+    # with backoff; a batch with rejected values is retried row by row and the rejected rows
+    # go to the dead-letter file. Every record has a log_key, and rows whose key is already
+    # in the table are skipped, so replaying the spool after a crash inserts nothing twice.
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, spool_path=SPOOL_PATH,
+                 dead_letter_path=DEAD_LETTER_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.dead_letter_path = dead_letter_path
+        self._pending = []
+        self._oldest = None
+        self._retry_at = 0.0
+        self._retry_delay = 1.0
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.failed_flushes = 0
+        self.skipped = 0
+        self.dead_letters = 0
+        self.last_flush = None
+        self.last_error = None
+        self._load_spool()
+        self._thread = threading.Thread(target=self._run, name="securecheck-log-writer", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, listener):
+        # listener(rows) is called after every successful flush with the records written
+        self._listeners.append(listener)
+
+    def submit(self, record):
+        row = {column: record.get(column) for column in LOG_COLUMNS}
+        row["log_key"] = row["log_key"] or uuid.uuid4().hex
+        with self._cond:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                spool.write(json.dumps(row) + "\n")
+            self._pending.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _load_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path, encoding="utf-8") as spool:
+            self._pending = [json.loads(line) for line in spool if line.strip()]
+        # Spools from before log keys existed
+        for row in self._pending:
+            row["log_key"] = row.get("log_key") or uuid.uuid4().hex
+        if self._pending:
+            self._oldest = time.monotonic()
+
+    def _rewrite_spool(self):
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as spool:
+            for row in self._pending:
+                spool.write(json.dumps(row) + "\n")
+        os.replace(tmp_path, self.spool_path)
+
+    def _due(self):
+        if not self._pending or time.monotonic() < self._retry_at:
+            return False
+        return len(self._pending) >= self.batch_size or time.monotonic() - self._oldest >= self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    self._cond.wait(timeout=min(self.flush_interval, 1.0))
+                if self._closed:
+                    return
+            self.flush()
+
+    def _unwritten(self, cursor, rows):
+        # Rows whose log_key is not in the table yet
+        keys = [row["log_key"] for row in rows]
+        cursor.execute(f"SELECT log_key FROM traffic_stops WHERE log_key IN ({', '.join(['%s'] * len(keys))})", keys)
+        present = {key for key, in cursor.fetchall()}
+        return [row for row in rows if row["log_key"] not in present]
+
+    def _write(self, rows):
+        # One transaction; returns the rows actually inserted
+        with transaction() as cursor:
+            rows = self._unwritten(cursor, rows)
+            if rows:
+                cursor.executemany(INSERT_QUERY, [tuple(row[column] for column in LOG_COLUMNS) for row in rows])
+                rollups.apply_rows(cursor, rows)
+        return rows
+
+    def _write_rows(self, batch):
+        # After a data error: each row in its own transaction, rejected ones to the dead-letter file.
+        # Anything else (the database went away) is raised; rows already in are skipped next time.
+        written = []
+        rejected = 0
+        for row in batch:
+            try:
+                written.extend(self._write([row]))
+            except Exception as e:
+                if not is_data_error(e):
+                    raise
+                with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letters:
+                    dead_letters.write(json.dumps({"row": row, "error": str(e), "at": time.time()}) + "\n")
+                rejected += 1
+                with self._cond:
+                    self.dead_letters += 1
+                    self.last_error = f"Rejected log moved to {self.dead_letter_path}: {e}"
+        return written, rejected
+
+    def flush(self):
+        # Writes everything pending in batch_size chunks; returns the number of rows written
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = self._pending[:self.batch_size]
+                if not batch:
+                    break
+                started = time.perf_counter()
+                rejected = 0
+                try:
+                    try:
+                        rows = self._write(batch)
+                    except Exception as e:
+                        if not is_data_error(e):
+                            raise
+                        rows, rejected = self._write_rows(batch)
+                except Exception as e:
+                    with self._cond:
+                        self.failed_flushes += 1
+                        self.last_error = str(e)
+                        self._retry_at = time.monotonic() + self._retry_delay
+                        self._retry_delay = min(self._retry_delay * 2, MAX_RETRY_DELAY)
+                    break
+                with self._cond:
+                    del self._pending[:len(batch)]
+                    self._oldest = time.monotonic() if self._pending else None
+                    self._rewrite_spool()
+                    self._retry_delay = 1.0
+                    if not rejected:
+                        self.last_error = None
+                    self.written += len(rows)
+                    # Already in the table: committed before a crash and replayed from the spool
+                    self.skipped += len(batch) - len(rows) - rejected
+                    self.last_flush = {
+                        "rows": len(rows),
+                        "seconds": round(time.perf_counter() - started, 4),
+                        "at": time.time(),
+                    }
+                written += len(rows)
+                if not rows:
+                    continue
+                for listener in self._listeners:
+                    try:
+                        listener(rows)
+                    except Exception as e:
+                        self.last_error = f"Listener failed: {e}"
+        return written
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "written": self.written,
+                "failed_flushes": self.failed_flushes,
+                "skipped": self.skipped,
+                "dead_letters": self.dead_letters,
+                "last_flush": self.last_flush,
+                "last_error": self.last_error,
+            }
+
+
+def _refresh_derived_data(rows):
+    invalidate_cache()
+    # The mirror and the sketches read the new rows back by id
+    refresh_mirror()
+    refresh_sketches()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+            _writer.subscribe(_refresh_derived_data)
+            atexit.register(_writer.close)
+        return _writer
@@ -0,0 +1,265 @@
+# Versioned schema migrations for the SecureCheck database.
+#
+#   python migrations.py             # MySQL (settings from db_utils)
+#   python migrations.py --sqlite securecheck.db
+#
+# Every step checks the live schema before changing it, so migrations can be
+# re-run safely on databases created by the notebook or by an older version.
+import argparse
+import sys
+import time
+
+import rollups
+from db_utils import SQLiteBackend, configure_pool, get_pool, invalidate_cache, transaction
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS traffic_stops (
+        id {id_column},
+        stop_date VARCHAR(20),
+        stop_time VARCHAR(20),
+        country_name VARCHAR(100),
+        driver_gender VARCHAR(10),
+        driver_age_raw INT,
+        driver_age INT,
+        driver_race VARCHAR(50),
+        violation_raw VARCHAR(100),
+        violation VARCHAR(100),
+        search_conducted BOOLEAN,
+        search_type VARCHAR(100),
+        stop_outcome VARCHAR(100),
+        is_arrested BOOLEAN,
+        stop_duration VARCHAR(100),
+        drugs_related_stop BOOLEAN,
+        vehicle_number VARCHAR(100),
+        timestamp DATETIME
+    )
+"""
+ID_COLUMN = {
+    "mysql": "INT AUTO_INCREMENT PRIMARY KEY",
+    "sqlite": "INTEGER PRIMARY KEY AUTOINCREMENT",
+}
+
+MIGRATIONS_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at VARCHAR(32)
+    )
+"""
+
+AGE_GROUP_EXPRESSION = """CASE
+            WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
+            WHEN driver_age BETWEEN 26 AND 35 THEN '26-35'
+            WHEN driver_age BETWEEN 36 AND 45 THEN '36-45'
+            WHEN driver_age BETWEEN 46 AND 60 THEN '46-60'
+            ELSE '60+'
+        END"""
+
+# Derived columns, stored in MySQL. SQLite can only add VIRTUAL generated columns,
+# which it still indexes.
+DERIVED_COLUMNS = {
+    "stop_hour": {
+        "mysql": "TINYINT UNSIGNED AS (CAST(LEFT(stop_time, 2) AS UNSIGNED)) STORED",
+        "sqlite": "INTEGER GENERATED ALWAYS AS (CAST(substr(stop_time, 1, 2) AS INTEGER)) VIRTUAL",
+    },
+    "stop_day": {
+        "mysql": "DATE AS (DATE(timestamp)) STORED",
+        "sqlite": "DATE GENERATED ALWAYS AS (date(timestamp)) VIRTUAL",
+    },
+    "age_group": {
+        "mysql": f"VARCHAR(5) AS ({AGE_GROUP_EXPRESSION}) STORED",
+        "sqlite": f"VARCHAR(5) GENERATED ALWAYS AS ({AGE_GROUP_EXPRESSION}) VIRTUAL",
+    },
+}
+
+# Tuned to the insight queries: vehicle lookups, the drug/search vehicle rankings
+# (covering indexes), country x violation rollups and time-based breakdowns
+INSIGHT_INDEXES = {
+    "idx_vehicle_number": ["vehicle_number"],
+    "idx_country_violation": ["country_name", "violation"],
+    "idx_timestamp": ["timestamp"],
+    "idx_drugs_vehicle": ["drugs_related_stop", "vehicle_number"],
+    "idx_search_vehicle": ["search_conducted", "vehicle_number"],
+    "idx_stop_hour": ["stop_hour"],
+    "idx_stop_day": ["stop_day"],
+}
+
+# Date-range and country filters on the insight pages compare these columns directly
+FILTER_INDEXES = {
+    "traffic_stops": {"idx_country_timestamp": ["country_name", "timestamp"]},
+    "rollup_time": {"idx_rollup_time_day": ["stop_day"], "idx_rollup_time_country_day": ["country_name", "stop_day"]},
+}
+
+# Home logs preview sorts: (column, id) serves ORDER BY column, id and the keyset seek of any
+# page. idx_timestamp and idx_vehicle_number already do, since every index ends in the row id.
+SORT_INDEXES = {
+    "idx_sort_country": ["country_name", "id"],
+    "idx_sort_violation": ["violation", "id"],
+    "idx_sort_outcome": ["stop_outcome", "id"],
+}
+
+LOG_KEY_COLUMNS = {"log_key": {"mysql": "VARCHAR(32)", "sqlite": "VARCHAR(32)"}}
+
+
+def _dialect():
+    return get_pool().backend.name
+
+
+def existing_columns(cursor, table):
+    if _dialect() == "sqlite":
+        # table_xinfo also lists generated columns
+        return {row[1] for row in cursor.execute(f"PRAGMA table_xinfo({table})").fetchall()}
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,),
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def existing_indexes(cursor, table):
+    if _dialect() == "sqlite":
+        return {row[1] for row in cursor.execute(f"PRAGMA index_list({table})").fetchall()}
+    cursor.execute(
+        "SELECT DISTINCT index_name FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,),
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def add_columns(cursor, table, columns):
+    present = existing_columns(cursor, table)
+    dialect = _dialect()
+    for name, definitions in columns.items():
+        if name not in present:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definitions[dialect]}")
+
+
+def create_indexes(cursor, table, indexes):
+    present = existing_indexes(cursor, table)
+    for name, columns in indexes.items():
+        if name not in present:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+
+
+def create_base_table(cursor):
+    cursor.execute(CREATE_TABLE_QUERY.format(id_column=ID_COLUMN[_dialect()]))
+
+
+def add_derived_columns(cursor):
+    add_columns(cursor, "traffic_stops", DERIVED_COLUMNS)
+
+
+def add_insight_indexes(cursor):
+    create_indexes(cursor, "traffic_stops", INSIGHT_INDEXES)
+
+
+def create_rollups(cursor):
+    # Rebuilding is idempotent: the rollups are recomputed from traffic_stops
+    rollups.create_tables(cursor)
+    rollups.rebuild(cursor)
+
+
+def add_filter_indexes(cursor):
+    for table, indexes in FILTER_INDEXES.items():
+        create_indexes(cursor, table, indexes)
+
+
+def add_log_keys(cursor):
+    # Logs written through the Add Log queue carry a unique key, so a batch replayed from the
+    # spool after a crash can skip the rows that were already committed. Not a UNIQUE index:
+    # year partitioning needs timestamp in every unique key.
+    add_columns(cursor, "traffic_stops", LOG_KEY_COLUMNS)
+    create_indexes(cursor, "traffic_stops", {"idx_log_key": ["log_key"]})
+
+
+def add_sort_indexes(cursor):
+    create_indexes(cursor, "traffic_stops", SORT_INDEXES)
+
+
+def partition_by_year(cursor, log=print):
+    # Optional and MySQL only: one RANGE partition per year of timestamp, so a date-range
+    # filter only opens the partitions it overlaps. Every unique key of a partitioned table
+    # must contain the partitioning column, so the primary key becomes (id, timestamp),
+    # which in turn needs every row to have a timestamp.
+    if _dialect() != "mysql":
+        raise RuntimeError("Year partitioning needs MySQL")
+    cursor.execute("SELECT COUNT(*) FROM traffic_stops WHERE timestamp IS NULL")
+    if cursor.fetchall()[0][0]:
+        raise RuntimeError("Rows without a timestamp cannot be partitioned by year")
+    cursor.execute("SELECT MIN(YEAR(timestamp)), MAX(YEAR(timestamp)) FROM traffic_stops")
+    first, last = cursor.fetchall()[0]
+    if first is None:
+        raise RuntimeError("traffic_stops is empty; nothing to partition")
+    # Room for the next few years of new stops; later ones land in p_future
+    years = range(int(first), int(last) + 3)
+    partitions = [f"PARTITION p{year} VALUES LESS THAN ({year + 1})" for year in years]
+    partitions.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    cursor.execute("ALTER TABLE traffic_stops MODIFY timestamp DATETIME NOT NULL, "
+                   "DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)")
+    cursor.execute(f"ALTER TABLE traffic_stops PARTITION BY RANGE (YEAR(timestamp)) ({', '.join(partitions)})")
+    log(f"Partitioned traffic_stops into {len(partitions)} partitions ({first} to {years[-1]} and later)")
+
+
+# (version, name, step): append new migrations, never renumber applied ones
+MIGRATIONS = [
+    (1, "create_traffic_stops", create_base_table),
+    (2, "add_derived_columns", add_derived_columns),
+    (3, "add_insight_indexes", add_insight_indexes),
+    (4, "create_rollups", create_rollups),
+    (5, "add_filter_indexes", add_filter_indexes),
+    (6, "add_log_keys", add_log_keys),
+    (7, "add_sort_indexes", add_sort_indexes),
+]
+
+
+def applied_versions():
+    with transaction() as cursor:
+        cursor.execute(MIGRATIONS_TABLE_QUERY)
+        return {row[0] for row in cursor.execute("SELECT version FROM schema_migrations").fetchall()}
+
+
+def migrate(log=print):
+    # MySQL commits DDL implicitly, which is why each step is idempotent on its own
+    done = applied_versions()
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        started = time.perf_counter()
+        with transaction() as cursor:
+            step(cursor)
+            cursor.execute(
+                "REPLACE INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                (version, name, time.strftime("%Y-%m-%d %H:%M:%S")),
+            )
+        applied.append(version)
+        log(f"Applied migration {version:03d} {name} in {time.perf_counter() - started:.2f}s")
+    if applied:
+        invalidate_cache()
+    else:
+        log("Schema is up to date")
+    return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply SecureCheck schema migrations.")
+    parser.add_argument("--sqlite", metavar="PATH", help="migrate a SQLite file instead of MySQL")
+    parser.add_argument("--partition-by-year", action="store_true",
+                        help="also range-partition traffic_stops by year (MySQL only)")
+    args = parser.parse_args(argv)
+    if args.sqlite and args.partition_by_year:
+        parser.error("--partition-by-year needs MySQL")
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    migrate()
+    if args.partition_by_year:
+        with transaction() as cursor:
+            partition_by_year(cursor)
+        invalidate_cache()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
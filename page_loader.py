@@ -0,0 +1,55 @@
+# Sidebar pages and the modules behind them. A page module, and everything it pulls in
+# (plotly, pyarrow, the query catalogs), is imported the first time the page is opened,
+# so starting the app and switching pages only pays for the page on screen.
+import importlib
+import sys
+import threading
+import time
+
+PAGES = {
+    "🏠 Home": ("home", "show_dashboard"),
+    "💡 Fundamental Insights": ("fundamental_insights", "show_fundamental_insights"),
+    "🧠 Profound Insights": ("profound_insights", "show_profound_insights"),
+    "📝 Add New Police Log": ("add_log", "show_add_log"),
+    "🚘 Vehicle Lookup": ("vehicle_lookup", "show_vehicle_lookup"),
+    "🚨 Alerts": ("alerts", "show_alerts"),
+    "🩺 Diagnostics": ("diagnostics", "show_diagnostics"),
+}
+
+# Seconds per startup step for this server process, shown on the Diagnostics page
+startup_times = {}
+_lock = threading.Lock()
+
+
+def _record(step, seconds):
+    with _lock:
+        startup_times.setdefault(step, round(seconds, 4))
+
+
+def _warm_start():
+    # Serve from the latest local snapshot while the database warms up in the background.
+    # Started with the first page rather than in app.py: snapshots pulls in pandas, pyarrow
+    # and the database drivers, which every page needs anyway.
+    started = time.perf_counter()
+    from snapshots import get_warm_start
+
+    get_warm_start()
+    _record("warm start", time.perf_counter() - started)
+
+
+def load_page(label):
+    # Returns the page's show_* function, importing its module on first use
+    _warm_start()
+    module_name, function_name = PAGES[label]
+    module = sys.modules.get(module_name)
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        _record(f"import {module_name}", time.perf_counter() - started)
+    return getattr(module, function_name)
+
+
+def record_run(seconds):
+    # The first script run of the process is the cold start users wait for
+    _record("first run", seconds)
+
@@ -0,0 +1,209 @@
+# Keyset pagination for the Home logs preview and its CSV export.
+#
+#   python pagination.py check --sqlite securecheck.db    # every sort is an index seek at any depth
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from db_utils import fetch_data, get_pool, query_data, stream_data
+from snapshots import serving_snapshot
+
+PREVIEW_TABLE = "traffic_stops"
+PAGE_SIZES = [25, 50, 100, 250, 500]
+# Columns that can be sorted on; each has a (column, id) index (migrations 3 and 7), so a page
+# is a seek on that index however deep it is
+SORT_COLUMNS = ["id", "timestamp", "country_name", "violation", "stop_outcome", "vehicle_number"]
+FILTER_COLUMNS = ["country_name", "violation", "stop_outcome", "driver_gender", "driver_race", "stop_duration"]
+# A page this far into a sort is checked and timed against the first one; it fails the check
+# when it takes CHECK_SLOWDOWN times as long (plus CHECK_SLACK_MS of noise)
+CHECK_DEPTH = 0.9
+CHECK_SLOWDOWN = 3.0
+CHECK_SLACK_MS = 1.0
+CHECK_REPEATS = 5
+
+
+def _check_column(column, allowed):
+    if column not in allowed:
+        raise ValueError(f"Unsupported column: {column}")
+    return column
+
+
+def _plain(value):
+    # Cursor values go back to the driver as query parameters; NaN/NaT become NULL
+    if value is None or value != value:
+        return None
+    if hasattr(value, "to_pydatetime"):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _select(conditions, params, sort_column, descending):
+    direction = "DESC" if descending else "ASC"
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = "id" if sort_column == "id" else f"{sort_column} {direction}, id"
+    query = f"""
+        SELECT * FROM {PREVIEW_TABLE}
+        {where}
+        ORDER BY {order} {direction}
+    """
+    return query, params
+
+
+def _view_queries(cursor, sort_column, descending, filters):
+    # SELECTs for one sorted, filtered view of the table, starting after `cursor`. Read in
+    # order, they give the view's rows in order, and each one is a single seek on the
+    # (sort column, id) index: the rest of the cursor's sort value, then the values after it,
+    # then (descending) the NULLs, which sort first ascending and last descending in MySQL and
+    # SQLite. A row-value (col, id) > (%s, %s) would be one query, but SQLite only seeks on its
+    # first column, so a deep page in a column with few values walks every row of the value.
+    _check_column(sort_column, SORT_COLUMNS)
+    comparison = "<" if descending else ">"
+
+    conditions = []
+    params = []
+    for column, value in sorted((filters or {}).items()):
+        if value is None or value == "":
+            continue
+        conditions.append(f"{_check_column(column, FILTER_COLUMNS)} = %s")
+        params.append(value)
+
+    if cursor is None:
+        return [_select(conditions, params, sort_column, descending)]
+    if sort_column == "id":
+        return [_select(conditions + [f"id {comparison} %s"], params + [cursor[1]], sort_column, descending)]
+    if cursor[0] is None:
+        queries = [_select(conditions + [f"{sort_column} IS NULL", f"id {comparison} %s"], params + [cursor[1]],
+                           sort_column, descending)]
+        if not descending:
+            queries.append(_select(conditions + [f"{sort_column} IS NOT NULL"], params, sort_column, descending))
+        return queries
+    queries = [_select(conditions + [f"{sort_column} = %s", f"id {comparison} %s"], params + [cursor[0], cursor[1]],
+                       sort_column, descending),
+               _select(conditions + [f"{sort_column} {comparison} %s"], params + [cursor[0]], sort_column, descending)]
+    if descending:
+        queries.append(_select(conditions + [f"{sort_column} IS NULL"], params, sort_column, descending))
+    return queries
+
+
+def _read(queries, wanted, fetch):
+    # Up to `wanted` rows from the queries in order; a query is only run when the page runs
+    # past the end of the one before
+    parts = []
+    for query, params in queries:
+        part = fetch(query + " LIMIT %s", tuple(params) + (wanted,))
+        parts.append(part)
+        wanted -= len(part)
+        if wanted <= 0:
+            break
+    parts = [part for part in parts if not part.empty] or parts[:1]
+    return parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+
+def fetch_page(cursor=None, page_size=50, sort_column="id", descending=False, filters=None):
+    # Keyset pagination: the page starts right after `cursor`, the (sort value, id) of the
+    # previous page's last row, so the database seeks instead of skipping OFFSET rows.
+    # Returns the page and the cursor for the next one (None on the last page).
+    queries = _view_queries(cursor, sort_column, descending, filters)
+    snapshot = serving_snapshot()
+    # One extra row tells us whether a next page exists
+    wanted = int(page_size) + 1
+    if snapshot is not None and cursor is None and sort_column == "id" and not descending and not queries[0][1]:
+        # The default first page is the head of the snapshot, which is stored in id order
+        page = snapshot.head(wanted)
+    else:
+        page = _read(queries, wanted, lambda query, params: fetch_data(query, params, page="home",
+                                                                         label="logs preview page"))
+
+    next_cursor = None
+    if len(page) > page_size:
+        page = page.iloc[:page_size]
+        last = page.iloc[-1]
+        next_cursor = (_plain(last[sort_column]), int(last["id"]))
+    return page.reset_index(drop=True), next_cursor
+
+
+def export_view(output, sort_column="id", descending=False, filters=None, chunk_size=None):
+    # Writes the whole view as CSV to a text file object, one streamed chunk at a time
+    query, params = _view_queries(None, sort_column, descending, filters)[0]
+    options = {} if chunk_size is None else {"chunk_size": chunk_size}
+    rows = 0
+    for chunk in stream_data(query, tuple(params) or None, page="home", label="logs export", **options):
+        chunk.to_csv(output, header=rows == 0, index=False)
+        rows += len(chunk)
+    return rows
+
+
+def fetch_filter_values(column):
+    _check_column(column, FILTER_COLUMNS)
+    result = fetch_data(f"SELECT DISTINCT {column} FROM {PREVIEW_TABLE} WHERE {column} IS NOT NULL ORDER BY {column}",
+                        page="home", label=f"filter values: {column}")
+    return result[column].tolist() if not result.empty else []
+
+
+def _plan_problems(query, params):
+    # What in the query plan reads more than the page: a table scan or a sort of the result
+    if get_pool().backend.name == "sqlite":
+        plan = query_data("EXPLAIN QUERY PLAN " + query, tuple(params) or None, use_cache=False)
+        return [detail for detail in plan["detail"]
+                if "TEMP B-TREE" in detail or (detail.startswith("SCAN") and "USING" not in detail)]
+    plan = query_data("EXPLAIN " + query, tuple(params) or None, use_cache=False)
+    return [f"{row['table']}: type {row['type']}, {row['Extra']}" for _, row in plan.iterrows()
+            if row["type"] == "ALL" or "filesort" in str(row["Extra"] or "")]
+
+
+def _page_ms(cursor, page_size, sort_column, descending):
+    # Median time to read one page straight from the database, without the result cache
+    queries = _view_queries(cursor, sort_column, descending, None)
+    samples = []
+    for _ in range(CHECK_REPEATS):
+        started = time.perf_counter()
+        _read(queries, page_size + 1, lambda query, params: query_data(query, params, use_cache=False))
+        samples.append((time.perf_counter() - started) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+
+def check(page_size=50, log=print):
+    # For every sort, a page CHECK_DEPTH into the table must be index seeks only and take
+    # about as long as the first page. Returns the number of sorts that fail.
+    total = int(query_data(f"SELECT COUNT(*) AS total FROM {PREVIEW_TABLE}", use_cache=False)["total"].iloc[0])
+    failures = 0
+    for sort_column in SORT_COLUMNS:
+        for descending in (False, True):
+            direction = "DESC" if descending else "ASC"
+            deep = query_data(f"SELECT {sort_column} AS sort_value, id FROM {PREVIEW_TABLE} "
+                              f"ORDER BY {sort_column} {direction}, id {direction} LIMIT 1 OFFSET %s",
+                              (int(total * CHECK_DEPTH),), use_cache=False)
+            cursor = (_plain(deep["sort_value"].iloc[0]), int(deep["id"].iloc[0])) if not deep.empty else None
+            problems = [problem for query, params in _view_queries(cursor, sort_column, descending, None)
+                        for problem in _plan_problems(query + " LIMIT %s", params + [page_size + 1])]
+            first = _page_ms(None, page_size, sort_column, descending)
+            deeper = _page_ms(cursor, page_size, sort_column, descending)
+            if deeper > first * CHECK_SLOWDOWN + CHECK_SLACK_MS:
+                problems.append(f"{deeper / first:.1f}x slower at depth")
+            failures += bool(problems)
+            log(f"{'ok  ' if not problems else 'FAIL'} {sort_column} {direction}: first page {first:.2f} ms, "
+                f"page at {CHECK_DEPTH:.0%} {deeper:.2f} ms" + (f"  ({'; '.join(problems)})" if problems else ""))
+    return failures
+
+
+def main(argv=None):
+    from db_utils import SQLiteBackend, configure_pool
+
+    parser = argparse.ArgumentParser(description="Check that every logs preview sort pages by index seeks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check_parser = commands.add_parser("check", help="explain and time a first and a deep page of every sort")
+    check_parser.add_argument("--sqlite", metavar="PATH", help="use a SQLite file instead of MySQL")
+    check_parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    return 1 if check(args.page_size) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
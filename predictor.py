@@ -0,0 +1,384 @@
+# Outcome/violation predictor for new logs. Stops are counted in dense tensors indexed by
+# (gender, age, search, duration, drugs, class), and a prediction backs off from the exact
+# combination to coarser ones (5-year age band, any age, any gender and age, everything),
+# each level smoothed towards the next, so rare ages still get an answer drawn from the
+# closest stops instead of a fixed default. New stops only add to the counts; the scoring
+# tables are recomputed lazily on the next predict, and batches are scored by indexing them.
+#
+#   python predictor.py --sqlite securecheck.db     # train from the database, write predictor.npz
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from table_mirror import get_table_mirror
+
+PREDICTOR_PATH = os.environ.get("SECURECHECK_PREDICTOR_PATH", "predictor.npz")
+# Pseudo-counts a level borrows from the coarser level below it
+SMOOTHING = float(os.environ.get("SECURECHECK_PREDICTOR_SMOOTHING", "2.0"))
+FORMAT_VERSION = 1
+
+KEY_COLUMNS = ["driver_gender", "driver_age", "search_conducted", "stop_duration", "drugs_related_stop"]
+TARGETS = {"outcome": "stop_outcome", "violation": "violation"}
+TEXT_FEATURES = ["driver_gender", "stop_duration"]
+FLAG_FEATURES = ["search_conducted", "drugs_related_stop"]
+DEFAULT_OUTCOME = "warning"
+DEFAULT_VIOLATION = "speeding"
+
+# Ages 0..MAX_AGE get a slot each (older ones are clipped), plus one for unknown ages
+MAX_AGE = 100
+AGE_BAND = 5
+AGE_SLOTS = MAX_AGE + 2
+AGE_BANDS = np.append(np.arange(MAX_AGE + 1) // AGE_BAND, MAX_AGE // AGE_BAND + 1)
+
+# Server-side pre-aggregation: only one row per distinct (key, outcome, violation) crosses the wire
+BUILD_QUERY = """
+    SELECT driver_gender, driver_age, search_conducted, stop_duration, drugs_related_stop,
+           stop_outcome, violation, COUNT(*) AS stops
+    FROM traffic_stops
+    WHERE id <= %s
+    GROUP BY driver_gender, driver_age, search_conducted, stop_duration, drugs_related_stop,
+             stop_outcome, violation
+"""
+HIGH_WATER_QUERY = "SELECT MAX(id) AS high_water FROM traffic_stops"
+
+
+def _normalize(name, values):
+    # Same matching rules as the old exact-match lookup: case-insensitive text, exact integers
+    values = pd.Series(values, dtype=object).reset_index(drop=True)
+    if name in TEXT_FEATURES:
+        return values.where(values.isna(), values.astype(str).str.lower())
+    return pd.to_numeric(values, errors="coerce")
+
+
+def _normalize_one(name, value):
+    if value is None or value != value:
+        return None
+    if name in TEXT_FEATURES:
+        return str(value).lower()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _age_slot(value):
+    try:
+        age = float(value)
+    except (TypeError, ValueError):
+        return AGE_SLOTS - 1
+    return AGE_SLOTS - 1 if age != age else int(min(max(age, 0), MAX_AGE))
+
+
+class Vocabulary:
+    # Value -> slot; slot 0 stands for missing and never-seen values
+    def __init__(self, keys=(), labels=()):
+        self.keys = [None] + list(keys)
+        self.labels = [None] + list(labels)
+        self.index = {key: slot for slot, key in enumerate(self.keys) if slot}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def encode(self, keys):
+        return keys.map(self.index).fillna(0).to_numpy(dtype=np.int64)
+
+    def grow(self, keys, labels):
+        # Adds the keys not seen before; returns True when any were added
+        added = False
+        for key, label in zip(keys, labels):
+            if key == key and key is not None and key not in self.index:
+                self.index[key] = len(self.keys)
+                self.keys.append(key)
+                self.labels.append(str(label))
+                added = True
+        return added
+
+    def state(self):
+        return {"keys": self.keys[1:], "labels": self.labels[1:]}
+
+
+def _age_slots(values):
+    ages = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float)
+    slots = np.full(len(ages), AGE_SLOTS - 1, dtype=np.int64)
+    known = ~np.isnan(ages)
+    slots[known] = np.clip(ages[known], 0, MAX_AGE).astype(np.int64)
+    return slots
+
+
+def _smoothed(counts):
+    # counts: (gender, age, search, duration, drugs, class). Returns the probabilities of the
+    # finest level, each level being (its counts + SMOOTHING x coarser probabilities) / (n + SMOOTHING)
+    counts = counts.astype(np.float64)
+    classes = counts.shape[-1]
+    total = counts.sum(axis=(0, 1, 2, 3, 4), keepdims=True)
+    probabilities = (total + 1.0) / (total.sum(axis=-1, keepdims=True) + classes)
+    bands = np.zeros((counts.shape[0], AGE_BANDS[-1] + 1) + counts.shape[2:])
+    np.add.at(bands, (slice(None), AGE_BANDS), counts)
+    levels = [
+        counts.sum(axis=(0, 1), keepdims=True),
+        counts.sum(axis=1, keepdims=True),
+        bands[:, AGE_BANDS],
+        counts,
+    ]
+    for level in levels:
+        probabilities = (level + SMOOTHING * probabilities) / (level.sum(axis=-1, keepdims=True) + SMOOTHING)
+    return probabilities
+
+
+class Predictor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.features = {name: Vocabulary() for name in TEXT_FEATURES + FLAG_FEATURES}
+        self.classes = {target: Vocabulary() for target in TARGETS}
+        self.counts = {target: self._empty(target) for target in TARGETS}
+        self.high_water = 0
+        self.updates = 0
+        self.last_error = None
+        self._tables = None
+
+    def _shape(self, classes):
+        return (len(self.features["driver_gender"]), AGE_SLOTS, len(self.features["search_conducted"]),
+                len(self.features["stop_duration"]), len(self.features["drugs_related_stop"]), classes)
+
+    def _empty(self, target):
+        return np.zeros(self._shape(len(self.classes[target])), dtype=np.int64)
+
+    def _resize(self):
+        # Pads every tensor out to the current vocabulary sizes
+        for target, counts in self.counts.items():
+            shape = self._shape(len(self.classes[target]))
+            if counts.shape != shape:
+                self.counts[target] = np.pad(counts, [(0, new - old) for old, new in zip(counts.shape, shape)])
+
+    def _encode(self, frame):
+        # Feature slots per row, in tensor axis order
+        codes = {name: self.features[name].encode(_normalize(name, frame[name]))
+                 for name in TEXT_FEATURES + FLAG_FEATURES}
+        return (codes["driver_gender"], _age_slots(frame["driver_age"]), codes["search_conducted"],
+                codes["stop_duration"], codes["drugs_related_stop"])
+
+    def _add(self, frame, weights):
+        # frame: KEY_COLUMNS and target columns; weights: stops per row
+        grown = False
+        for name in TEXT_FEATURES + FLAG_FEATURES:
+            keys = _normalize(name, frame[name])
+            unique = ~keys.duplicated()
+            grown |= self.features[name].grow(keys[unique], frame[name].reset_index(drop=True)[unique])
+        for target, column in TARGETS.items():
+            values = pd.Series(frame[column], dtype=object).reset_index(drop=True)
+            unique = values.drop_duplicates()
+            grown |= self.classes[target].grow(unique, unique)
+        if grown:
+            self._resize()
+        slots = self._encode(frame)
+        for target, column in TARGETS.items():
+            classes = self.classes[target].encode(pd.Series(frame[column], dtype=object).reset_index(drop=True))
+            # Rows without a value for this target are not counted towards it
+            known = classes > 0
+            counts = self.counts[target]
+            flat = np.ravel_multi_index(tuple(slot[known] for slot in slots) + (classes[known],), counts.shape)
+            counts += np.bincount(flat, weights=weights[known], minlength=counts.size).astype(np.int64).reshape(counts.shape)
+        self.updates += 1
+        self._tables = None
+
+    def load_counts(self, counts):
+        # counts: DataFrame shaped like BUILD_QUERY's result
+        if counts.empty:
+            return
+        with self._lock:
+            self._add(counts, counts["stops"].to_numpy(dtype=np.int64))
+
+    def add_frame(self, frame):
+        # Rows delivered by the table mirror; rows at or below high_water are already counted
+        # (e.g. by a model loaded from disk)
+        with self._lock:
+            if "id" in frame:
+                frame = frame[frame["id"] > self.high_water]
+                if frame.empty:
+                    return
+                self.high_water = max(self.high_water, int(frame["id"].max()))
+            self._add(frame, np.ones(len(frame), dtype=np.int64))
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _scoring_tables(self):
+        # Best class, its probability and the exact-match support for every feature combination
+        if self._tables is None:
+            tables = {}
+            for target, counts in self.counts.items():
+                if counts.shape[-1] < 2:
+                    tables[target] = None
+                    continue
+                # Class slot 0 (missing) is never counted, so it is left out of the vote
+                probabilities = _smoothed(counts[..., 1:])
+                best = probabilities.argmax(axis=-1)
+                tables[target] = (best + 1, np.take_along_axis(probabilities, best[..., None], axis=-1)[..., 0],
+                                  counts.sum(axis=-1))
+            self._tables = tables
+        return self._tables
+
+    def predict_batch(self, records):
+        # records: DataFrame (or dict of columns) with KEY_COLUMNS. Returns one row per record with
+        # stop_outcome, violation, their probabilities and how many stops matched exactly.
+        frame = pd.DataFrame(records)
+        result = pd.DataFrame(index=frame.index)
+        with self._lock:
+            slots = self._encode(frame)
+            tables = self._scoring_tables()
+            labels = {target: np.array(self.classes[target].labels, dtype=object) for target in TARGETS}
+        support = np.zeros(len(frame), dtype=np.int64)
+        for target, column in TARGETS.items():
+            default = DEFAULT_OUTCOME if target == "outcome" else DEFAULT_VIOLATION
+            if tables[target] is None:
+                result[column] = default
+                result[f"{target}_probability"] = 0.0
+                continue
+            best, probability, matched = tables[target]
+            result[column] = labels[target][best[slots]]
+            result[f"{target}_probability"] = probability[slots]
+            if target == "outcome":
+                support = matched[slots]
+        result["support"] = support
+        return result
+
+    def predict(self, driver_gender, driver_age, search_conducted, stop_duration, drugs_related_stop):
+        # Returns (outcome, violation, stops matching exactly); one record without building a DataFrame
+        with self._lock:
+            slot = tuple(self.features[name].index.get(_normalize_one(name, value), 0)
+                         for name, value in (("driver_gender", driver_gender), ("search_conducted", search_conducted),
+                                             ("stop_duration", stop_duration), ("drugs_related_stop", drugs_related_stop)))
+            slot = (slot[0], _age_slot(driver_age)) + slot[1:]
+            tables = self._scoring_tables()
+            if tables["outcome"] is None or tables["violation"] is None:
+                return DEFAULT_OUTCOME, DEFAULT_VIOLATION, 0
+            return (self.classes["outcome"].labels[tables["outcome"][0][slot]],
+                    self.classes["violation"].labels[tables["violation"][0][slot]],
+                    int(tables["outcome"][2][slot]))
+
+    def stop_durations(self):
+        with self._lock:
+            return sorted(label for label in self.features["stop_duration"].labels[1:] if label is not None)
+
+    def class_labels(self, target):
+        # Outcomes or violations seen so far, for the Add Log form
+        with self._lock:
+            return sorted(self.classes[target].labels[1:])
+
+    def nbytes(self):
+        return sum(counts.nbytes for counts in self.counts.values())
+
+    def __len__(self):
+        # Feature combinations with at least one stop
+        return int((self.counts["outcome"].sum(axis=-1) > 0).sum())
+
+    def save(self, path=PREDICTOR_PATH):
+        # Counts are stored as uint32 and compressed; written to a temporary file first
+        with self._lock:
+            state = {
+                "version": FORMAT_VERSION,
+                "high_water": self.high_water,
+                "features": {name: vocabulary.state() for name, vocabulary in self.features.items()},
+                "classes": {target: vocabulary.state() for target, vocabulary in self.classes.items()},
+            }
+            arrays = {target: counts.astype(np.uint32) for target, counts in self.counts.items()}
+        temporary = f"{path}.tmp.npz"
+        np.savez_compressed(temporary, state=np.array(json.dumps(state)), **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=PREDICTOR_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            state = json.loads(str(data["state"]))
+            if state["version"] != FORMAT_VERSION:
+                raise ValueError(f"{path} has format version {state['version']}, expected {FORMAT_VERSION}")
+            predictor = cls()
+            predictor.features = {name: Vocabulary(**vocabulary) for name, vocabulary in state["features"].items()}
+            predictor.classes = {target: Vocabulary(**vocabulary) for target, vocabulary in state["classes"].items()}
+            predictor.counts = {target: data[target].astype(np.int64) for target in TARGETS}
+            predictor.high_water = state["high_water"]
+        predictor._resize()
+        return predictor
+
+
+def build_predictor():
+    # Trains from counts grouped in the database, up to the id read first so rows inserted
+    # meanwhile are left for the mirror to add. Database errors are raised.
+    from db_utils import query_data
+
+    high_water = query_data(HIGH_WATER_QUERY, use_cache=False, page="add_log", label="predictor high water").iloc[0, 0]
+    predictor = Predictor()
+    if pd.isna(high_water):
+        return predictor
+    predictor.load_counts(query_data(BUILD_QUERY, (int(high_water),), use_cache=False,
+                                     page="add_log", label="predictor build"))
+    predictor.high_water = int(high_water)
+    return predictor
+
+
+_predictor = None
+_predictor_lock = threading.Lock()
+
+
+def _unseen(table):
+    # Mirrored rows the predictor has not counted yet
+    return table.columns["id"] > _predictor.high_water
+
+
+def get_predictor():
+    # Starts from the saved model, or else trains from counts grouped in the database and saves
+    # them; either way the table mirror only feeds it the rows above its high-water mark and
+    # every new delta. A file that cannot be used is reported in last_error.
+    global _predictor
+    mirror = get_table_mirror()
+    with _predictor_lock:
+        if _predictor is None:
+            predictor, problem = None, None
+            if os.path.exists(PREDICTOR_PATH):
+                try:
+                    predictor = Predictor.load(PREDICTOR_PATH)
+                except (OSError, ValueError, KeyError) as e:
+                    problem = f"Ignored {PREDICTOR_PATH}: {e}"
+            if predictor is None:
+                predictor = build_predictor()
+                try:
+                    predictor.save(PREDICTOR_PATH)
+                except OSError as e:
+                    problem = f"{problem + '; ' if problem else ''}could not save {PREDICTOR_PATH}: {e}"
+            predictor.last_error = problem
+            _predictor = predictor
+            mirror.subscribe(_predictor, _unseen)
+    mirror.refresh()
+    return _predictor
+
+
+def main(argv=None):
+    from db_utils import SQLiteBackend, configure_pool
+
+    parser = argparse.ArgumentParser(description="Train the outcome/violation predictor from traffic_stops.")
+    parser.add_argument("--sqlite", metavar="PATH", help="use a SQLite file instead of MySQL")
+    parser.add_argument("--output", default=PREDICTOR_PATH, help="model file to write")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    started = time.perf_counter()
+    predictor = build_predictor()
+    predictor.save(args.output)
+    print(f"Trained on stops up to id {predictor.high_water:,} ({len(predictor):,} feature combinations) in "
+          f"{time.perf_counter() - started:.2f}s -> {args.output} ({os.path.getsize(args.output):,} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_MB = float(os.environ.get("SECURECHECK_CACHE_MB", "64"))
+# How long a probed data version is trusted before asking the database again
+VERSION_PROBE_INTERVAL = float(os.environ.get("SECURECHECK_CACHE_PROBE_INTERVAL", "1.0"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(query):
+    return _WHITESPACE.sub(" ", query).strip().rstrip(";").strip()
+
+
+def is_cacheable(query):
+    head = normalize_sql(query)[:6].upper()
+    return head.startswith("SELECT") or head.startswith("WITH")
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class QueryCache:
+    # LRU cache of query results keyed by (normalized SQL, params, data version).
+    # The data version comes from version_source(), e.g. (COUNT(*), MAX(id)) of
+    # traffic_stops, plus a local generation bumped by invalidate() on writes.
+    def __init__(self, version_source, max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+                 probe_interval=VERSION_PROBE_INTERVAL):
+        self.version_source = version_source
+        self.max_bytes = max_bytes
+        self.probe_interval = probe_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._generation = 0
+        self._version = None
+        self._probed_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def data_version(self):
+        with self._lock:
+            generation = self._generation
+            if self._version is not None and time.monotonic() - self._probed_at < self.probe_interval:
+                return self._version
+        version = (generation,) + tuple(self.version_source())
+        with self._lock:
+            if version != self._version:
+                # New rows landed: everything cached for the old version is dead
+                self._drop_where(lambda key: key[2] != version)
+            self._version = version
+            self._probed_at = time.monotonic()
+        return version
+
+    def _key(self, query, params, version):
+        return (normalize_sql(query), tuple(params) if params is not None else None, version)
+
+    def get(self, query, params=None):
+        key = self._key(query, params, self.data_version())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, key
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0].copy(deep=False), key
+
+    def put(self, key, df):
+        nbytes = frame_nbytes(df)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key[2] != self._version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (df, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def _drop_where(self, predicate):
+        stale = [key for key in self._entries if predicate(key)]
+        for key in stale:
+            _, nbytes = self._entries.pop(key)
+            self._bytes -= nbytes
+        self.invalidations += len(stale)
+
+    def invalidate(self):
+        # Called by writers: forces a fresh version probe and drops every entry
+        with self._lock:
+            self._generation += 1
+            self._version = None
+            self._drop_where(lambda key: True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "data_version": self._version,
+            }
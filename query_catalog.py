@@ -0,0 +1,545 @@
+# Every insight question in one place: its SQL, written once with named parameters
+# (%(top_n)s) and the date/country markers from insight_filters.py, the parameters'
+# types and bounds, and how its answer is charted. The insight pages are generated from
+# this catalog, and each question runs as a prepared statement cached per connection,
+# so asking it again only sends the parameter values.
+import re
+
+import streamlit as st
+from chart_cache import collapse, fold_small, note_downsampled
+from insight_filters import FILTER_MARKER, filter_clause, is_filterable
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|" + FILTER_MARKER.pattern)
+
+
+class Param:
+    # An integer parameter the page lets the user change
+    def __init__(self, name, label, default, minimum, maximum, help=None):
+        self.name = name
+        self.label = label
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.help = help
+
+    def coerce(self, value):
+        value = int(value)
+        if not self.minimum <= value <= self.maximum:
+            raise ValueError(f"{self.label} must be between {self.minimum} and {self.maximum}")
+        return value
+
+
+class Chart:
+    # One plotly.express call: kind ("bar", "pie", ...) and its keyword arguments. prepare
+    # reshapes the answer first (downsampled charts say so); the title may name parameters.
+    def __init__(self, kind, title, layout=None, prepare=None, downsampled=False, **options):
+        self.kind = kind
+        self.title = title
+        self.layout = layout or {}
+        self.prepare = prepare
+        self.downsampled = downsampled
+        self.options = options
+
+
+class Question:
+    # title is the question's key (selection, snapshots, metrics) and never changes; heading is
+    # what the page shows and may name parameters, like a chart title
+    def __init__(self, page, title, sql, category=None, params=(), charts=(), columns=None, heading=None):
+        self.page = page
+        self.title = title
+        self.heading_format = heading or title
+        self.sql = sql
+        self.category = category
+        self.params = list(params)
+        self.charts = list(charts)
+        # Result columns shown in the table (all of them when None)
+        self.columns = columns
+
+    @property
+    def filterable(self):
+        return is_filterable(self.sql)
+
+    def defaults(self):
+        return {param.name: param.default for param in self.params}
+
+    def values(self, overrides=None):
+        # Parameter values with the defaults filled in, checked against their bounds
+        values = self.defaults()
+        for param in self.params:
+            if overrides and overrides.get(param.name) is not None:
+                values[param.name] = param.coerce(overrides[param.name])
+        return values
+
+    def is_default(self, values):
+        return values == self.defaults()
+
+    def heading(self, values=None):
+        return self.heading_format.format(**self.values(values))
+
+    def bind(self, values=None, filters=None):
+        # (query, params): named parameters become %s in order of appearance, next to the
+        # filter predicates, so the query text is the same for every value
+        values = self.values(values)
+        params = []
+
+        def substitute(match):
+            name, keyword, date_column = match.groups()
+            if name is not None:
+                params.append(values[name])
+                return "%s"
+            clause, clause_params = filter_clause(keyword, date_column, filters)
+            if not clause:
+                return match.group(0)
+            params.extend(clause_params)
+            return clause
+
+        query = _PLACEHOLDER.sub(substitute, self.sql)
+        return query, tuple(params) or None
+
+    def figures(self, result, values=None):
+        # Imported on first use: plotly.express is only needed when a chart is not cached
+        import plotly.express as px
+
+        values = self.values(values)
+        figures = []
+        for chart in self.charts:
+            points = result if chart.prepare is None else chart.prepare(result)
+            if points.empty:
+                continue
+            fig = getattr(px, chart.kind)(points, title=chart.title.format(**values), **chart.options)
+            if chart.layout:
+                fig.update_layout(**chart.layout)
+            if chart.downsampled:
+                fig = note_downsampled(fig, len(points), len(result))
+            figures.append(fig)
+        return figures
+
+
+def _year_labels(result):
+    points = result.dropna(subset=["arrest_rate_percent"]).copy()
+    points["year"] = points["year"].astype(str)
+    return points
+
+
+TOP_N = Param("top_n", "Rows to show", 10, 1, 100)
+
+CATALOG = [
+    # Vehicle questions read traffic_stops, the rest read the rollup tables
+    Question(
+        "fundamental_insights", "What are the top 10 vehicles involved in drug-related stops?",
+        """
+        SELECT vehicle_number, COUNT(*) AS stop_count
+        FROM traffic_stops
+        WHERE drugs_related_stop = 1 AND vehicle_number IS NOT NULL AND vehicle_number != ''
+        /*and timestamp*/
+        GROUP BY vehicle_number
+        ORDER BY stop_count DESC
+        LIMIT %(top_n)s
+        """,
+        category="🚗 Vehicle-Based",
+        params=[TOP_N],
+        heading="What are the top {top_n} vehicles involved in drug-related stops?",
+        charts=[Chart("bar", "Top {top_n} Vehicles in Drug-Related Stops", x="vehicle_number", y="stop_count",
+                      labels={"vehicle_number": "Vehicle", "stop_count": "Number of Stops"},
+                      layout={"xaxis_title": "Vehicle", "yaxis_title": "Stops"})],
+        columns=["vehicle_number"],
+    ),
+    Question(
+        "fundamental_insights", "Which vehicles were most frequently searched?",
+        """
+        SELECT vehicle_number, COUNT(*) AS search_count
+        FROM traffic_stops
+        WHERE search_conducted = 1 AND vehicle_number IS NOT NULL AND vehicle_number != ''
+        /*and timestamp*/
+        GROUP BY vehicle_number
+        ORDER BY search_count DESC
+        LIMIT %(top_n)s
+        """,
+        category="🚗 Vehicle-Based",
+        params=[TOP_N],
+        charts=[Chart("bar", "Most Frequently Searched Vehicles", x="vehicle_number", y="search_count",
+                      labels={"vehicle_number": "Vehicle", "search_count": "Search Count"},
+                      layout={"xaxis_title": "Vehicle", "yaxis_title": "Searches"})],
+        columns=["vehicle_number"],
+    ),
+    Question(
+        "fundamental_insights", "Which driver age group had the highest arrest rate?",
+        """
+        SELECT
+            CASE
+                WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
+                WHEN driver_age BETWEEN 26 AND 35 THEN '26-35'
+                WHEN driver_age BETWEEN 36 AND 45 THEN '36-45'
+                WHEN driver_age BETWEEN 46 AND 60 THEN '46-60'
+                ELSE '60+'
+            END AS age_group,
+            ROUND(SUM(arrests) * 100.0 / SUM(stops), 2) AS arrest_rate
+        FROM rollup_profile
+        WHERE driver_age IS NOT NULL
+        GROUP BY age_group
+        ORDER BY arrest_rate DESC
+        """,
+        category="🧍 Demographic-Based",
+        charts=[Chart("bar", "Arrest Rate by Driver Age Group", x="age_group", y="arrest_rate",
+                      labels={"age_group": "Age Group", "arrest_rate": "Arrest Rate (%)"},
+                      layout={"yaxis_range": [45, 55]})],
+    ),
+    Question(
+        "fundamental_insights", "What is the gender distribution of drivers stopped in each country?",
+        """
+        SELECT country_name, driver_gender, CAST(SUM(stops) AS SIGNED) AS count
+        FROM rollup_profile
+        GROUP BY country_name, driver_gender
+        ORDER BY country_name, driver_gender
+        """,
+        category="🧍 Demographic-Based",
+        charts=[Chart("bar", "Gender Distribution of Drivers by Country", x="country_name", y="count",
+                      color="driver_gender", barmode="group", labels={"country_name": "Country", "count": "Count"},
+                      layout={"yaxis_range": [10000, 12000]})],
+    ),
+    Question(
+        "fundamental_insights", "Which race and gender combination has the highest search rate?",
+        """
+        SELECT driver_race, driver_gender,
+               ROUND(SUM(searches) * 100.0 / SUM(stops), 2) AS search_rate
+        FROM rollup_profile
+        GROUP BY driver_race, driver_gender
+        ORDER BY search_rate DESC
+        LIMIT %(top_n)s
+        """,
+        category="🧍 Demographic-Based",
+        params=[Param("top_n", "Combinations to show", 5, 1, 100)],
+        charts=[Chart("bar", "Top Race-Gender Combinations by Search Rate", x="driver_race", y="search_rate",
+                      color="driver_gender", labels={"driver_race": "Race", "search_rate": "Search Rate (%)"},
+                      layout={"yaxis_range": [45, 55]})],
+    ),
+    Question(
+        "fundamental_insights", "What time of day sees the most traffic stops?",
+        """
+        SELECT
+            CASE
+                WHEN stop_hour BETWEEN 6 AND 11 THEN 'Morning'
+                WHEN stop_hour BETWEEN 12 AND 17 THEN 'Afternoon'
+                WHEN stop_hour BETWEEN 18 AND 21 THEN 'Evening'
+                ELSE 'Night'
+            END AS time_of_day,
+            CAST(SUM(stops) AS SIGNED) AS stop_count
+        FROM rollup_time
+        /*where stop_day*/
+        GROUP BY time_of_day
+        ORDER BY stop_count DESC
+        """,
+        category="🕒 Time & Duration Based",
+        charts=[Chart("pie", "Traffic Stops by Time of Day", names="time_of_day", values="stop_count", hole=0.4)],
+    ),
+    Question(
+        "fundamental_insights", "What is the average stop duration for different violations?",
+        """
+        SELECT violation,
+            ROUND(
+                SUM(stops * CASE stop_duration
+                    WHEN '0-15 Min' THEN 7.5
+                    WHEN '16-30 Min' THEN 23
+                    WHEN '30+ Min' THEN 40
+                END)
+                / SUM(CASE WHEN stop_duration IN ('0-15 Min', '16-30 Min', '30+ Min') THEN stops END),
+            2) AS avg_duration_min
+        FROM rollup_violation_duration
+        GROUP BY violation
+        ORDER BY avg_duration_min DESC
+        """,
+        category="🕒 Time & Duration Based",
+        charts=[Chart("bar", "Average Stop Duration by Violation", x="violation", y="avg_duration_min",
+                      labels={"violation": "Violation", "avg_duration_min": "Avg Duration (min)"},
+                      layout={"yaxis_range": [23, 24]})],
+    ),
+    Question(
+        "fundamental_insights", "Are stops during the night more likely to lead to arrests?",
+        """
+        SELECT
+            CASE
+                WHEN stop_hour BETWEEN 22 AND 23 OR stop_hour BETWEEN 0 AND 5 THEN 'Night'
+                ELSE 'Day'
+            END AS time_segment,
+            ROUND(SUM(arrests) * 100.0 / SUM(stops), 2) AS arrest_rate
+        FROM rollup_time
+        /*where stop_day*/
+        GROUP BY time_segment
+        """,
+        category="🕒 Time & Duration Based",
+        charts=[Chart("pie", "Arrest Rate: Night vs Day", names="time_segment", values="arrest_rate", hole=0.4)],
+    ),
+    Question(
+        "fundamental_insights", "Which violations are most associated with searches or arrests?",
+        """
+        SELECT violation,
+            ROUND(SUM(searches) * 100.0 / SUM(stops), 2) AS search_rate,
+            ROUND(SUM(arrests) * 100.0 / SUM(stops), 2) AS arrest_rate
+        FROM rollup_profile
+        GROUP BY violation
+        ORDER BY search_rate DESC
+        """,
+        category="⚖️ Violation-Based",
+        charts=[Chart("bar", "Search and Arrest Rates by Violation", x="violation", y="Rate", color="Metric",
+                      barmode="group", labels={"violation": "Violation", "Rate": "Rate (%)"},
+                      layout={"yaxis_range": [48, 51]},
+                      prepare=lambda result: result.melt(id_vars="violation", value_vars=["search_rate", "arrest_rate"],
+                                                         var_name="Metric", value_name="Rate"))],
+    ),
+    Question(
+        "fundamental_insights", "Which violations are most common among younger drivers (<25)?",
+        """
+        SELECT violation, CAST(SUM(stops) AS SIGNED) AS count
+        FROM rollup_profile
+        WHERE driver_age < %(age_cutoff)s
+        GROUP BY violation
+        ORDER BY count DESC
+        """,
+        category="⚖️ Violation-Based",
+        params=[Param("age_cutoff", "Younger than", 25, 16, 100)],
+        heading="Which violations are most common among younger drivers (<{age_cutoff})?",
+        charts=[Chart("pie", "Violations Among Drivers Under {age_cutoff}", names="violation", values="count", hole=0.4)],
+    ),
+    Question(
+        "fundamental_insights", "Is there a violation that rarely results in search or arrest?",
+        """
+        SELECT violation,
+            ROUND(SUM(searches) * 100.0 / SUM(stops), 2) AS search_rate,
+            ROUND(SUM(arrests) * 100.0 / SUM(stops), 2) AS arrest_rate
+        FROM rollup_profile
+        GROUP BY violation
+        HAVING search_rate < 50 AND arrest_rate < 50
+        ORDER BY violation
+        """,
+        category="⚖️ Violation-Based",
+    ),
+    Question(
+        "fundamental_insights", "Which countries report the highest rate of drug-related stops?",
+        """
+        SELECT country_name,
+            ROUND(SUM(drug_stops) * 100.0 / SUM(stops), 2) AS drug_stop_rate
+        FROM rollup_profile
+        GROUP BY country_name
+        ORDER BY drug_stop_rate DESC
+        """,
+        category="🌍 Location-Based",
+        charts=[Chart("bar", "Drug-Related Stop Rate by Country", x="country_name", y="drug_stop_rate",
+                      labels={"country_name": "Country", "drug_stop_rate": "Rate (%)"},
+                      layout={"yaxis_range": [49, 51]})],
+    ),
+    Question(
+        "fundamental_insights", "What is the arrest rate by country and violation?",
+        """
+        SELECT country_name, violation,
+            ROUND(SUM(arrests) * 100.0 / SUM(stops), 2) AS arrest_rate
+        FROM rollup_profile
+        GROUP BY country_name, violation
+        ORDER BY country_name, arrest_rate DESC
+        """,
+        category="🌍 Location-Based",
+        charts=[Chart("bar", "Arrest Rate by Country and Violation", x="violation", y="arrest_rate",
+                      color="country_name", barmode="group",
+                      labels={"violation": "Violation", "arrest_rate": "Arrest Rate (%)"},
+                      layout={"yaxis_range": [49, 51]})],
+    ),
+    Question(
+        "fundamental_insights", "Which country has the most stops with search conducted?",
+        """
+        SELECT country_name, CAST(SUM(searches) AS SIGNED) AS search_count
+        FROM rollup_profile
+        GROUP BY country_name
+        HAVING SUM(searches) > 0
+        ORDER BY search_count DESC
+        """,
+        category="🌍 Location-Based",
+        charts=[Chart("pie", "Search-Conducted Stops by Country", names="country_name", values="search_count",
+                      hole=0.4)],
+    ),
+    # Every profound question is answered from the rollup tables
+    Question(
+        "profound_insights", "Yearly Breakdown of Stops and Arrests by Country",
+        """
+       WITH stop_stats AS (
+            SELECT
+                country_name,
+                YEAR(stop_day) AS year,
+                SUM(stops) AS total_stops,
+                SUM(arrests) AS total_arrests
+            FROM rollup_time
+            /*where stop_day*/
+            GROUP BY country_name, YEAR(stop_day)
+        )
+        SELECT
+            country_name,
+            year,
+            CAST(total_stops AS SIGNED) AS total_stops,
+            CAST(total_arrests AS SIGNED) AS total_arrests,
+            ROUND(CASE
+                WHEN total_stops > 0 THEN (total_arrests * 100.0 / total_stops)
+                ELSE 0
+            END, 2) AS arrest_rate_percent
+        FROM stop_stats
+        ORDER BY year, country_name;
+        """,
+        charts=[
+            Chart("bar", "Total Stops per Year by Country", x="year", y="total_stops", color="country_name",
+                  barmode="group", layout={"yaxis_range": [21000, 22000]}),
+            Chart("bar", "Arrest Rate (%) Over Years by Country", x="arrest_rate_percent", y="year",
+                  color="country_name", orientation="h", barmode="group", layout={"xaxis_range": [48, 51]},
+                  prepare=_year_labels),
+        ],
+    ),
+    Question(
+        "profound_insights", "Driver Violation Trends Based on Age and Race",
+        """
+        SELECT
+            driver_race,
+            violation,
+            CASE
+                WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
+                WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
+                WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
+                ELSE '60+'
+            END AS age_group,
+            CAST(SUM(stops) AS SIGNED) AS count
+        FROM rollup_profile
+        GROUP BY driver_race, violation, age_group
+        ORDER BY count DESC
+        """,
+        charts=[Chart("sunburst", "Violation Trends by Age and Race", path=["driver_race", "age_group", "violation"],
+                      values="count", width=800, height=800, downsampled=True,
+                      prepare=lambda result: fold_small(result, ["driver_race", "age_group", "violation"], "count"))],
+    ),
+    Question(
+        "profound_insights", "Time Period Analysis of Stops (Year, Month, Hour)",
+        """
+        SELECT
+            YEAR(stop_day) AS year,
+            MONTH(stop_day) AS month,
+            stop_hour AS hour,
+            CAST(SUM(stops) AS SIGNED) AS total_stops
+        FROM rollup_time
+        /*where stop_day*/
+        GROUP BY YEAR(stop_day), MONTH(stop_day), stop_hour
+        ORDER BY year, month, hour
+        """,
+        # Years are summed away once there are too many points for one chart
+        charts=[Chart("line", "Stops by Hour of the Day, Colored by Month", x="hour", y="total_stops", color="month",
+                      downsampled=True,
+                      prepare=lambda result: collapse(result, ["month", "hour", "year"], ["total_stops"]))],
+    ),
+    Question(
+        "profound_insights", "Violations with High Search and Arrest Rates",
+        """
+        WITH violation_summary AS (
+            SELECT
+                violation,
+                SUM(stops) AS total,
+                SUM(searches) AS searches,
+                SUM(arrests) AS arrests
+            FROM rollup_profile
+            GROUP BY violation
+        )
+        SELECT
+            violation,
+            CAST(total AS SIGNED) AS total,
+            CAST(searches AS SIGNED) AS searches,
+            CAST(arrests AS SIGNED) AS arrests,
+            ROUND((searches * 100.0 / total), 2) AS search_rate_percent,
+            ROUND((arrests * 100.0 / total), 2) AS arrest_rate_percent
+        FROM violation_summary
+        ORDER BY arrest_rate_percent DESC
+        """,
+        charts=[Chart("scatter", "Search Rate vs Arrest Rate by Violation", x="search_rate_percent",
+                      y="arrest_rate_percent", size="total", color="violation", hover_name="violation")],
+    ),
+    Question(
+        "profound_insights", "Driver Demographics by Country (Age, Gender, and Race)",
+        """
+        SELECT
+            country_name,
+            driver_gender,
+            driver_race,
+            SUM(driver_age * stops) * 1.0 / SUM(CASE WHEN driver_age IS NOT NULL THEN stops END) AS avg_age,
+            CAST(SUM(stops) AS SIGNED) AS total_drivers
+        FROM rollup_profile
+        GROUP BY country_name, driver_gender, driver_race
+        ORDER BY country_name, total_drivers DESC
+        """,
+        charts=[Chart("bar", "Driver Demographics by Country", x="country_name", y="total_drivers",
+                      color="driver_race", facet_col="driver_gender")],
+    ),
+    Question(
+        "profound_insights", "Top 5 Violations with Highest Arrest Rates",
+        """
+        WITH violation_stats AS (
+            SELECT
+                violation,
+                SUM(stops) AS total,
+                SUM(arrests) AS arrests
+            FROM rollup_profile
+            GROUP BY violation
+        )
+        SELECT
+            violation,
+            CAST(total AS SIGNED) AS total,
+            CAST(arrests AS SIGNED) AS arrests,
+            ROUND((arrests * 100.0 / total), 2) AS arrest_rate_percent
+        FROM violation_stats
+        ORDER BY arrest_rate_percent DESC
+        LIMIT %(top_n)s
+        """,
+        params=[Param("top_n", "Violations to show", 5, 1, 100)],
+        heading="Top {top_n} Violations with Highest Arrest Rates",
+        charts=[Chart("bar", "Top {top_n} Violations with Highest Arrest Rates", x="violation",
+                      y="arrest_rate_percent", color="violation", layout={"yaxis_range": [48, 51]})],
+    ),
+]
+
+QUESTIONS = {(question.page, question.title): question for question in CATALOG}
+
+
+def questions(page):
+    return [question for question in CATALOG if question.page == page]
+
+
+def get_question(page, title):
+    return QUESTIONS[(page, title)]
+
+
+def categories(page):
+    # {category: [titles]} in catalog order
+    grouped = {}
+    for question in questions(page):
+        grouped.setdefault(question.category, []).append(question.title)
+    return grouped
+
+
+def _param_key(key, question, param):
+    return f"{key}_{question.title}_{param.name}"
+
+
+def param_controls(question, key):
+    # Renders the question's parameter inputs; returns their values
+    if not question.params:
+        return question.values()
+    columns = st.columns(len(question.params))
+    values = {}
+    for column, param in zip(columns, question.params):
+        values[param.name] = column.number_input(param.label, min_value=param.minimum, max_value=param.maximum,
+                                                 value=param.default, step=1, help=param.help,
+                                                 key=_param_key(key, question, param))
+    return question.values(values)
+
+
+def session_values(question, key):
+    # Values last entered for a question that is not on screen, e.g. in a report
+    return question.values({param.name: st.session_state.get(_param_key(key, question, param))
+                            for param in question.params})
+
+
+def session_heading(page, title, key):
+    # format_func for question pickers: the heading with the values last entered for it. The
+    # picker needs a key, or a changed heading would make it a new widget and reset the choice.
+    question = get_question(page, title)
+    return question.heading(session_values(question, key))
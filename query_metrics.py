@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+METRICS_CAPACITY = int(os.environ.get("SECURECHECK_METRICS_CAPACITY", "2000"))
+METRICS_PATH = os.environ.get("SECURECHECK_METRICS_PATH", "query_metrics.prom")
+PHASES = ("connect", "execute", "fetch", "frame", "total")
+QUANTILES = (0.5, 0.95, 0.99)
+# Payload size is estimated from an evenly spaced sample of the fetched rows
+PAYLOAD_SAMPLE_ROWS = 100
+
+_LABEL_ESCAPES = re.compile(r'[\\"\n]')
+
+
+def _value_bytes(value):
+    if value is None:
+        return 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return 8
+
+
+def estimate_payload_bytes(rows):
+    if not rows:
+        return 0
+    step = max(len(rows) // PAYLOAD_SAMPLE_ROWS, 1)
+    sample = rows[::step]
+    sampled = sum(_value_bytes(value) for row in sample for value in row)
+    return int(sampled * len(rows) / len(sample))
+
+
+def _escape(value):
+    return _LABEL_ESCAPES.sub(lambda match: {"\\": "\\\\", '"': '\\"', "\n": "\\n"}[match.group()], str(value))
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class QueryMetrics:
+    # Bounded ring buffer of per-query samples: the oldest samples fall off once
+    # capacity is reached, so summaries describe the most recent traffic.
+    def __init__(self, capacity=METRICS_CAPACITY):
+        self.capacity = capacity
+        self._samples = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, page=None, label=None, timings=None, rows=0, payload_bytes=0, cache_hit=False, error=None):
+        timings = timings or {}
+        sample = {
+            "at": time.time(),
+            "page": page or "unknown",
+            "label": label or "unlabelled",
+            "rows": int(rows),
+            "bytes": int(payload_bytes),
+            "cache_hit": bool(cache_hit),
+            "error": None if error is None else str(error),
+        }
+        for phase in PHASES:
+            sample[f"{phase}_s"] = float(timings.get(phase, 0.0))
+        with self._lock:
+            self._samples.append(sample)
+            self.recorded += 1
+        return sample
+
+    def samples(self):
+        with self._lock:
+            return list(self._samples)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def frame(self):
+        return pd.DataFrame(self.samples(), columns=["at", "page", "label", "rows", "bytes", "cache_hit", "error"]
+                            + [f"{phase}_s" for phase in PHASES])
+
+    def summary(self):
+        # One row per (page, label): latency percentiles plus mean phase times and payload
+        rows = []
+        groups = {}
+        for sample in self.samples():
+            groups.setdefault((sample["page"], sample["label"]), []).append(sample)
+        for (page, label), samples in groups.items():
+            totals = np.array([sample["total_s"] for sample in samples])
+            p50, p95, p99 = np.percentile(totals, [q * 100 for q in QUANTILES])
+            row = {
+                "page": page,
+                "label": label,
+                "count": len(samples),
+                "cache_hits": sum(sample["cache_hit"] for sample in samples),
+                "errors": sum(sample["error"] is not None for sample in samples),
+                "p50_ms": round(p50 * 1000, 2),
+                "p95_ms": round(p95 * 1000, 2),
+                "p99_ms": round(p99 * 1000, 2),
+            }
+            # Phase and payload means only count queries that reached the database
+            executed = [sample for sample in samples if not sample["cache_hit"]] or samples
+            for phase in PHASES[:-1]:
+                row[f"{phase}_ms"] = round(np.mean([sample[f"{phase}_s"] for sample in executed]) * 1000, 2)
+            row["avg_rows"] = round(np.mean([sample["rows"] for sample in samples]), 1)
+            row["avg_bytes"] = int(np.mean([sample["bytes"] for sample in executed]))
+            rows.append(row)
+        result = pd.DataFrame(rows)
+        if not result.empty:
+            result = result.sort_values("p95_ms", ascending=False, ignore_index=True)
+        return result
+
+    def to_prometheus(self):
+        # Prometheus text exposition format; quantiles cover the samples still in the buffer
+        groups = {}
+        for sample in self.samples():
+            groups.setdefault((sample["page"], sample["label"]), []).append(sample)
+
+        lines = [
+            "# HELP securecheck_query_seconds Query latency by phase over the recent query window.",
+            "# TYPE securecheck_query_seconds summary",
+        ]
+        for (page, label), samples in sorted(groups.items()):
+            for phase in PHASES:
+                values = np.array([sample[f"{phase}_s"] for sample in samples])
+                for quantile, value in zip(QUANTILES, np.percentile(values, [q * 100 for q in QUANTILES])):
+                    lines.append(f"securecheck_query_seconds{_labels(page=page, label=label, phase=phase, quantile=quantile)} {value:.6f}")
+                lines.append(f"securecheck_query_seconds_sum{_labels(page=page, label=label, phase=phase)} {values.sum():.6f}")
+                lines.append(f"securecheck_query_seconds_count{_labels(page=page, label=label, phase=phase)} {len(values)}")
+
+        for name, help_text, field in (
+            ("securecheck_query_rows", "Rows returned over the recent query window.", "rows"),
+            ("securecheck_query_payload_bytes", "Approximate result payload bytes over the recent query window.", "bytes"),
+            ("securecheck_query_cache_hits", "Queries answered from the result cache over the recent query window.", "cache_hit"),
+            ("securecheck_query_errors", "Failed queries over the recent query window.", "error"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for (page, label), samples in sorted(groups.items()):
+                if field == "error":
+                    value = sum(sample["error"] is not None for sample in samples)
+                else:
+                    value = sum(int(sample[field]) for sample in samples)
+                lines.append(f"{name}{_labels(page=page, label=label)} {value}")
+
+        lines.append("# HELP securecheck_queries_recorded_total Queries recorded since the server started.")
+        lines.append("# TYPE securecheck_queries_recorded_total counter")
+        lines.append(f"securecheck_queries_recorded_total {self.recorded}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=METRICS_PATH):
+        # Written to a temporary file first so a scraper never reads half a file
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as output:
+            output.write(self.to_prometheus())
+        os.replace(temporary, path)
+        return path
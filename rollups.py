@@ -0,0 +1,186 @@
+# Incrementally maintained summary tables for the insight pages.
+#
+#   python rollups.py --rebuild [--sqlite securecheck.db]
+#
+# Each rollup keeps stop counts and flag sums per combination of a few low-cardinality
+# dimensions, so the insight queries scan groups instead of stops. New rows are folded
+# in by the log writer and the CSV loader inside the same transaction as their INSERT;
+# --rebuild recomputes everything from traffic_stops (e.g. after a manual import).
+import argparse
+import hashlib
+import sys
+import time
+
+import pandas as pd
+
+from db_utils import SQLiteBackend, configure_pool, get_pool, invalidate_cache, transaction
+
+MEASURES = ["stops", "searches", "arrests", "drug_stops"]
+FLAG_COLUMNS = {"searches": "search_conducted", "arrests": "is_arrested", "drug_stops": "drugs_related_stop"}
+
+ROLLUPS = {
+    # Demographic, violation and location questions
+    "rollup_profile": {
+        "country_name": "VARCHAR(100)",
+        "driver_gender": "VARCHAR(10)",
+        "driver_race": "VARCHAR(50)",
+        "driver_age": "INT",
+        "violation": "VARCHAR(100)",
+    },
+    # Time-of-day, yearly and year/month/hour questions
+    "rollup_time": {
+        "country_name": "VARCHAR(100)",
+        "stop_day": "DATE",
+        "stop_hour": "INT",
+    },
+    # Average stop duration per violation
+    "rollup_violation_duration": {
+        "violation": "VARCHAR(100)",
+        "stop_duration": "VARCHAR(100)",
+    },
+}
+
+CREATE_ROLLUP_QUERY = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        group_key CHAR(40) PRIMARY KEY,
+        {dimensions},
+        stops BIGINT NOT NULL DEFAULT 0,
+        searches BIGINT NOT NULL DEFAULT 0,
+        arrests BIGINT NOT NULL DEFAULT 0,
+        drug_stops BIGINT NOT NULL DEFAULT 0
+    )
+"""
+
+REBUILD_SELECT_QUERY = """
+    SELECT {dimensions},
+        COUNT(*) AS stops,
+        SUM(CASE WHEN search_conducted = 1 THEN 1 ELSE 0 END) AS searches,
+        SUM(CASE WHEN is_arrested = 1 THEN 1 ELSE 0 END) AS arrests,
+        SUM(CASE WHEN drugs_related_stop = 1 THEN 1 ELSE 0 END) AS drug_stops
+    FROM traffic_stops
+    GROUP BY {dimensions}
+"""
+
+UPSERT_SUFFIX = {
+    "mysql": "ON DUPLICATE KEY UPDATE " + ", ".join(f"{m} = {m} + VALUES({m})" for m in MEASURES),
+    "sqlite": "ON CONFLICT(group_key) DO UPDATE SET " + ", ".join(f"{m} = {m} + excluded.{m}" for m in MEASURES),
+}
+
+
+def _normalize(value):
+    if value is None or (isinstance(value, float) and value != value) or value is pd.NaT:
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()[:10]
+    return value
+
+
+def group_key(values):
+    # Same key whether the group came from a rebuild (DB types) or from new rows (Python types)
+    text = "\x1f".join("\x00" if value is None else str(value) for value in values)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def upsert_query(table, dialect):
+    columns = ["group_key"] + list(ROLLUPS[table]) + MEASURES
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+        + UPSERT_SUFFIX[dialect]
+    )
+
+
+def _group_rows(groups, dimensions):
+    rows = []
+    for record in groups.itertuples(index=False, name=None):
+        values = [_normalize(value) for value in record[:len(dimensions)]]
+        counts = [int(value) for value in record[len(dimensions):]]
+        rows.append(tuple([group_key(values)] + values + counts))
+    return rows
+
+
+def create_tables(cursor):
+    for table, dimensions in ROLLUPS.items():
+        cursor.execute(CREATE_ROLLUP_QUERY.format(
+            table=table,
+            dimensions=",\n        ".join(f"{name} {kind}" for name, kind in dimensions.items()),
+        ))
+
+
+def rebuild(cursor):
+    # One GROUP BY pass over traffic_stops per rollup
+    dialect = get_pool().backend.name
+    for table, dimensions in ROLLUPS.items():
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(REBUILD_SELECT_QUERY.format(dimensions=", ".join(dimensions)))
+        groups = pd.DataFrame(cursor.fetchall(), columns=list(dimensions) + MEASURES)
+        rows = _group_rows(groups, list(dimensions))
+        if rows:
+            cursor.executemany(upsert_query(table, dialect), rows)
+
+
+def _derive(frame):
+    # Build the rollup dimensions and flags for raw traffic_stops rows
+    frame = frame.copy()
+    if "stop_hour" not in frame:
+        frame["stop_hour"] = pd.to_numeric(frame["stop_time"].astype("string").str[:2], errors="coerce")
+    if "stop_day" not in frame:
+        frame["stop_day"] = frame["timestamp"].astype("string").str[:10]
+    frame["stops"] = 1
+    for measure, column in FLAG_COLUMNS.items():
+        frame[measure] = (pd.to_numeric(frame[column], errors="coerce").fillna(0) == 1).astype(int)
+    return frame
+
+
+_tables_ready = False
+
+
+def tables_ready(cursor):
+    global _tables_ready
+    if not _tables_ready:
+        try:
+            cursor.execute("SELECT 1 FROM rollup_violation_duration WHERE 1 = 0").fetchall()
+            _tables_ready = True
+        except Exception:
+            return False
+    return True
+
+
+def apply_frame(cursor, frame):
+    # Fold newly inserted rows into every rollup; call inside the INSERT's transaction
+    if frame.empty or not tables_ready(cursor):
+        return
+    dialect = get_pool().backend.name
+    frame = _derive(frame)
+    for table, dimensions in ROLLUPS.items():
+        groups = frame.groupby(list(dimensions), dropna=False, sort=False)[MEASURES].sum().reset_index()
+        cursor.executemany(upsert_query(table, dialect), _group_rows(groups, list(dimensions)))
+
+
+def apply_rows(cursor, rows):
+    apply_frame(cursor, pd.DataFrame(list(rows)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the SecureCheck rollup tables.")
+    parser.add_argument("--rebuild", action="store_true", help="recompute all rollups from traffic_stops")
+    parser.add_argument("--sqlite", metavar="PATH", help="use a SQLite file instead of MySQL")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    started = time.perf_counter()
+    with transaction() as cursor:
+        create_tables(cursor)
+        if args.rebuild:
+            rebuild(cursor)
+    invalidate_cache()
+    print(f"Rollups ready in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
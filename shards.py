@@ -0,0 +1,334 @@
+# Fan-out of the insight questions over several databases, e.g. one per check post or
+# per country, listed in a JSON file named by SECURECHECK_SHARDS:
+#
+#   [{"name": "India", "sqlite": "shards/india.db"},
+#    {"name": "USA", "mysql": {"host": "10.0.0.5", "user": "app", "password": "...", "database": "securecheck"}}]
+#
+#   python shards.py split securecheck.db --by country_name --dir shards   # SQLite shards for local testing
+#   python shards.py check securecheck.db --config shards/shards.json      # sharded answers == single database
+#
+# Shards never return rates or averages. Each one sends partial aggregates: its rollup
+# groups (stop, search, arrest and drug-stop sums), or per-vehicle counts for the vehicle
+# questions. The partials are loaded into an in-memory SQLite database and the question's
+# own SQL runs over them, so every rate and average is computed from the summed counts.
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+
+import pandas as pd
+
+import rollups
+from db_utils import (QUERY_TIMEOUT, ConnectionPool, MySQLBackend, SQLiteBackend, _run_query, configure_pool,
+                      query_data, query_metrics, stream_data, transaction)
+from insight_filters import FILTER_MARKER, apply_filters, filter_clause
+
+SHARDS_PATH = os.environ.get("SECURECHECK_SHARDS", "")
+SHARD_POOL_SIZE = int(os.environ.get("SECURECHECK_SHARD_POOL_SIZE", "2"))
+# Partials are reused for this long, so a report over many questions reads each rollup once
+SHARD_CACHE_SECONDS = float(os.environ.get("SECURECHECK_SHARD_CACHE_SECONDS", "30"))
+
+ROLLUP_PARTIAL_QUERY = """
+    SELECT {dimensions}, SUM(stops) AS stops, SUM(searches) AS searches,
+           SUM(arrests) AS arrests, SUM(drug_stops) AS drug_stops
+    FROM {table}
+    {where}
+    GROUP BY {dimensions}
+"""
+_ROLLUP_TABLE = re.compile(r"\bFROM\s+(rollup_\w+)", re.IGNORECASE)
+
+# Questions over raw traffic_stops: per-vehicle counts from every shard, ranked centrally
+VEHICLE_PLANS = {
+    "What are the top 10 vehicles involved in drug-related stops?": ("drugs_related_stop", "stop_count"),
+    "Which vehicles were most frequently searched?": ("search_conducted", "search_count"),
+}
+VEHICLE_PARTIAL_QUERY = """
+    SELECT vehicle_number, COUNT(*) AS {count}
+    FROM traffic_stops
+    WHERE {flag} = 1 AND vehicle_number IS NOT NULL AND vehicle_number != ''
+    /*and timestamp*/
+    GROUP BY vehicle_number
+"""
+VEHICLE_FINAL_QUERY = """
+    SELECT vehicle_number, CAST(SUM({count}) AS SIGNED) AS {count}
+    FROM vehicle_counts
+    GROUP BY vehicle_number
+    ORDER BY {count} DESC
+    LIMIT %s
+"""
+
+
+class Shard:
+    def __init__(self, name, backend, pool_size=SHARD_POOL_SIZE):
+        self.name = name
+        self.pool = ConnectionPool(backend, size=pool_size)
+
+
+def load_shards(path):
+    with open(path, encoding="utf-8") as config_file:
+        entries = json.load(config_file)
+    base = os.path.dirname(os.path.abspath(path))
+    shards = []
+    for entry in entries:
+        if "sqlite" in entry:
+            backend = SQLiteBackend(os.path.join(base, entry["sqlite"]))
+        else:
+            backend = MySQLBackend(**entry["mysql"])
+        shards.append(Shard(entry["name"], backend))
+    return shards
+
+
+def plan(question, values=None, filters=None):
+    # question: a query_catalog.Question
+    # -> ({central table: partial query run on every shard}, final query, final params)
+    values = question.values(values)
+    if question.title in VEHICLE_PLANS:
+        flag, count = VEHICLE_PLANS[question.title]
+        partial, params = apply_filters(VEHICLE_PARTIAL_QUERY.format(flag=flag, count=count), filters)
+        return {"vehicle_counts": (partial, params)}, VEHICLE_FINAL_QUERY.format(count=count), (values["top_n"],)
+    tables = sorted(set(_ROLLUP_TABLE.findall(question.sql)))
+    if not tables:
+        raise ValueError(f"No shard plan for {question.title!r}")
+    partials = {}
+    for table in tables:
+        dimensions = ", ".join(rollups.ROLLUPS[table])
+        where, params = _rollup_filter(question, table, filters)
+        partials[table] = (ROLLUP_PARTIAL_QUERY.format(dimensions=dimensions, table=table, where=where), params)
+    final, params = question.bind(values, filters)
+    return partials, final, params
+
+
+def _rollup_filter(question, table, filters):
+    # The question's own filters, narrowed to the ones the rollup has columns for, so each shard
+    # only sends the groups the final query keeps. The final query still applies all of them.
+    match = FILTER_MARKER.search(question.sql)
+    if match is None or not filters:
+        return "", None
+    dimensions = rollups.ROLLUPS[table]
+    date_column = match.group(2)
+    pushed = {}
+    if filters.get("countries") and "country_name" in dimensions:
+        pushed["countries"] = filters["countries"]
+    if date_column in dimensions:
+        pushed.update({key: filters[key] for key in ("start", "end") if filters.get(key)})
+    clause, params = filter_clause("where", date_column, pushed)
+    return clause, params or None
+
+
+class ShardSet:
+    def __init__(self, shards, cache_seconds=SHARD_CACHE_SECONDS):
+        self.shards = shards
+        self.cache_seconds = cache_seconds
+        self._partials = {}
+        self._lock = threading.Lock()
+
+    def _partial(self, shard, table, query, params, timeout):
+        key = (shard.name, query, params)
+        with self._lock:
+            cached = self._partials.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_seconds:
+            return cached[1]
+        timings = {}
+        started = time.perf_counter()
+        try:
+            frame = _run_query(query, params, timings, timeout, pool=shard.pool)
+        except Exception as e:
+            timings["total"] = time.perf_counter() - started
+            query_metrics.record("shards", f"{shard.name}: {table}", timings, error=e)
+            raise
+        timings["total"] = time.perf_counter() - started
+        query_metrics.record("shards", f"{shard.name}: {table}", timings, rows=timings["rows"],
+                             payload_bytes=timings["bytes"])
+        with self._lock:
+            self._partials[key] = (time.monotonic(), frame)
+        return frame
+
+    def answer(self, question, values=None, filters=None, timeout=QUERY_TIMEOUT):
+        # Runs the partials on every shard in parallel and the final query centrally. Shards
+        # that fail are left out and listed in result.attrs["missing_shards"].
+        partials, final, final_params = plan(question, values, filters)
+        frames = {table: [] for table in partials}
+        missing = {}
+        tasks = [(shard, table, partial, params) for shard in self.shards
+                 for table, (partial, params) in partials.items()]
+        with ThreadPoolExecutor(max_workers=max(len(tasks), 1), thread_name_prefix="securecheck-shard") as executor:
+            futures = {executor.submit(self._partial, shard, table, partial, params, timeout): (shard, table)
+                       for shard, table, partial, params in tasks}
+            for future in as_completed(futures):
+                shard, table = futures[future]
+                try:
+                    frames[table].append(future.result())
+                except Exception as e:
+                    missing[shard.name] = str(e)
+        result = combine(frames, final, final_params)
+        result.attrs["shards"] = len(self.shards) - len(missing)
+        if missing:
+            result.attrs["missing_shards"] = missing
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._partials.clear()
+
+
+def combine(frames, final, params=None):
+    # {table: [partial frames]} -> the final query's answer over their union
+    backend = SQLiteBackend(":memory:")
+    with closing(backend.connect()) as connection:
+        for table, parts in frames.items():
+            parts = [part for part in parts if not part.empty]
+            if not parts:
+                continue
+            merged = pd.concat(parts, ignore_index=True)
+            for column in merged.columns:
+                if column in rollups.MEASURES or column.endswith("_count"):
+                    # MySQL returns SUM() as Decimal, which SQLite cannot store
+                    merged[column] = pd.to_numeric(merged[column]).astype("int64")
+                elif merged[column].dtype == object:
+                    merged[column] = merged[column].map(lambda value: value if value is None or isinstance(value, (str, int, float)) else str(value))
+            merged.to_sql(table, connection, index=False)
+        with closing(connection.cursor()) as cursor:
+            try:
+                cursor.execute(backend.adapt_query(final), params or ())
+            except sqlite3.OperationalError as e:
+                # No shard sent any rows for a table the query reads; anything else is a real error
+                if "no such table" not in str(e):
+                    raise
+                return pd.DataFrame()
+            return pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
+
+
+def shard_notes(result):
+    # Page captions for a sharded answer; streamlit is only needed by the pages, not the CLI
+    import streamlit as st
+
+    if "shards" not in result.attrs:
+        return
+    st.caption(f"Merged from {result.attrs['shards']} shard(s).")
+    if result.attrs.get("missing_shards"):
+        st.warning("Partial answer, these shards did not respond: " + ", ".join(
+            f"{name} ({error})" for name, error in result.attrs["missing_shards"].items()))
+
+
+_shards = None
+_shards_lock = threading.Lock()
+
+
+def get_shards():
+    # None unless SECURECHECK_SHARDS names a shard list
+    global _shards
+    if not SHARDS_PATH:
+        return None
+    with _shards_lock:
+        if _shards is None:
+            _shards = ShardSet(load_shards(SHARDS_PATH))
+        return _shards
+
+
+def split(source, column, directory, log=print):
+    # One SQLite shard per distinct value of column, each migrated and with its own rollups
+    from ingest import INSERT_COLUMNS, INSERT_QUERY
+    from migrations import migrate
+
+    os.makedirs(directory, exist_ok=True)
+    configure_pool(SQLiteBackend(source), size=1)
+    values = query_data(f"SELECT DISTINCT {column} FROM traffic_stops ORDER BY {column}",
+                        use_cache=False)[column].tolist()
+    entries = []
+    for value in values:
+        if value is None or value != value:
+            # Rows without a value get a shard of their own rather than being dropped
+            value, where, params = None, f"{column} IS NULL", None
+        else:
+            where, params = f"{column} = %s", (value,)
+        name = re.sub(r"[^0-9A-Za-z]+", "_", str(value)).strip("_").lower() or "blank"
+        path = os.path.join(directory, f"{name}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        configure_pool(SQLiteBackend(source), size=1)
+        chunks = list(stream_data(f"SELECT {', '.join(INSERT_COLUMNS)} FROM traffic_stops WHERE {where} ORDER BY id",
+                                  params))
+        configure_pool(SQLiteBackend(path), size=1)
+        migrate(log=lambda message: None)
+        rows = 0
+        with transaction() as cursor:
+            for chunk in chunks:
+                records = [tuple(None if item != item else item for item in row)
+                           for row in chunk[INSERT_COLUMNS].astype(object).itertuples(index=False, name=None)]
+                cursor.executemany(INSERT_QUERY, records)
+                rows += len(records)
+            rollups.rebuild(cursor)
+        entries.append({"name": str(value), "sqlite": f"{name}.db"})
+        log(f"{value}: {rows:,} rows -> {path}")
+    config = os.path.join(directory, "shards.json")
+    with open(config, "w", encoding="utf-8") as config_file:
+        json.dump(entries, config_file, indent=2)
+    log(f"Wrote {config}")
+    return config
+
+
+def check(source, config, log=print):
+    # Every insight question over the shards against the same question on the source database
+    from query_catalog import CATALOG
+
+    shard_set = ShardSet(load_shards(config))
+    configure_pool(SQLiteBackend(source), size=2)
+    failures = 0
+    for question in CATALOG:
+        started = time.perf_counter()
+        sharded = shard_set.answer(question)
+        seconds = time.perf_counter() - started
+        expected = query_data(*question.bind(), use_cache=False)
+        same = _same_rows(sharded, expected, limited=re.search(r"\bLIMIT\b", question.sql, re.IGNORECASE) is not None)
+        failures += not same
+        log(f"{'ok  ' if same else 'DIFF'} {seconds * 1000:8.1f} ms  {question.title}")
+    return failures
+
+
+def _same_rows(left, right, limited=False):
+    if list(left.columns) != list(right.columns) or len(left) != len(right):
+        return False
+    if left.empty:
+        return True
+    # Ties may come back in any order, so rows are compared as sorted text
+    def rows(frame):
+        return sorted(tuple(str(value) for value in row) for row in frame.astype(object).itertuples(index=False))
+    if rows(left) == rows(right):
+        return True
+    if not limited:
+        return False
+    # Under LIMIT, rows tied with the last one kept are an arbitrary pick: the ranked values
+    # must match, and so must every row ranked above the tie
+    value = left.columns[-1]
+    if sorted(left[value].tolist()) != sorted(right[value].tolist()):
+        return False
+    cutoff = left[value].min()
+    return rows(left[left[value] > cutoff]) == rows(right[right[value] > cutoff])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a SQLite database into shards or check sharded answers.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    split_parser = commands.add_parser("split", help="write one SQLite shard per value of a column")
+    split_parser.add_argument("source")
+    split_parser.add_argument("--by", default="country_name")
+    split_parser.add_argument("--dir", default="shards")
+    check_parser = commands.add_parser("check", help="compare sharded answers with the source database")
+    check_parser.add_argument("source")
+    check_parser.add_argument("--config", default=os.path.join("shards", "shards.json"))
+    args = parser.parse_args(argv)
+
+    if args.command == "split":
+        split(args.source, args.by, args.dir)
+        return 0
+    return 1 if check(args.source, args.config) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
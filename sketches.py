@@ -0,0 +1,390 @@
+# Constant-memory sketches for the vehicle questions, whose exact GROUP BY vehicle_number
+# runs over an almost unique column. Per (country, month) bucket and flag we keep a
+# Space-Saving summary for the heaviest vehicles and a HyperLogLog for distinct vehicles.
+# Both merge, so any set of countries and months is answered by merging its buckets, and
+# every answer carries an error bound. Only the sketch state is kept, in memory and in
+# SKETCH_PATH: the flagged rows above its id high-water mark are folded in as they arrive,
+# so neither the app nor a restart needs the table itself. Sketches cannot subtract, so like
+# the table mirror they keep a checksum of the flagged rows at or below the mark (row count
+# and id sum), compared with the database now and then and after a load: deleted rows, or a
+# lower id committed after a higher one, make it differ and the sketches are rebuilt.
+#
+#   python sketches.py --sqlite securecheck.db     # rebuild the state file from the database
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from db_utils import query_data, stream_data
+
+# Vehicles tracked per summary; counts are over-estimated by at most the summary's floor,
+# which stays below (stops in the bucket) / TOPK_CAPACITY
+TOPK_CAPACITY = int(os.environ.get("SECURECHECK_SKETCH_CAPACITY", "256"))
+# 2**12 registers: about 1.6% standard error on distinct counts
+HLL_PRECISION = 12
+SKETCH_FLAGS = {"drug_stops": "drugs_related_stop", "searches": "search_conducted"}
+SKETCH_PATH = os.environ.get("SECURECHECK_SKETCH_PATH", "vehicle_sketches.npz")
+# New rows are looked for at most this often, and the state is written at most this often
+REFRESH_INTERVAL = float(os.environ.get("SECURECHECK_SKETCH_REFRESH_INTERVAL", "2.0"))
+SAVE_INTERVAL = float(os.environ.get("SECURECHECK_SKETCH_SAVE_INTERVAL", "300"))
+CHECKSUM_INTERVAL = float(os.environ.get("SECURECHECK_SKETCH_CHECKSUM_INTERVAL", "60"))
+FORMAT_VERSION = 2
+
+# Only stops with a sketched flag are read. The delta is bounded by the id read first, which
+# becomes the new high-water mark, so unflagged rows are not scanned again on the next refresh.
+MAX_ID_QUERY = "SELECT MAX(id) AS max_id FROM traffic_stops"
+_FLAGGED = " OR ".join(f"{column} = 1" for column in SKETCH_FLAGS.values())
+DELTA_QUERY = f"""
+    SELECT id, country_name, timestamp, vehicle_number, {", ".join(SKETCH_FLAGS.values())}
+    FROM traffic_stops
+    WHERE id > %s AND id <= %s AND ({_FLAGGED})
+    ORDER BY id
+"""
+CHECKSUM_QUERY = f"""
+    SELECT COUNT(*) AS row_count, SUM(id) AS id_sum
+    FROM traffic_stops
+    WHERE id <= %s AND ({_FLAGGED})
+"""
+
+
+class SpaceSaving:
+    # Mergeable Space-Saving summary. For a monitored item, count - error <= true count <= count;
+    # any item not monitored occurred at most `floor` times.
+    def __init__(self, capacity=TOPK_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+        self.total = 0
+
+    @classmethod
+    def from_counts(cls, counts, capacity=TOPK_CAPACITY):
+        # counts: Series item -> exact count. Keeps the largest; the rest bound the floor.
+        summary = cls(capacity)
+        counts = counts.sort_values(ascending=False, kind="stable")
+        kept = counts.iloc[:capacity]
+        summary.counts = {item: int(count) for item, count in kept.items()}
+        summary.errors = dict.fromkeys(summary.counts, 0)
+        summary.floor = int(counts.iloc[capacity]) if len(counts) > capacity else 0
+        summary.total = int(counts.sum())
+        return summary
+
+    def merge(self, other):
+        return SpaceSaving.merge_all([self, other], self.capacity)
+
+    @classmethod
+    def merge_all(cls, summaries, capacity=TOPK_CAPACITY):
+        # An item missing from a summary may still have occurred up to that summary's floor,
+        # so every item starts at the sum of floors and gains what it has above each floor
+        merged = cls(capacity)
+        floor = sum(summary.floor for summary in summaries)
+        counts = {}
+        errors = {}
+        for summary in summaries:
+            for item, count in summary.counts.items():
+                counts[item] = counts.get(item, floor) + count - summary.floor
+                errors[item] = errors.get(item, floor) + summary.errors[item] - summary.floor
+        ranked = sorted(counts, key=counts.get, reverse=True)
+        merged.counts = {item: counts[item] for item in ranked[:capacity]}
+        merged.errors = {item: errors[item] for item in ranked[:capacity]}
+        merged.floor = max(floor, counts[ranked[capacity]]) if len(ranked) > capacity else floor
+        merged.total = sum(summary.total for summary in summaries)
+        return merged
+
+    def top(self, k):
+        # [(item, count, error, guaranteed)]: guaranteed items are certainly in the true top k
+        ranked = sorted(self.counts.items(), key=lambda entry: (-entry[1], entry[0]))
+        threshold = max(ranked[k][1] if len(ranked) > k else 0, self.floor)
+        return [(item, count, self.errors[item], count - self.errors[item] >= threshold)
+                for item, count in ranked[:k]]
+
+
+def _hashes(values):
+    # Stable 64-bit hashes (same in every process), vectorized
+    return pd.util.hash_pandas_object(pd.Series(values, dtype=object), index=False).to_numpy(np.uint64)
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_many(self, values):
+        if len(values) == 0:
+            return
+        hashes = _hashes(values)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1 bit in the remaining 64 - p bits
+        bits = np.where(rest > 0, np.floor(np.log2(np.maximum(rest, 1).astype(np.float64))) + 1, 0)
+        rank = (64 - self.precision - bits + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        merged = HyperLogLog(self.precision)
+        merged.registers = np.maximum(self.registers, other.registers)
+        return merged
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class _Bucket:
+    __slots__ = ("topk", "distinct")
+
+    def __init__(self):
+        self.topk = {flag: SpaceSaving() for flag in SKETCH_FLAGS}
+        self.distinct = {flag: HyperLogLog() for flag in SKETCH_FLAGS}
+
+
+class VehicleSketches:
+    # add_frame() folds rows into their (country, month) buckets; refresh() reads the rows
+    # above high_water from the database and saves the state now and then
+    def __init__(self, path=SKETCH_PATH):
+        self.path = path
+        self.high_water = 0
+        self.row_count = 0
+        self.id_sum = 0
+        self.loaded = False
+        self.rebuilds = 0
+        self.last_error = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._last_save = time.monotonic()
+        self._last_checksum = 0.0
+        # A loaded state is checked on the first refresh: the database may have changed since
+        self._verify = True
+        self._unsaved = False
+
+    def _bucket(self, country, month):
+        key = (None if country != country else country, None if month != month else int(month))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        return bucket
+
+    def add_frame(self, frame):
+        plates = frame["vehicle_number"]
+        frame = frame[plates.notna() & (plates.astype("string").str.strip() != "")]
+        if frame.empty:
+            return
+        stamps = pd.to_datetime(frame["timestamp"], errors="coerce")
+        # Months as yyyymm integers; exact vehicle counts per (country, month) first, then merged in
+        keyed = pd.DataFrame({"country": frame["country_name"], "month": stamps.dt.year * 100 + stamps.dt.month,
+                              "vehicle_number": frame["vehicle_number"]})
+        with self._lock:
+            for flag, column in SKETCH_FLAGS.items():
+                rows = keyed[(pd.to_numeric(frame[column], errors="coerce") == 1).to_numpy()]
+                counts = rows.groupby(["country", "month", "vehicle_number"], dropna=False, sort=False).size()
+                for (country, month), vehicles in counts.groupby(level=[0, 1], dropna=False, sort=False):
+                    vehicles = vehicles.droplevel([0, 1])
+                    bucket = self._bucket(country, month)
+                    bucket.topk[flag] = bucket.topk[flag].merge(SpaceSaving.from_counts(vehicles))
+                    bucket.distinct[flag].add_many(vehicles.index.to_numpy(dtype=object))
+
+    def _checksum_matches(self):
+        row = query_data(CHECKSUM_QUERY, (self.high_water,), use_cache=False, page="sketches",
+                         label="checksum").iloc[0]
+        count = 0 if pd.isna(row["row_count"]) else int(row["row_count"])
+        total = 0 if pd.isna(row["id_sum"]) else int(row["id_sum"])
+        return count == self.row_count and total == self.id_sum
+
+    def _reset(self):
+        with self._lock:
+            self._buckets.clear()
+        self.high_water = 0
+        self.row_count = 0
+        self.id_sum = 0
+        self._unsaved = True
+
+    def refresh(self, force=False):
+        # Returns the number of new flagged rows. Errors are kept in last_error while there is
+        # state to answer from; the first load raises them.
+        if not force and self.loaded and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+            return 0
+        if not self._refresh_lock.acquire(blocking=force or not self.loaded):
+            return 0
+        try:
+            rows = 0
+            rebuilt = False
+            try:
+                now = time.monotonic()
+                if self._verify or now - self._last_checksum >= CHECKSUM_INTERVAL:
+                    if self.high_water and not self._checksum_matches():
+                        self.rebuilds += 1
+                        self._reset()
+                        rebuilt = True
+                    self._last_checksum = now
+                    self._verify = False
+                top = query_data(MAX_ID_QUERY, use_cache=False, page="sketches", label="max id")["max_id"].iloc[0]
+                top = self.high_water if pd.isna(top) else int(top)
+                if top > self.high_water:
+                    for chunk in stream_data(DELTA_QUERY, (self.high_water, top), page="sketches", label="delta"):
+                        # Advanced per chunk so a failed read resumes without counting rows twice
+                        self.add_frame(chunk)
+                        self.high_water = int(chunk["id"].max())
+                        self.row_count += len(chunk)
+                        self.id_sum += int(chunk["id"].sum())
+                        self._unsaved = True
+                        rows += len(chunk)
+                    self.high_water = top
+                    self._unsaved = True
+            except Exception as e:
+                self.last_error = str(e)
+                if not self.loaded:
+                    raise
+                return 0
+            first_load = not self.loaded
+            self.loaded = True
+            self.last_error = None
+            self._last_refresh = time.monotonic()
+            if self._unsaved and (first_load or rebuilt or time.monotonic() - self._last_save >= SAVE_INTERVAL):
+                try:
+                    self.save()
+                except OSError as e:
+                    self.last_error = f"Could not save {self.path}: {e}"
+            return rows
+        finally:
+            self._refresh_lock.release()
+
+    def save(self, path=None):
+        # Space-Saving summaries as JSON, HyperLogLog registers as one uint8 array
+        path = path or self.path
+        with self._lock:
+            keys = list(self._buckets)
+            state = {
+                "version": FORMAT_VERSION,
+                "high_water": self.high_water,
+                "row_count": self.row_count,
+                "id_sum": self.id_sum,
+                "buckets": [list(key) for key in keys],
+                "topk": [{flag: {"capacity": summary.capacity, "counts": summary.counts, "errors": summary.errors,
+                                 "floor": summary.floor, "total": summary.total}
+                          for flag, summary in self._buckets[key].topk.items()} for key in keys],
+            }
+            registers = np.array([[self._buckets[key].distinct[flag].registers for flag in SKETCH_FLAGS]
+                                  for key in keys], dtype=np.uint8).reshape(len(keys), len(SKETCH_FLAGS), -1)
+            self._unsaved = False
+            self._last_save = time.monotonic()
+        temporary = f"{path}.tmp.npz"
+        np.savez_compressed(temporary, state=np.array(json.dumps(state)), registers=registers)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=SKETCH_PATH):
+        sketches = cls(path)
+        with np.load(path, allow_pickle=False) as data:
+            state = json.loads(str(data["state"]))
+            if state["version"] != FORMAT_VERSION:
+                raise ValueError(f"{path} has format version {state['version']}, expected {FORMAT_VERSION}")
+            registers = data["registers"]
+        for position, (key, summaries) in enumerate(zip(state["buckets"], state["topk"])):
+            bucket = sketches._bucket(*key)
+            for slot, flag in enumerate(SKETCH_FLAGS):
+                summary = SpaceSaving(summaries[flag]["capacity"])
+                summary.counts = summaries[flag]["counts"]
+                summary.errors = summaries[flag]["errors"]
+                summary.floor = summaries[flag]["floor"]
+                summary.total = summaries[flag]["total"]
+                bucket.topk[flag] = summary
+                bucket.distinct[flag].registers = registers[position, slot].copy()
+        sketches.high_water = state["high_water"]
+        sketches.row_count = state["row_count"]
+        sketches.id_sum = state["id_sum"]
+        return sketches
+
+    def _selected(self, filters):
+        # Buckets for the filters; dates select whole months
+        countries = set(filters.get("countries") or []) if filters else set()
+        first = filters["start"].year * 100 + filters["start"].month if filters and filters.get("start") else None
+        last = filters["end"].year * 100 + filters["end"].month if filters and filters.get("end") else None
+        for (country, month), bucket in self._buckets.items():
+            if countries and country not in countries:
+                continue
+            if (first or last) and month is None:
+                continue
+            if (first and month < first) or (last and month > last):
+                continue
+            yield bucket
+
+    def estimate(self, flag, k=10, filters=None):
+        # Returns (top k as a DataFrame with error bounds, distinct vehicles, distinct error, stops)
+        distinct = HyperLogLog()
+        with self._lock:
+            buckets = list(self._selected(filters))
+            topk = SpaceSaving.merge_all([bucket.topk[flag] for bucket in buckets])
+            for bucket in buckets:
+                distinct = distinct.merge(bucket.distinct[flag])
+        top = pd.DataFrame(topk.top(k), columns=["vehicle_number", "count", "max_overcount", "guaranteed"])
+        vehicles = distinct.count()
+        return top, vehicles, int(math.ceil(vehicles * distinct.relative_error())), topk.total
+
+
+_sketches = None
+_sketches_lock = threading.Lock()
+
+
+def get_vehicle_sketches():
+    # Starts from the saved state when there is one (the first run builds it from the
+    # flagged rows), then catches up on the rows added since
+    global _sketches
+    with _sketches_lock:
+        if _sketches is None:
+            sketches = None
+            if os.path.exists(SKETCH_PATH):
+                try:
+                    sketches = VehicleSketches.load(SKETCH_PATH)
+                except (OSError, ValueError, KeyError) as e:
+                    sketches = VehicleSketches()
+                    sketches.last_error = f"Ignored {SKETCH_PATH}: {e}"
+            _sketches = sketches or VehicleSketches()
+    _sketches.refresh()
+    return _sketches
+
+
+def refresh_sketches():
+    # For writers: folds in new rows if anything has loaded the sketches, otherwise does nothing
+    sketches = _sketches
+    if sketches is not None and sketches.loaded:
+        sketches.refresh(force=True)
+
+
+def main(argv=None):
+    from db_utils import SQLiteBackend, configure_pool
+
+    parser = argparse.ArgumentParser(description="Rebuild the vehicle sketch state from traffic_stops.")
+    parser.add_argument("--sqlite", metavar="PATH", help="use a SQLite file instead of MySQL")
+    parser.add_argument("--output", default=SKETCH_PATH, help="state file to write")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    started = time.perf_counter()
+    sketches = VehicleSketches(args.output)
+    sketches.refresh(force=True)
+    sketches.save()
+    print(f"Sketched stops up to id {sketches.high_water:,} in {time.perf_counter() - started:.2f}s -> "
+          f"{args.output} ({os.path.getsize(args.output):,} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+# Local Arrow IPC snapshots of traffic_stops and the computed insight results.
+#
+#   python snapshots.py                  # snapshot the MySQL database now
+#   python snapshots.py --sqlite securecheck.db
+#
+# The app memory-maps the latest snapshot at startup and serves pages from it while
+# a background thread warms up the database; from then on pages read live data and
+# a new snapshot is written every SNAPSHOT_INTERVAL seconds when the data changed.
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from db_utils import SQLiteBackend, configure_pool, query_data, result_cache, stream_data
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # snapshots are optional; pages then always read the database
+    pa = None
+
+SNAPSHOT_DIR = os.environ.get("SECURECHECK_SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_INTERVAL = float(os.environ.get("SECURECHECK_SNAPSHOT_INTERVAL", "900"))
+SNAPSHOT_KEEP = 2
+# An unfinished snapshot nothing has written to for this long was left by a failed writer
+STALE_TEMPORARY_SECONDS = float(os.environ.get("SECURECHECK_SNAPSHOT_STALE_SECONDS", "3600"))
+MAX_RETRY_DELAY = 60.0
+LATEST_FILE = "LATEST"
+MANIFEST_FILE = "manifest.json"
+TABLE_FILE = "traffic_stops.arrow"
+
+# traffic_stops with its derived columns; dates stay text so MySQL and SQLite agree
+TABLE_COLUMNS = [
+    ("id", "int64"), ("stop_date", "string"), ("stop_time", "string"), ("country_name", "string"),
+    ("driver_gender", "string"), ("driver_age_raw", "int64"), ("driver_age", "int64"),
+    ("driver_race", "string"), ("violation_raw", "string"), ("violation", "string"),
+    ("search_conducted", "int64"), ("search_type", "string"), ("stop_outcome", "string"),
+    ("is_arrested", "int64"), ("stop_duration", "string"), ("drugs_related_stop", "int64"),
+    ("vehicle_number", "string"), ("timestamp", "timestamp"), ("stop_hour", "int64"),
+    ("stop_day", "string"), ("age_group", "string"),
+]
+TABLE_QUERY = f"SELECT {', '.join(name for name, _ in TABLE_COLUMNS)} FROM traffic_stops ORDER BY id"
+
+
+def _table_schema():
+    types = {"int64": pa.int64(), "string": pa.string(), "timestamp": pa.timestamp("s")}
+    return pa.schema([(name, types[kind]) for name, kind in TABLE_COLUMNS])
+
+
+def _table_batch(chunk, schema):
+    chunk = chunk.copy()
+    for name, kind in TABLE_COLUMNS:
+        if kind == "timestamp":
+            chunk[name] = pd.to_datetime(chunk[name], errors="coerce")
+        elif kind == "string":
+            chunk[name] = chunk[name].map(lambda value: None if value is None or value != value else str(value))
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def snapshot_queries():
+    # "page/label" -> (query, params) for every result the pages can be served from,
+    # with the catalog's default parameters. Imported here: the page modules import this one.
+    import home
+    from query_catalog import CATALOG
+
+    queries = {"home/dashboard metrics": (home.METRICS_QUERY, None)}
+    queries.update({f"{question.page}/{question.title}": question.bind() for question in CATALOG})
+    return queries
+
+
+def _table_version(version):
+    # (row count, max id): the cache's leading generation counter is local to one process
+    return tuple(version[1:])
+
+
+def _result_file(key):
+    return f"result-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.arrow"
+
+
+def _write_arrow(table, path):
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def write_snapshot(directory=SNAPSHOT_DIR, log=print):
+    # Written to a temporary directory, then published by rewriting the LATEST pointer
+    if pa is None:
+        raise RuntimeError("pyarrow is required for snapshots")
+    started = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    version = result_cache.data_version()
+    name = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, name)
+    temporary = path + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+
+    try:
+        # The table is streamed to disk one chunk at a time
+        schema = _table_schema()
+        rows = 0
+        with pa.OSFile(os.path.join(temporary, TABLE_FILE), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for chunk in stream_data(TABLE_QUERY, page="snapshot", label="traffic_stops"):
+                writer.write_table(_table_batch(chunk, schema))
+                rows += len(chunk)
+
+        results = {}
+        for key, (query, params) in snapshot_queries().items():
+            frame = query_data(query, params, page="snapshot", label=key, prepared=True)
+            _write_arrow(pa.Table.from_pandas(frame, preserve_index=False), os.path.join(temporary, _result_file(key)))
+            results[key] = _result_file(key)
+
+        manifest = {
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "data_version": list(_table_version(version)),
+            "rows": rows,
+            "table": TABLE_FILE,
+            "results": results,
+        }
+        with open(os.path.join(temporary, MANIFEST_FILE), "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(temporary, path)
+    except BaseException:
+        # Also on Ctrl-C in the CLI; what a killed process leaves behind goes in the sweep below
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(directory, LATEST_FILE)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as latest:
+        latest.write(name)
+    os.replace(pointer + ".tmp", pointer)
+
+    _sweep(directory)
+    log(f"Wrote snapshot {path} ({rows:,} rows, {len(results)} results) in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+def _last_modified(path):
+    # Newest mtime of a directory and the files in it: a snapshot being written keeps growing
+    times = [os.path.getmtime(path)]
+    for entry in os.scandir(path):
+        try:
+            times.append(entry.stat().st_mtime)
+        except OSError:
+            pass
+    return max(times)
+
+
+def _sweep(directory):
+    # Older snapshots may still be memory-mapped by a running server; only the oldest go.
+    # Temporary directories are only removed once nothing has written to them for
+    # STALE_TEMPORARY_SECONDS, since another process may still be writing its snapshot.
+    entries = [entry for entry in os.listdir(directory) if os.path.isdir(os.path.join(directory, entry))]
+    snapshots = sorted(entry for entry in entries if not entry.endswith(".tmp"))
+    for old in snapshots[:-SNAPSHOT_KEEP]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    for entry in entries:
+        temporary = os.path.join(directory, entry)
+        try:
+            stale = entry.endswith(".tmp") and time.time() - _last_modified(temporary) > STALE_TEMPORARY_SECONDS
+        except OSError:
+            # Finished or removed by its writer meanwhile
+            continue
+        if stale:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.created_at = self.manifest["created_at"]
+        self.data_version = tuple(self.manifest["data_version"])
+        self._table = None
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _read(self, name):
+        # Memory-mapped: record batches point straight into the page cache
+        return pa.ipc.open_file(pa.memory_map(os.path.join(self.path, name), "r")).read_all()
+
+    def table(self):
+        with self._lock:
+            if self._table is None:
+                self._table = self._read(self.manifest["table"])
+            return self._table
+
+    def has_result(self, key):
+        return key in self.manifest["results"]
+
+    def result(self, key):
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = self._read(self.manifest["results"][key]).to_pandas()
+            return self._results[key].copy()
+
+    def chunks(self, columns=None, chunk_size=50000):
+        table = self.table()
+        if columns is not None:
+            table = table.select(columns)
+        for batch in table.to_batches(max_chunksize=chunk_size):
+            yield batch.to_pandas()
+
+    def head(self, rows):
+        # Rows are stored in id order
+        return self.table().slice(0, rows).to_pandas()
+
+
+def latest_snapshot(directory=SNAPSHOT_DIR):
+    if pa is None:
+        return None
+    try:
+        with open(os.path.join(directory, LATEST_FILE), encoding="utf-8") as latest:
+            return Snapshot(os.path.join(directory, latest.read().strip()))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class WarmStart:
+    # Serves the latest snapshot until the database has answered every snapshot query
+    # once (which also fills the result cache), then keeps snapshots fresh.
+    def __init__(self, directory=SNAPSHOT_DIR, interval=SNAPSHOT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.snapshot = latest_snapshot(directory)
+        self.live = self.snapshot is None
+        self.last_error = None
+        self._snapshot_version = self.snapshot.data_version if self.snapshot else None
+        self._thread = threading.Thread(target=self._run, name="securecheck-snapshots", daemon=True)
+        self._thread.start()
+
+    def serving(self):
+        return None if self.live else self.snapshot
+
+    def _catch_up(self):
+        import table_mirror
+
+        for key, (query, params) in snapshot_queries().items():
+            page, label = key.split("/", 1)
+            query_data(query, params, page=page, label=label, prepared=True)
+        self.live = True
+        # A mirror loaded from the snapshot checks it against the database and catches up
+        table_mirror.refresh_mirror()
+
+    def _run(self):
+        delay = 1.0
+        while not self.live:
+            try:
+                self._catch_up()
+            except Exception as e:
+                self.last_error = str(e)
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        if pa is None:
+            return
+        while True:
+            try:
+                version = _table_version(result_cache.data_version())
+                if version != self._snapshot_version:
+                    write_snapshot(self.directory, log=lambda message: None)
+                    self._snapshot_version = version
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            time.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "serving_snapshot": not self.live,
+            "snapshot": None if self.snapshot is None else self.snapshot.path,
+            "snapshot_created_at": None if self.snapshot is None else self.snapshot.created_at,
+            "last_error": self.last_error,
+        }
+
+
+_warm_start = None
+_warm_start_lock = threading.Lock()
+
+
+def get_warm_start():
+    global _warm_start
+    with _warm_start_lock:
+        if _warm_start is None:
+            _warm_start = WarmStart()
+        return _warm_start
+
+
+def serving_snapshot():
+    # The snapshot pages should answer from; None once the database is live, or when
+    # warm start was never started (CLIs and the benchmark always read the database)
+    warm_start = _warm_start
+    return None if warm_start is None else warm_start.serving()
+
+
+def snapshot_result(page, label):
+    snapshot = serving_snapshot()
+    key = f"{page}/{label}"
+    if snapshot is None or not snapshot.has_result(key):
+        return None
+    return snapshot.result(key)
+
+
+def data_version():
+    # Cache key for derived artefacts; probing the database is what a cold start avoids
+    snapshot = serving_snapshot()
+    if snapshot is not None:
+        return ("snapshot", snapshot.created_at)
+    return result_cache.data_version()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a SecureCheck snapshot.")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="snapshot directory")
+    parser.add_argument("--sqlite", metavar="PATH", help="snapshot a SQLite file instead of MySQL")
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        configure_pool(SQLiteBackend(args.sqlite), size=1)
+    os.makedirs(args.dir, exist_ok=True)
+    write_snapshot(args.dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
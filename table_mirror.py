@@ -0,0 +1,183 @@
+# Shared in-process mirror of traffic_stops. ids are AUTO_INCREMENT, so a refresh only
+# fetches rows above the high-water mark, appends them to the columnar buffers and hands
+# the same delta to every subscriber (predictor, vehicle index, Home counters).
+# A checksum of everything at or below the mark (row count and id sum) is compared with
+# the database now and then; only a mismatch (deleted or re-inserted rows) re-reads it all.
+import os
+import threading
+import time
+
+from columnar import LOAD_COLUMNS, LOAD_QUERY, ColumnarTable
+from db_utils import query_data, stream_data
+from snapshots import serving_snapshot
+
+# Pages refresh at most this often; the log writer refreshes after every flush
+REFRESH_INTERVAL = float(os.environ.get("SECURECHECK_MIRROR_REFRESH_INTERVAL", "2.0"))
+CHECKSUM_INTERVAL = float(os.environ.get("SECURECHECK_MIRROR_CHECKSUM_INTERVAL", "60"))
+
+DELTA_QUERY = f"{LOAD_QUERY} WHERE id > %s ORDER BY id"
+CHECKSUM_QUERY = "SELECT COUNT(*) AS row_count, SUM(id) AS id_sum FROM traffic_stops WHERE id <= %s"
+
+
+def _as_int(value):
+    if value is None or value != value:
+        return 0
+    return int(value)
+
+
+class TableMirror:
+    # Subscribers are objects with add_frame(frame), called with each delta, and clear(),
+    # called before a full re-sync delivers the whole table again.
+    def __init__(self):
+        self.table = ColumnarTable.from_chunks([])
+        self.high_water = 0
+        self.loaded = False
+        self._id_sum = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._last_refresh = 0.0
+        self._last_checksum = 0.0
+        # Set after loading from a snapshot: the database may have moved on since
+        self._verify = False
+        self.deltas = 0
+        self.delta_rows = 0
+        self.resyncs = 0
+        self.last_refresh_ms = None
+        self.last_error = None
+
+    def subscribe(self, subscriber, replay_rows=None):
+        # Rows already mirrored are replayed from the columnar buffers, so the subscriber
+        # lines up with the high-water mark without another read of the table.
+        # replay_rows(table) can pick the rows worth replaying (a boolean mask).
+        with self._lock:
+            if self.table.length:
+                rows = None if replay_rows is None else replay_rows(self.table)
+                if rows is None or rows.any():
+                    subscriber.add_frame(self.table.to_frame(rows))
+            self._subscribers.append(subscriber)
+
+    def _deliver(self, chunks):
+        # Hands each chunk to the subscribers as it streams in, then adds all of them to the
+        # table in one build: appending chunk by chunk would re-copy every earlier chunk
+        delivered = []
+
+        def passed_on():
+            for frame in chunks:
+                if frame.empty:
+                    continue
+                self.high_water = max(self.high_water, int(frame["id"].max()))
+                self._id_sum += int(frame["id"].sum())
+                for subscriber in self._subscribers:
+                    subscriber.add_frame(frame)
+                delivered.append(len(frame))
+                yield frame
+
+        if self.table.length:
+            self.table = self.table.appended(passed_on())
+        else:
+            self.table = ColumnarTable.from_chunks(passed_on())
+        return sum(delivered)
+
+    def _fetch_delta(self):
+        return self._deliver(stream_data(DELTA_QUERY, (self.high_water,), page="table_mirror", label="delta"))
+
+    def _checksum_matches(self):
+        result = query_data(CHECKSUM_QUERY, (self.high_water,), use_cache=False,
+                            page="table_mirror", label="checksum")
+        row = result.iloc[0]
+        return _as_int(row["row_count"]) == self.table.length and _as_int(row["id_sum"]) == self._id_sum
+
+    def _resync(self, chunks):
+        self.table = ColumnarTable.from_chunks([])
+        self.high_water = 0
+        self._id_sum = 0
+        for subscriber in self._subscribers:
+            subscriber.clear()
+        self._deliver(chunks)
+
+    def _load_snapshot(self, snapshot):
+        self._resync(snapshot.chunks(LOAD_COLUMNS))
+        self.loaded = True
+        self._verify = True
+
+    def refresh(self, force=False):
+        # Returns the number of new rows. Errors are kept in last_error while there is
+        # mirrored data to serve; the first load raises them.
+        if not force and self.loaded and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+            return 0
+        if not self._lock.acquire(blocking=force or not self.loaded):
+            # Another session is refreshing; its rows arrive soon enough
+            return 0
+        try:
+            started = time.perf_counter()
+            snapshot = serving_snapshot()
+            if snapshot is not None:
+                # The database is still warming up; the snapshot is all there is for now
+                if not self.loaded:
+                    self._load_snapshot(snapshot)
+                return 0
+            try:
+                now = time.monotonic()
+                if self.loaded and (self._verify or now - self._last_checksum >= CHECKSUM_INTERVAL):
+                    if not self._checksum_matches():
+                        self.resyncs += 1
+                        self._resync(stream_data(DELTA_QUERY, (0,), page="table_mirror", label="full resync"))
+                    self._last_checksum = now
+                    self._verify = False
+                elif not self.loaded:
+                    self._last_checksum = now
+                rows = self._fetch_delta()
+            except Exception as e:
+                self.last_error = str(e)
+                if not self.loaded:
+                    raise
+                return 0
+            self.loaded = True
+            self.last_error = None
+            self._last_refresh = time.monotonic()
+            self.deltas += 1
+            self.delta_rows += rows
+            self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 3)
+            return rows
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "rows": self.table.length,
+            "high_water": self.high_water,
+            "bytes": self.table.nbytes(),
+            "subscribers": len(self._subscribers),
+            "refreshes": self.deltas,
+            "delta_rows": self.delta_rows,
+            "resyncs": self.resyncs,
+            "last_refresh_ms": self.last_refresh_ms,
+            "last_error": self.last_error,
+        }
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_table_mirror():
+    # Created empty; the first refresh() loads it
+    global _mirror
+    with _mirror_lock:
+        if _mirror is None:
+            _mirror = TableMirror()
+        return _mirror
+
+
+def refresh_mirror(force=True):
+    # For writers: picks up new rows if anything has loaded the mirror, otherwise does nothing
+    mirror = _mirror
+    if mirror is not None and mirror.loaded:
+        mirror.refresh(force=force)
+
+
+def get_columnar_table():
+    mirror = get_table_mirror()
+    mirror.refresh()
+    return mirror.table
@@ -0,0 +1,272 @@
+import bisect
+import json
+import os
+import re
+import threading
+from collections import deque
+
+from table_mirror import get_table_mirror
+
+WATCHLIST_PATH = os.environ.get("SECURECHECK_WATCHLIST", "watchlist.json")
+# Most recent stops kept in memory per vehicle; counts always cover every stop
+HISTORY_LIMIT = int(os.environ.get("SECURECHECK_VEHICLE_HISTORY", "25"))
+SEARCH_LIMIT = 20
+# Fill values written by the data prep notebook and ingest.py, not real plates
+IGNORED_PLATES = {"", "UNKONWN", "UNKNOWN", "NONE", "NAN"}
+HISTORY_COLUMNS = ["id", "timestamp", "country_name", "violation", "stop_outcome",
+                   "search_conducted", "drugs_related_stop", "is_arrested"]
+
+_NOT_PLATE = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_plate(value):
+    # "tn-01 ab 1234" and "TN01AB1234" are the same vehicle
+    if value is None or value != value:
+        return ""
+    return _NOT_PLATE.sub("", str(value).upper())
+
+
+def _trigrams(plate):
+    return {plate[i:i + 3] for i in range(len(plate) - 2)}
+
+
+def _flag(value):
+    if value is None or value != value:
+        return 0
+    return int(bool(int(value)))
+
+
+def _timestamp_text(value):
+    if value is None or value != value:
+        return None
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)[:19]
+
+
+class _Vehicle:
+    __slots__ = ("plate", "display", "stops", "searches", "drug_stops", "arrests", "last_seen", "history")
+
+    def __init__(self, plate, display):
+        self.plate = plate
+        self.display = display
+        self.stops = 0
+        self.searches = 0
+        self.drug_stops = 0
+        self.arrests = 0
+        self.last_seen = None
+        self.history = deque(maxlen=HISTORY_LIMIT)
+
+    def add(self, stop):
+        self.stops += 1
+        self.searches += stop["search_conducted"]
+        self.drug_stops += stop["drugs_related_stop"]
+        self.arrests += stop["is_arrested"]
+        if stop["timestamp"] is not None and (self.last_seen is None or stop["timestamp"] > self.last_seen):
+            self.last_seen = stop["timestamp"]
+        self.history.append(stop)
+
+    def summary(self, with_history=False):
+        result = {
+            "vehicle_number": self.display,
+            "plate": self.plate,
+            "stops": self.stops,
+            "searches": self.searches,
+            "drug_stops": self.drug_stops,
+            "arrests": self.arrests,
+            "last_seen": self.last_seen,
+        }
+        if with_history:
+            # Newest first
+            result["history"] = sorted(self.history, key=lambda stop: stop["timestamp"] or "", reverse=True)
+        return result
+
+
+class VehicleIndex:
+    # Normalized plate -> per-vehicle counters and recent stops. A sorted plate list
+    # serves prefix lookups with bisect and a trigram map serves partial plates, so no
+    # lookup scans all vehicles. New stops arrive as deltas through add_frame(), never a rescan.
+    def __init__(self):
+        self._vehicles = {}
+        self._sorted = []
+        self._trigrams = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stop(row):
+        return {
+            "id": None if row.get("id") is None or row.get("id") != row.get("id") else int(row["id"]),
+            "timestamp": _timestamp_text(row.get("timestamp")),
+            "country_name": row.get("country_name"),
+            "violation": row.get("violation"),
+            "stop_outcome": row.get("stop_outcome"),
+            "search_conducted": _flag(row.get("search_conducted")),
+            "drugs_related_stop": _flag(row.get("drugs_related_stop")),
+            "is_arrested": _flag(row.get("is_arrested")),
+        }
+
+    def load_chunks(self, chunks):
+        # chunks: DataFrames with vehicle_number and HISTORY_COLUMNS; the sorted list is built once at the end
+        with self._lock:
+            new_plates = []
+            for chunk in chunks:
+                for row in chunk.to_dict("records"):
+                    plate = normalize_plate(row["vehicle_number"])
+                    if plate in IGNORED_PLATES:
+                        continue
+                    vehicle = self._vehicles.get(plate)
+                    if vehicle is None:
+                        vehicle = self._vehicles[plate] = _Vehicle(plate, str(row["vehicle_number"]).strip())
+                        new_plates.append(plate)
+                    vehicle.add(self._stop(row))
+            for plate in new_plates:
+                for trigram in _trigrams(plate):
+                    self._trigrams.setdefault(trigram, set()).add(plate)
+            if len(new_plates) * 20 < len(self._sorted):
+                # Small deltas: inserting beats re-sorting every plate
+                for plate in new_plates:
+                    bisect.insort(self._sorted, plate)
+            else:
+                self._sorted = sorted(self._vehicles)
+
+    def add_frame(self, frame):
+        # Rows delivered by the table mirror
+        self.load_chunks([frame])
+
+    def clear(self):
+        with self._lock:
+            self._vehicles.clear()
+            self._sorted = []
+            self._trigrams.clear()
+
+    def lookup(self, vehicle_number, with_history=True):
+        plate = normalize_plate(vehicle_number)
+        with self._lock:
+            vehicle = self._vehicles.get(plate)
+            return None if vehicle is None else vehicle.summary(with_history)
+
+    def prefix(self, text, limit=SEARCH_LIMIT):
+        plate = normalize_plate(text)
+        if not plate:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._sorted, plate)
+            matches = []
+            for candidate in self._sorted[start:start + limit]:
+                if not candidate.startswith(plate):
+                    break
+                matches.append(candidate)
+            return [self._vehicles[match].summary() for match in matches]
+
+    def partial(self, text, limit=SEARCH_LIMIT):
+        # Plates containing text anywhere: intersect trigram postings, rarest first
+        plate = normalize_plate(text)
+        if len(plate) < 3:
+            return self.prefix(plate, limit)
+        with self._lock:
+            postings = sorted((self._trigrams.get(trigram, set()) for trigram in _trigrams(plate)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            matches = sorted(candidate for candidate in candidates if plate in candidate)[:limit]
+            return [self._vehicles[match].summary() for match in matches]
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        # Exact match first, then prefix matches, then plates that contain the text
+        results = []
+        seen = set()
+        exact = self.lookup(text, with_history=False)
+        for match in ([exact] if exact else []) + self.prefix(text, limit) + self.partial(text, limit):
+            if match["plate"] not in seen:
+                seen.add(match["plate"])
+                results.append(match)
+        return results[:limit]
+
+    def __len__(self):
+        return len(self._vehicles)
+
+
+class Watchlist:
+    # Plates of interest kept in a small JSON file: [{"plate": ..., "reason": ..., "prefix": false}]
+    def __init__(self, path=WATCHLIST_PATH):
+        self.path = path
+        self._exact = {}
+        self._prefixes = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as watchlist_file:
+            for entry in json.load(watchlist_file):
+                self._put(entry)
+
+    def _put(self, entry):
+        plate = normalize_plate(entry.get("plate"))
+        if not plate:
+            raise ValueError("Watchlist entries need a plate")
+        entry = {"plate": plate, "reason": entry.get("reason", ""), "prefix": bool(entry.get("prefix", False))}
+        target = self._prefixes if entry["prefix"] else self._exact
+        target[plate] = entry
+        return entry
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as watchlist_file:
+            json.dump(self._entries(), watchlist_file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _entries(self):
+        return sorted(list(self._exact.values()) + list(self._prefixes.values()), key=lambda entry: entry["plate"])
+
+    def entries(self):
+        with self._lock:
+            return self._entries()
+
+    def add(self, plate, reason="", prefix=False):
+        with self._lock:
+            entry = self._put({"plate": plate, "reason": reason, "prefix": prefix})
+            self._save()
+            return entry
+
+    def remove(self, plate):
+        plate = normalize_plate(plate)
+        with self._lock:
+            removed = self._exact.pop(plate, None) or self._prefixes.pop(plate, None)
+            if removed:
+                self._save()
+            return removed
+
+    def match(self, vehicle_number):
+        # Exact entry plus every prefix entry the plate starts with: O(plate length)
+        plate = normalize_plate(vehicle_number)
+        if not plate:
+            return []
+        with self._lock:
+            hits = [self._exact[plate]] if plate in self._exact else []
+            hits.extend(self._prefixes[plate[:end]] for end in range(1, len(plate) + 1) if plate[:end] in self._prefixes)
+            return hits
+
+
+_index = None
+_watchlist = None
+_lock = threading.Lock()
+
+
+def get_vehicle_index():
+    # Fed by the table mirror: the rows it already holds, then every new delta
+    global _index
+    mirror = get_table_mirror()
+    with _lock:
+        if _index is None:
+            _index = VehicleIndex()
+            mirror.subscribe(_index)
+    mirror.refresh()
+    return _index
+
+
+def get_watchlist():
+    global _watchlist
+    with _lock:
+        if _watchlist is None:
+            _watchlist = Watchlist()
+        return _watchlist
@@ -0,0 +1,58 @@
+import streamlit as st
+import pandas as pd
+from vehicle_index import get_vehicle_index, get_watchlist
+
+
+def show_vehicle_lookup():
+    st.title("🚘 Suspect Vehicle Lookup")
+
+    index = get_vehicle_index()
+    watchlist = get_watchlist()
+
+    query = st.text_input("Vehicle Number", placeholder="Full plate, prefix or any part of it")
+
+    if query:
+        matches = index.search(query)
+        if not matches:
+            st.warning("No vehicles found.")
+        else:
+            st.subheader("📊 Matching Vehicles")
+            st.dataframe(pd.DataFrame(matches).drop(columns=["plate"]))
+
+            selected = st.selectbox("Vehicle Details", [match["vehicle_number"] for match in matches])
+            details = index.lookup(selected)
+
+            for hit in watchlist.match(selected):
+                st.error(f"🚨 On watchlist ({hit['plate']}{'*' if hit['prefix'] else ''}): {hit['reason'] or 'no reason given'}")
+
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Stops", details["stops"])
+            col2.metric("Searches", details["searches"])
+            col3.metric("Drug-Related", details["drug_stops"])
+            col4.metric("Arrests", details["arrests"])
+            st.caption(f"Last seen: {details['last_seen'] or 'unknown'}")
+
+            st.subheader("🧾 Recent Stops")
+            st.dataframe(pd.DataFrame(details["history"]))
+
+    st.markdown("---")
+    st.subheader("🚨 Watchlist")
+    with st.form("watchlist_form", clear_on_submit=True):
+        plate = st.text_input("Plate")
+        reason = st.text_input("Reason")
+        prefix = st.checkbox("Match every plate starting with this")
+        if st.form_submit_button("Add to Watchlist") and plate:
+            try:
+                watchlist.add(plate, reason, prefix)
+            except ValueError as e:
+                st.error(str(e))
+
+    entries = watchlist.entries()
+    if entries:
+        st.dataframe(pd.DataFrame(entries))
+        to_remove = st.selectbox("Remove Entry", [entry["plate"] for entry in entries])
+        if st.button("Remove"):
+            watchlist.remove(to_remove)
+            st.rerun()
+    else:
+        st.info("The watchlist is empty.")